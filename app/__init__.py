@@ -1,9 +1,11 @@
+import hmac
 import os
-from flask import Flask
-from flask_cors import CORS
-import cloudinary
+from flask import Flask, abort, request
 
 def create_app(config_name='development'):
+    # Los módulos pesados se importan aquí y no al importar el paquete
+    from flask_cors import CORS
+    import cloudinary
 
     app = Flask(__name__)
 
@@ -11,21 +13,75 @@ def create_app(config_name='development'):
     from app.config import config
     app.config.from_object(config[config_name])
 
+    if app.config['TRUSTED_PROXIES']:
+        # La IP del cliente es la que agregó el primer proxy de confianza, no la que dice el cliente
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
 
-    CORS(app)
+
+    # Cabeceras que los clientes (subidas reanudables, control de carga) necesitan leer
+    CORS(app, expose_headers=['Location', 'Upload-Offset', 'Upload-Length', 'Tus-Resumable', 'Retry-After', 'X-Coalesced'])
 
 
     cloudinary.config(
         cloud_name=app.config['CLOUDINARY_CLOUD_NAME'],
         api_key=app.config['CLOUDINARY_API_KEY'],
-        api_secret=app.config['CLOUDINARY_API_SECRET']
+        api_secret=app.config['CLOUDINARY_API_SECRET'],
+        upload_prefix=app.config['CLOUDINARY_UPLOAD_PREFIX']
     )
 
 
+    from app.utils.metrics import init_metrics
+    init_metrics(app)
+
+    # Antes que cualquier componente que guarde estado (reportes, subidas, archivos)
+    from app.utils.state import init_state
+    init_state(app)
+
+
+    from app.utils.cpu_topology import apply_worker_layout, init_cpu_topology
+    cpu_topology = init_cpu_topology(app)
+
+
+    from app.utils.models import preload_modules, registry
+    if app.config['PRELOAD_MODELS']:
+        preload_modules()
+
+
+    from app.utils.scheduler import init_scheduler
+    scheduler = init_scheduler(app)
+
+    # Con gunicorn se vuelve a aplicar en post_fork con el número real de workers
+    apply_worker_layout(app, workers=int(os.getenv('WEB_CONCURRENCY', 1)))
+
+
+    from app.utils.report_cache import init_report_cache
+    init_report_cache(app)
+
+    from app.utils.encoding import init_encoding
+    init_encoding(app)
+
+    from app.utils.upload_manager import init_upload_manager
+    init_upload_manager(app)
+
+    from app.utils.storage import init_storage
+    init_storage(app)
+
+    from app.utils.coalescing import init_coalescing
+    init_coalescing(app)
+
+    from app.utils.history import init_history
+    init_history(app)
+
+
     from app.modules.analisis_ergonomico.routes import analisis_ergonomico_bp
     from app.modules.analisis_postural.routes import analisis_postural_bp
+    from app.modules.historial.routes import historial_bp
+    from app.modules.reevaluacion.routes import reevaluacion_bp
     app.register_blueprint(analisis_ergonomico_bp, url_prefix='/api/analisis-ergonomico')
     app.register_blueprint(analisis_postural_bp, url_prefix='/api/analisis-postural')
+    app.register_blueprint(historial_bp, url_prefix='/api/historial')
+    app.register_blueprint(reevaluacion_bp, url_prefix='/api/reevaluacion')
 
     @app.route('/')
     def index():
@@ -33,11 +89,35 @@ def create_app(config_name='development'):
             'message': 'API de Análisis Postural',
             'status': 'running',
             'version': '1.0.0',
-            'modules': ['analisis-ergonomico', 'analisis-postural']
+            'modules': ['analisis-ergonomico', 'analisis-postural', 'historial', 'reevaluacion']
         }
 
     @app.route('/health')
     def health():
         return {'status': 'healthy'}, 200
 
+    @app.route('/ready')
+    def ready():
+        # El calentamiento se inicia en post_fork (gunicorn.conf.py) o en la primera consulta
+        if not registry.ready:
+            registry.start_warmup()
+        status = registry.status()
+        return status, 200 if status['ready'] else 503
+
+    def internal_allowed():
+        token = app.config['INTERNAL_TOKEN']
+        return bool(token) and hmac.compare_digest(request.headers.get('X-Internal-Token', ''), token)
+
+    @app.route('/scheduler')
+    def scheduler_stats():
+        if not internal_allowed():
+            abort(404)
+        return scheduler.stats(), 200
+
+    @app.route('/cpu')
+    def cpu_layout():
+        if not internal_allowed():
+            abort(404)
+        return cpu_topology.layout, 200
+
     return app
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,9 +12,16 @@ class Config:
     CLOUDINARY_CLOUD_NAME = os.getenv('CLOUDINARY_CLOUD_NAME')
     CLOUDINARY_API_KEY = os.getenv('CLOUDINARY_API_KEY')
     CLOUDINARY_API_SECRET = os.getenv('CLOUDINARY_API_SECRET')
+    CLOUDINARY_UPLOAD_PREFIX = os.getenv('CLOUDINARY_UPLOAD_PREFIX')  # Permite apuntar a un servidor local
 
     # OpenAI
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+    OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 90))  # límite de cada llamada en segundo plano
+    OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 8))
+    REPORT_DEADLINE = float(os.getenv('REPORT_DEADLINE', 20))  # presupuesto total de /analyze en segundos
+    VISION_MAX_TILES = int(os.getenv('VISION_MAX_TILES', 4))  # tiles de 512px en detail=high
+    VISION_CONTEXT_MARGIN = float(os.getenv('VISION_CONTEXT_MARGIN', 0.35))  # margen alrededor de la persona
 
     # Server
     PORT = int(os.getenv('PORT', 5000))
@@ -23,9 +31,121 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+    # Planificador (control de admisión de etapas de CPU)
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+    SCHEDULER_CPU_SLOTS = int(os.getenv('SCHEDULER_CPU_SLOTS', 0))  # 0 = hilos asignados al worker
+    SCHEDULER_BATCH_CONCURRENCY = int(os.getenv('SCHEDULER_BATCH_CONCURRENCY', 1))
+    SCHEDULER_VIDEO_CONCURRENCY = int(os.getenv('SCHEDULER_VIDEO_CONCURRENCY', 1))
+    SCHEDULER_QUEUE_LIMITS = {
+        'interactive': int(os.getenv('SCHEDULER_QUEUE_INTERACTIVE', 16)),
+        'batch': int(os.getenv('SCHEDULER_QUEUE_BATCH', 8)),
+        'video': int(os.getenv('SCHEDULER_QUEUE_VIDEO', 2))
+    }
+    SCHEDULER_MAX_WAIT = float(os.getenv('SCHEDULER_MAX_WAIT', 30))  # segundos
+    SCHEDULER_MAX_PER_CLIENT = int(os.getenv('SCHEDULER_MAX_PER_CLIENT', 4))
+    TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))  # proxies delante de la API que agregan X-Forwarded-For
+    INTERNAL_TOKEN = os.getenv('INTERNAL_TOKEN')  # X-Internal-Token para /scheduler y /cpu (sin él, deshabilitados)
+
+    # Caché de reportes de IA por similitud (opcional)
+    REPORT_CACHE_ENABLED = os.getenv('REPORT_CACHE_ENABLED', 'false').lower() == 'true'
+    REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', 512))
+    REPORT_CACHE_ANGLE_TOLERANCE = float(os.getenv('REPORT_CACHE_ANGLE_TOLERANCE', 5.0))  # grados
+    REPORT_CACHE_HASH_TOLERANCE = int(os.getenv('REPORT_CACHE_HASH_TOLERANCE', 10))  # bits de 64
+    REPORT_CACHE_SHARED = os.getenv('REPORT_CACHE_SHARED', 'false').lower() == 'true'  # reutiliza reportes entre clientes
+
+    # Subidas a Cloudinary
+    UPLOAD_MAX_CONCURRENCY = int(os.getenv('UPLOAD_MAX_CONCURRENCY', 2))  # imágenes de las solicitudes, por worker
+    UPLOAD_MAX_JOBS = int(os.getenv('UPLOAD_MAX_JOBS', 2))  # videos en segundo plano, por worker
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 10 * 1024 * 1024))  # bytes
+    UPLOAD_MAX_RETRIES = int(os.getenv('UPLOAD_MAX_RETRIES', 4))
+    UPLOAD_BACKOFF_BASE = float(os.getenv('UPLOAD_BACKOFF_BASE', 1.0))  # segundos
+    UPLOAD_BACKOFF_MAX = float(os.getenv('UPLOAD_BACKOFF_MAX', 30.0))
+
+    # Subidas de video reanudables por partes (cada parte limitada por MAX_CONTENT_LENGTH)
+    VIDEO_MAX_SIZE = int(os.getenv('VIDEO_MAX_SIZE', 2 * 1024 * 1024 * 1024))  # bytes
+    VIDEO_EARLY_DECODE_BYTES = int(os.getenv('VIDEO_EARLY_DECODE_BYTES', 2 * 1024 * 1024))
+    VIDEO_UPLOAD_STALL_TIMEOUT = float(os.getenv('VIDEO_UPLOAD_STALL_TIMEOUT', 120))  # segundos
+
+    # Archivos de trabajo del análisis de video
+    STORAGE_SPOOL_FOLDER = os.getenv('STORAGE_SPOOL_FOLDER', '/dev/shm/analisis_postural')  # tmpfs
+    STORAGE_SPOOL_MAX_BYTES = int(os.getenv('STORAGE_SPOOL_MAX_BYTES', 64 * 1024 * 1024))
+    STORAGE_OUTPUT_QUOTA = int(os.getenv('STORAGE_OUTPUT_QUOTA', 5 * 1024 * 1024 * 1024))  # bytes, 0 = sin cuota
+    STORAGE_OUTPUT_TTL = int(os.getenv('STORAGE_OUTPUT_TTL', 24 * 3600))  # segundos, 0 = sin TTL
+    STORAGE_CHUNKED_TTL = int(os.getenv('STORAGE_CHUNKED_TTL', 24 * 3600))
+
+    # Video anotado en partes de N segundos que se suben mientras sigue el análisis (0 = un solo archivo)
+    VIDEO_SEGMENT_SECONDS = float(os.getenv('VIDEO_SEGMENT_SECONDS', 0))
+
+    # Miniaturas de los peores momentos del video (perfil de umbrales de la reevaluación)
+    VIDEO_KEYFRAMES = int(os.getenv('VIDEO_KEYFRAMES', 5))  # 0 = desactivado
+    VIDEO_KEYFRAME_GAP = float(os.getenv('VIDEO_KEYFRAME_GAP', 2.0))  # segundos mínimos entre momentos
+    VIDEO_KEYFRAME_WIDTH = int(os.getenv('VIDEO_KEYFRAME_WIDTH', 320))  # píxeles
+    VIDEO_KEYFRAME_PROFILE = os.getenv('VIDEO_KEYFRAME_PROFILE', 'actual')
+
+    # Suavizado temporal de landmarks, ángulos y veredictos en el análisis de video
+    VIDEO_SMOOTHING = os.getenv('VIDEO_SMOOTHING', 'none')  # none, one_euro o kalman
+    VIDEO_SMOOTHING_MIN_CUTOFF = float(os.getenv('VIDEO_SMOOTHING_MIN_CUTOFF', 1.0))  # Hz (one_euro)
+    VIDEO_SMOOTHING_BETA = float(os.getenv('VIDEO_SMOOTHING_BETA', 0.3))  # one_euro
+    VIDEO_SMOOTHING_PROCESS_NOISE = float(os.getenv('VIDEO_SMOOTHING_PROCESS_NOISE', 1.0))  # kalman
+    VIDEO_SMOOTHING_MEASUREMENT_NOISE = float(os.getenv('VIDEO_SMOOTHING_MEASUREMENT_NOISE', 1e-4))  # kalman
+    VIDEO_VERDICT_HOLD_FRAMES = int(os.getenv('VIDEO_VERDICT_HOLD_FRAMES', 0))  # cuadros para cambiar el veredicto (0 = sin histéresis)
+
+    # Codificación de respuestas
+    FAST_JSON = os.getenv('FAST_JSON', 'true').lower() == 'true'  # orjson si está instalado
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))  # bytes
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 5))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4))
+
+    # Coalescencia de solicitudes duplicadas en curso (compartida entre workers del nodo)
+    COALESCING_ENABLED = os.getenv('COALESCING_ENABLED', 'true').lower() == 'true'
+    COALESCING_FOLDER = os.getenv('COALESCING_FOLDER', '/tmp/analisis_postural_coalescing')
+    COALESCING_WAIT_TIMEOUT = float(os.getenv('COALESCING_WAIT_TIMEOUT', 300))  # segundos
+    COALESCING_LINGER = float(os.getenv('COALESCING_LINGER', 5))  # segundos
+
+    # Estado de trabajos, reportes y ubicación de archivos (file = disco del nodo, redis = compartido)
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'file')
+    STATE_REDIS_URL = os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0')
+    STATE_PREFIX = os.getenv('STATE_PREFIX', 'analisis_postural')
+    STATE_FORWARD_TIMEOUT = float(os.getenv('STATE_FORWARD_TIMEOUT', 60))  # segundos
+    NODE_ID = os.getenv('NODE_ID', socket.gethostname())
+    NODE_URL = os.getenv('NODE_URL')  # URL interna con la que otros nodos llegan a este
+
+    # Historial local de análisis (SQLite compartido por los workers del nodo)
+    HISTORY_ENABLED = os.getenv('HISTORY_ENABLED', 'true').lower() == 'true'
+    HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', 'data/historial.sqlite3')
+    HISTORY_ADMIN_TOKEN = os.getenv('HISTORY_ADMIN_TOKEN')  # permite consultar otros clientes
+    HISTORY_USER_SECRET = os.getenv('HISTORY_USER_SECRET')  # firma de X-User-Token (identidad de cada usuario)
+
+    # Reevaluación de landmarks guardados con otros perfiles de umbrales
+    RESCORING_DATA_FOLDER = os.getenv('RESCORING_DATA_FOLDER', 'landmark_datasets')
+    RESCORING_PROFILES_FILE = os.getenv('RESCORING_PROFILES_FILE')  # JSON con perfiles personalizados
+    RESCORING_CHUNK_ROWS = int(os.getenv('RESCORING_CHUNK_ROWS', 262144))  # filas por bloque
+
+    # Modo ASGI (asgi:app con uvicorn): E/S de red en el event loop y etapas de CPU en ejecutores
+    ASGI_ASYNC_VIEWS = os.getenv('ASGI_ASYNC_VIEWS', 'true').lower() == 'true'  # false = todo por el puente WSGI
+    ASGI_CPU_THREADS = int(os.getenv('ASGI_CPU_THREADS', 0))  # 0 = slots de CPU del planificador
+    ASGI_BLOCKING_THREADS = int(os.getenv('ASGI_BLOCKING_THREADS', 64))  # esperas en cola y rutas síncronas
+
+    # Modelos
+    PRELOAD_MODELS = os.getenv('PRELOAD_MODELS', 'true').lower() == 'true'
+    POSE_POOL_SIZE = int(os.getenv('POSE_POOL_SIZE', SCHEDULER_CPU_SLOTS))  # 0 = igual que los slots de CPU
+
+    # Reparto de núcleos entre los workers de gunicorn (sin medir todavía con loadtest: desactivado)
+    CPU_BUDGET_ENABLED = os.getenv('CPU_BUDGET_ENABLED', 'false').lower() == 'true'
+    CPU_THREADS_PER_WORKER = int(os.getenv('CPU_THREADS_PER_WORKER', 0))  # 0 = núcleos / workers
+    CPU_PINNING = os.getenv('CPU_PINNING', 'false').lower() == 'true'
+
+    # Perfilado bajo demanda (cabecera X-Profile o ?profile=)
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')
+    PROFILING_SAMPLE_RATE = int(os.getenv('PROFILING_SAMPLE_RATE', 0))  # 1 de cada N, 0 = desactivado
+    PROFILING_DIR = os.getenv('PROFILING_DIR', 'profiles')
+
 class DevelopmentConfig(Config):
     """Configuración para desarrollo"""
     DEBUG = True
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'true').lower() == 'true'
 
 class ProductionConfig(Config):
     """Configuración para producción"""
@@ -1,70 +1,410 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context, url_for
+import asyncio
+import json
+import time
 import uuid
-from openai import OpenAI
-from app.utils.cloudinary_helper import upload_image
+from concurrent.futures import TimeoutError as FutureTimeout
+from app.utils.asgi import async_view, run_blocking, run_cpu, spawn
+from app.utils.cloudinary_helper import upload_image, upload_image_async
+from app.utils.coalescing import coalesced
+from app.utils.encoding import encode_response
+from app.utils.history import ANONYMOUS_CLIENT, history_client_id, record_analysis
 from app.utils.mediapipe_helper import analyze_posture
-from app.utils.openai_helper import generate_ergonomic_report
+from app.utils.memory import memory_tracked
+from app.utils.metrics import AI_REPORTS
+from app.utils.openai_helper import (
+    agenerate_ergonomic_report, generate_local_report, get_async_openai_client, get_openai_client,
+    stream_ergonomic_report, submit_ergonomic_report
+)
+from app.utils.report_store import load_report, save_report
+from app.utils.profiling import profiled
+from app.utils.scheduler import AdmissionRejected, get_client_id, get_scheduler, rejection_response
 
 analisis_ergonomico_bp = Blueprint('analisis_ergonomico', __name__)
 
 @analisis_ergonomico_bp.route('/analyze', methods=['POST'])
+@profiled
+@coalesced('image')
+@memory_tracked('analyze')
 def analyze():
+    started = time.monotonic()
     try:
-        if 'image' not in request.files:
-            return jsonify({'error': 'No se encontró imagen en el request'}), 400
+        file, error = _image_file()
+        if error is not None:
+            return error
+
+        analysis_id = str(uuid.uuid4())
+
+        # Las solicitudes marcadas como batch ceden prioridad a las interactivas
+        with get_scheduler().slot(_job_class(), get_client_id(request)):
+            analysis_result = analyze_posture(file)
+
+        if not analysis_result['success']:
+            return jsonify({'error': analysis_result['error']}), 500
+
+        upload_result = upload_image(analysis_result['processed_image'], **_upload_options(analysis_id))
+        if not upload_result['success']:
+            return _upload_error(upload_result)
+        _record_image(analysis_id, analysis_result, upload_result)
+
+        # Un reporte ya generado para una postura y una imagen casi idénticas evita llamar al modelo
+        cache, cache_key, cached_report = _cached_report(analysis_result)
+
+        if cached_report is not None:
+            ai_future = None
+            ai_report_result = _cached_result(cached_report)
+        else:
+            ai_future = submit_ergonomic_report(
+                max_workers=current_app.config['OPENAI_MAX_CONNECTIONS'],
+                client=_openai_client(get_openai_client),
+                **_report_arguments(analysis_result, upload_result)
+            )
+
+            # El reporte de IA solo puede usar lo que queda del presupuesto de la solicitud
+            try:
+                ai_report_result = ai_future.result(timeout=_remaining_budget(started))
+            except FutureTimeout:
+                ai_report_result = None
+
+        return _analysis_response(
+            analysis_id, analysis_result, upload_result, ai_report_result, ai_future, cache, cache_key
+        )
+
+    except AdmissionRejected as e:
+        return rejection_response(e)
+
+    except Exception as e:
+        return _request_error(e)
 
-        file = request.files['image']
 
-        if file.filename == '':
-            return jsonify({'error': 'Archivo vacío'}), 400
+@async_view('analisis_ergonomico.analyze')
+@profiled
+@coalesced('image')
+@memory_tracked('analyze')
+async def analyze_async():
+    """
+    /analyze en modo ASGI: la inferencia va al ejecutor de CPU y la subida y el
+    reporte de IA se esperan en el event loop. Todo lo demás es lo de analyze.
+    """
+    started = time.monotonic()
+    try:
+        file, error = _image_file()
+        if error is not None:
+            return error
 
         analysis_id = str(uuid.uuid4())
 
+        async with get_scheduler().async_slot(_job_class(), get_client_id(request)):
+            analysis_result = await run_cpu(analyze_posture, file)
 
-        analysis_result = analyze_posture(file)
         if not analysis_result['success']:
             return jsonify({'error': analysis_result['error']}), 500
 
-        upload_result = upload_image(
-            analysis_result['processed_image'],
-            folder='analisis-ergonomico',
-            public_id=f'analysis_{analysis_id}'
+        upload_result = await upload_image_async(analysis_result['processed_image'], **_upload_options(analysis_id))
+        if not upload_result['success']:
+            return _upload_error(upload_result)
+        # SQLite puede esperar el lock de escritura de otro worker
+        await run_blocking(_record_image, analysis_id, analysis_result, upload_result)
+
+        cache, cache_key, cached_report = _cached_report(analysis_result)
+
+        if cached_report is not None:
+            ai_task = None
+            ai_report_result = _cached_result(cached_report)
+        else:
+            # La tarea sigue si se agota el presupuesto y el reporte queda en /report/<id>
+            ai_task = spawn(agenerate_ergonomic_report(
+                client=_openai_client(get_async_openai_client),
+                **_report_arguments(analysis_result, upload_result)
+            ))
+            try:
+                ai_report_result = await asyncio.wait_for(asyncio.shield(ai_task), _remaining_budget(started))
+            except asyncio.TimeoutError:
+                ai_report_result = None
+
+        return _analysis_response(
+            analysis_id, analysis_result, upload_result, ai_report_result, ai_task, cache, cache_key
         )
 
+    except AdmissionRejected as e:
+        return rejection_response(e)
+
+    except Exception as e:
+        return _request_error(e)
 
-        client = OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
 
-        ai_report_result = generate_ergonomic_report(
-            client=client,
-            image_url=upload_result['url'],
-            angles=analysis_result['angles'],
-            angle_details=analysis_result['recommendations']['angle_details'],
-            recommendations=analysis_result['recommendations']['recommendations'],
-            is_good_posture=analysis_result['is_good_posture']
+def _image_file():
+    """(archivo, None) con la imagen del formulario, o (None, respuesta de error)"""
+    if 'image' not in request.files:
+        return None, (jsonify({'error': 'No se encontró imagen en el request'}), 400)
+
+    file = request.files['image']
+
+    if file.filename == '':
+        return None, (jsonify({'error': 'Archivo vacío'}), 400)
+    return file, None
+
+
+def _upload_options(analysis_id):
+    return {'folder': 'analisis-ergonomico', 'public_id': f'analysis_{analysis_id}'}
+
+
+def _openai_client(factory):
+    """Cliente de OpenAI del worker; factory es get_openai_client o get_async_openai_client"""
+    config = current_app.config
+    return factory(
+        api_key=config['OPENAI_API_KEY'],
+        base_url=config['OPENAI_BASE_URL'],
+        timeout=config['OPENAI_TIMEOUT'],
+        max_connections=config['OPENAI_MAX_CONNECTIONS']
+    )
+
+
+def _remaining_budget(started):
+    return max(0.0, current_app.config['REPORT_DEADLINE'] - (time.monotonic() - started))
+
+
+def _cached_result(report):
+    return {'success': True, 'report': report, 'cached': True}
+
+
+def _request_error(error):
+    return jsonify({
+        'error': f'Error al procesar la solicitud: {str(error)}'
+    }), 500
+
+
+def _job_class():
+    return 'batch' if request.headers.get('X-Request-Priority') == 'batch' else 'interactive'
+
+
+def _cached_report(analysis_result):
+    """(caché, clave, reporte guardado o None)"""
+    cache = current_app.extensions['report_cache']
+    if cache is None:
+        return None, None, None
+    cache_key = cache.make_key(
+        analysis_result['recommendations']['angle_details'], analysis_result['processed_image'], get_client_id(request)
+    )
+    return cache, cache_key, cache.lookup(cache_key)
+
+
+def _report_arguments(analysis_result, upload_result):
+    config = current_app.config
+    return {
+        'image_url': upload_result['url'],
+        'angles': analysis_result['angles'],
+        'angle_details': analysis_result['recommendations']['angle_details'],
+        'recommendations': analysis_result['recommendations']['recommendations'],
+        'is_good_posture': analysis_result['is_good_posture'],
+        'image': analysis_result['processed_image'],
+        'landmarks': analysis_result['landmarks'],
+        'max_tiles': config['VISION_MAX_TILES'],
+        'context_margin': config['VISION_CONTEXT_MARGIN']
+    }
+
+
+def _analysis_response(analysis_id, analysis_result, upload_result, ai_report_result, ai_future, cache, cache_key):
+    angle_details = analysis_result['recommendations']['angle_details']
+    recommendations = analysis_result['recommendations']['recommendations']
+
+    response_data = {
+        'id': analysis_id,
+        'status': 'success',
+        'message': 'Análisis completado exitosamente',
+        'recommendations' : analysis_result['recommendations'],
+        'data': {
+            'image_url': upload_result['url'],
+            'ai_analysis': None,
+            'ai_analysis_status': 'completed'
+        }
+    }
+
+    if ai_report_result is None:
+        # Se responde con el reporte local y el de IA queda disponible en /report/<id>
+        AI_REPORTS.labels('fallback').inc()
+        response_data['data']['ai_analysis'] = generate_local_report(
+            angle_details, recommendations, analysis_result['is_good_posture']
         )
-        response_data = {
-            'id': analysis_id,
-            'status': 'success',
-            'message': 'Análisis completado exitosamente',
-            'recommendations' : analysis_result['recommendations'],
-            'data': {
-                'image_url': upload_result['url'],
-                'ai_analysis': None
-            }
+        response_data['data']['ai_analysis_status'] = 'pending'
+        response_data['data']['ai_report_url'] = url_for(
+            'analisis_ergonomico.get_report', analysis_id=analysis_id
+        )
+        _store_late_report(analysis_id, ai_future, cache, cache_key)
+    elif ai_report_result.get('cached'):
+        AI_REPORTS.labels('cache').inc()
+        response_data['data']['ai_analysis'] = ai_report_result['report']
+    elif ai_report_result['success']:
+        AI_REPORTS.labels('ai').inc()
+        response_data['data']['ai_analysis'] = ai_report_result['report']
+        response_data['data']['ai_usage'] = ai_report_result['usage']
+        if cache is not None:
+            cache.store(cache_key, ai_report_result['report'])
+    else:
+        AI_REPORTS.labels('error').inc()
+        response_data['data']['ai_analysis_status'] = 'error'
+        response_data['data']['ai_analysis'] = {
+            'error': ai_report_result.get('error', 'No se pudo generar análisis con IA')
         }
+    return encode_response(response_data, landmarks=analysis_result['landmarks'])
+
+
+def _upload_error(upload_result):
+    # Sin la URL de la imagen no hay respuesta ni reporte de IA que dar
+    return jsonify({'error': f"Error al subir la imagen: {upload_result['error']}"}), 502
+
 
-        if ai_report_result['success']:
-            response_data['data']['ai_analysis'] = ai_report_result['report']
+def _record_image(analysis_id, analysis_result, upload_result):
+    angle_details = analysis_result['recommendations']['angle_details']
+    record_analysis(
+        analysis_id=analysis_id,
+        client_id=history_client_id(request) or ANONYMOUS_CLIENT,
+        kind='imagen',
+        angles=analysis_result['angles'],
+        is_good_posture=analysis_result['is_good_posture'],
+        failed_checks=[d['segment'] for d in angle_details if d['status'] == 'incorrecto'],
+        media_url=upload_result.get('url'),
+        landmarks=analysis_result['landmarks']
+    )
+
+
+def _store_late_report(analysis_id, ai_future, cache=None, cache_key=None):
+    save_report(analysis_id, {'status': 'pending'})
+
+    def _on_done(future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        if result['success']:
+            AI_REPORTS.labels('late').inc()
+            if cache is not None:
+                cache.store(cache_key, result['report'])
+            save_report(analysis_id, {
+                'status': 'completed',
+                'ai_analysis': result['report'],
+                'ai_usage': result['usage']
+            })
         else:
-            response_data['data']['ai_analysis'] = {
-                'error': ai_report_result.get('error', 'No se pudo generar análisis con IA')
-            }
-        return jsonify(response_data), 200
+            save_report(analysis_id, {'status': 'error', 'error': result.get('error')})
+
+    ai_future.add_done_callback(_on_done)
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+@analisis_ergonomico_bp.route('/analyze/stream', methods=['POST'])
+@memory_tracked('analyze_stream')
+def analyze_stream():
+    """
+    Igual que /analyze, pero responde con server-sent events: primero el análisis
+    postural y después cada sección del reporte de IA en cuanto el modelo la termina.
+    """
+    try:
+        file, error = _image_file()
+        if error is not None:
+            return error
+
+        analysis_id = str(uuid.uuid4())
+
+        with get_scheduler().slot(_job_class(), get_client_id(request)):
+            analysis_result = analyze_posture(file)
+
+        if not analysis_result['success']:
+            return jsonify({'error': analysis_result['error']}), 500
+
+        upload_result = upload_image(analysis_result['processed_image'], **_upload_options(analysis_id))
+        if not upload_result['success']:
+            return _upload_error(upload_result)
+        _record_image(analysis_id, analysis_result, upload_result)
+
+    except AdmissionRejected as e:
+        return rejection_response(e)
 
     except Exception as e:
-        return jsonify({
-            'error': f'Error al procesar la solicitud: {str(e)}'
-        }), 500
+        return _request_error(e)
+
+    config = current_app.config
+    client = _openai_client(get_openai_client)
+    angle_details = analysis_result['recommendations']['angle_details']
+    recommendations = analysis_result['recommendations']['recommendations']
+
+    cache = current_app.extensions['report_cache']
+    cache_key = None
+    cached_report = None
+    if cache is not None:
+        cache_key = cache.make_key(angle_details, analysis_result['processed_image'], get_client_id(request))
+        cached_report = cache.lookup(cache_key)
+
+    def events():
+        yield _sse('analysis', {
+            'id': analysis_id,
+            'recommendations': analysis_result['recommendations'],
+            'image_url': upload_result['url']
+        })
+
+        if cached_report is not None:
+            AI_REPORTS.labels('cache').inc()
+            for name, content in cached_report.items():
+                yield _sse('section', {'name': name, 'content': content})
+            yield _sse('done', {'report': cached_report, 'usage': None})
+            return
+
+        for item in stream_ergonomic_report(
+            client=client,
+            image_url=upload_result['url'],
+            angles=analysis_result['angles'],
+            angle_details=angle_details,
+            recommendations=recommendations,
+            is_good_posture=analysis_result['is_good_posture'],
+            image=analysis_result['processed_image'],
+            landmarks=analysis_result['landmarks'],
+            max_tiles=config['VISION_MAX_TILES'],
+            context_margin=config['VISION_CONTEXT_MARGIN']
+        ):
+            if item['event'] == 'done':
+                AI_REPORTS.labels('ai').inc()
+                if cache is not None:
+                    cache.store(cache_key, item['data']['report'])
+                # Un cliente que perdió la conexión puede recuperar el reporte en /report/<id>
+                save_report(analysis_id, {
+                    'status': 'completed',
+                    'ai_analysis': item['data']['report'],
+                    'ai_usage': item['data']['usage']
+                })
+            elif item['event'] == 'error':
+                AI_REPORTS.labels('error').inc()
+                yield _sse('error', item['data'])
+                item = {'event': 'fallback', 'data': {
+                    'report': generate_local_report(
+                        angle_details, recommendations, analysis_result['is_good_posture']
+                    )
+                }}
+            yield _sse(item['event'], item['data'])
+
+    return Response(
+        stream_with_context(events()),
+        content_type='text/event-stream; charset=utf-8',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@analisis_ergonomico_bp.route('/report/<analysis_id>', methods=['GET'])
+def get_report(analysis_id):
+    try:
+        uuid.UUID(analysis_id)
+    except ValueError:
+        return jsonify({'error': 'Identificador inválido'}), 400
+
+    report = load_report(analysis_id)
+    if report is None:
+        return jsonify({'error': 'Reporte no encontrado'}), 404
+
+    status_code = 202 if report['status'] == 'pending' else 200
+    return encode_response(dict(report, id=analysis_id), status=status_code)
 
 
 @analisis_ergonomico_bp.route('/test', methods=['GET'])
@@ -84,6 +424,8 @@ def info():
         'description': 'Módulo para análisis de postura ergonómica usando MediaPipe y OpenCV',
         'endpoints': {
             'POST /analyze': 'Analizar postura desde una imagen',
+            'POST /analyze/stream': 'Analizar postura y recibir el reporte de IA por secciones (server-sent events)',
+            'GET /report/<id>': 'Reporte de IA que llegó después de responder el análisis',
             'GET /test': 'Verificar estado del módulo',
             'GET /info': 'Información del módulo'
         },
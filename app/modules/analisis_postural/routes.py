@@ -1,77 +1,496 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, current_app, request, jsonify, make_response, redirect, send_file, url_for
 import os
 import uuid
-from app.utils.video_posture_helper import process_video_posture
+from functools import wraps
+from app.utils.asgi import async_view, run_blocking, run_cpu
+from app.utils.chunked_upload import (
+    CHECKSUM_ALGORITHMS, TUS_EXTENSIONS, TUS_VERSION, ChunkedUploadError, ChunkedUploadStore,
+    iter_frames_while_uploading, parse_metadata
+)
+from app.utils.cloudinary_helper import spliced_video_url
+from app.utils.coalescing import coalesced
+from app.utils.encoding import encode_response
+from app.utils.history import ANONYMOUS_CLIENT, history_client_id, record_analysis
+from app.utils.smoothing import video_smoothing_options
+from app.utils.video_posture_helper import VIDEO_EAGER, process_video_posture
+from app.utils.profiling import profiled
+from app.utils.rescoring import DEFAULT_PROFILES, load_profiles
+from app.utils.scheduler import AdmissionRejected, get_client_id, get_scheduler, rejection_response
+from app.utils.state import forget_artifact, forward_to_owner, register_artifact
+from app.utils.storage import CHUNKED_FOLDER, OUTPUT_FOLDER
+from app.utils.upload_manager import get_upload_manager
 
 analisis_postural_bp = Blueprint('analisis_postural', __name__)
 
-UPLOAD_FOLDER = 'uploaded_videos'
-OUTPUT_FOLDER = 'output_videos'
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# Las carpetas las crea y administra VideoStorage (app.utils.storage)
 
 @analisis_postural_bp.route('/analizar-postura', methods=['POST'])
+@profiled
+@coalesced('video')
 def analizar_postura():
     try:
-        if 'video' not in request.files:
-            return jsonify({'error': 'No se envió ningún archivo de video'}), 400
+        video, error = _video_file()
+        if error is not None:
+            return error
+
+        uid, output_path, storage = _new_video()
+
+        # Los videos pequeños se escriben en tmpfs; el directorio de trabajo se borra siempre al salir
+        with storage.job(uid, input_size=request.content_length) as job:
+            input_path = job.file(video.filename)
+            # Guardar el archivo no necesita CPU: se hace antes de ocupar un slot de video
+            video.save(input_path)
+            with get_scheduler().slot('video', get_client_id(request)):
+                resumen = _process_video(input_path, output_path, uid)
+
+        return _finish_video(uid, output_path, resumen, storage)
+
+    except AdmissionRejected as e:
+        return rejection_response(e)
+
+    except Exception as e:
+        return _request_error(e)
+
+
+@async_view('analisis_postural.analizar_postura')
+@profiled
+@coalesced('video')
+async def analizar_postura_async():
+    """analizar_postura en modo ASGI: el video se guarda en un hilo y se decodifica y analiza en el ejecutor de CPU"""
+    try:
+        video, error = _video_file()
+        if error is not None:
+            return error
+
+        uid, output_path, storage = _new_video()
+
+        with storage.job(uid, input_size=request.content_length) as job:
+            input_path = job.file(video.filename)
+            await run_blocking(video.save, input_path)
+            async with get_scheduler().async_slot('video', get_client_id(request)):
+                resumen = await run_cpu(_process_video, input_path, output_path, uid)
+
+        return await run_blocking(_finish_video, uid, output_path, resumen, storage)
+
+    except AdmissionRejected as e:
+        return rejection_response(e)
+
+    except Exception as e:
+        return _request_error(e)
+
+
+def _video_file():
+    """(archivo, None) con el video del formulario, o (None, respuesta de error)"""
+    if 'video' not in request.files:
+        return None, (jsonify({'error': 'No se envió ningún archivo de video'}), 400)
+
+    video = request.files['video']
+
+    if video.filename == '':
+        return None, (jsonify({'error': 'Archivo vacío'}), 400)
+    return video, None
+
+
+def _new_video():
+    """Identificador, ruta del resultado y almacenamiento de un análisis nuevo"""
+    uid = str(uuid.uuid4())
+    output_path = os.path.join(OUTPUT_FOLDER, f"{uid}_resultado.mp4")
+    return uid, output_path, current_app.extensions['video_storage']
+
+
+def _request_error(error):
+    return jsonify({
+        'error': f'Error al procesar la solicitud: {str(error)}'
+    }), 500
 
-        video = request.files['video']
 
-        if video.filename == '':
-            return jsonify({'error': 'Archivo vacío'}), 400
+def _video_options():
+    config = current_app.config
+    options = {
+        'segment_seconds': config['VIDEO_SEGMENT_SECONDS'],
+        'keyframes': config['VIDEO_KEYFRAMES'],
+        'smoothing': video_smoothing_options(config)
+    }
+    if options['keyframes'] > 0:
+        profiles = load_profiles(config['RESCORING_PROFILES_FILE'])
+        options.update(
+            keyframe_gap=config['VIDEO_KEYFRAME_GAP'],
+            keyframe_width=config['VIDEO_KEYFRAME_WIDTH'],
+            keyframe_thresholds=profiles.get(config['VIDEO_KEYFRAME_PROFILE'], DEFAULT_PROFILES['actual'])
+        )
+    return options
 
-        uid = str(uuid.uuid4())
-        input_path = os.path.join(UPLOAD_FOLDER, f"{uid}_{video.filename}")
-        output_path = os.path.join(OUTPUT_FOLDER, f"{uid}_resultado.mp4")
 
-        video.save(input_path)
+def _process_video(input_path, output_path, uid):
+    return process_video_posture(input_path, output_path, upload_id=uid, **_video_options())
 
-        resumen = process_video_posture(input_path, output_path)
 
+def _finish_video(uid, output_path, resumen, storage):
+    if not resumen['success']:
+        storage.discard_outputs(output_path)
+        return jsonify({'error': resumen['error']}), 500
+
+    storage.sweep()
+
+    _register_outputs(output_path, resumen)
+    response_data = _video_response(uid, output_path, resumen)
+    _record_video(uid, resumen, response_data)
+    return encode_response(response_data)
+
+
+def _video_response(uid, output_path, resumen):
+    # Con partes, el video se puede reproducir parte por parte mientras se termina de subir
+    filenames = resumen['segmentos'] or [os.path.basename(output_path)]
+    local_urls = [
+        url_for('analisis_postural.download_video', filename=name, _external=True)
+        for name in filenames
+    ]
+
+    response_data = {
+        'id': uid,
+        'status': 'success',
+        'message': 'Análisis de video completado exitosamente',
+        'data': {
+            'resumen': {
+                'total_frames': resumen['total_frames'],
+                'malas_posturas': resumen['malas_posturas'],
+                'porcentaje_malas_posturas': round(
+                    (resumen['malas_posturas'] / resumen['total_frames'] * 100)
+                    if resumen['total_frames'] > 0 else 0,
+                    2
+                ),
+                'fps_procesamiento': resumen['fps_procesamiento']
+            },
+            # Mientras se sube a Cloudinary el video se sirve desde este servidor
+            'video_resultado_url': local_urls[0],
+            'video_upload_status': resumen['upload_status'],
+            'video_status_url': url_for('analisis_postural.video_status', video_id=uid),
+            'video_filename': filenames[0]
+        }
+    }
+    if resumen['segmentos'] is not None:
+        response_data['data']['video_partes_urls'] = local_urls
+    if resumen['momentos'] is not None:
+        response_data['data']['peores_momentos'] = [
+            {
+                'url': url_for('analisis_postural.momento', filename=momento['archivo'], _external=True),
+                'segundo': momento['segundo'],
+                'frame': momento['frame'],
+                'severidad': momento['severidad'],
+                'mala_postura': momento['mala_postura'],
+                'desviaciones': momento['desviaciones']
+            }
+            for momento in resumen['momentos']
+        ]
+
+    return response_data
+
+
+def _register_outputs(output_path, resumen):
+    # Otro nodo que reciba la descarga sabrá a cuál reenviarla
+    names = list(resumen['segmentos'] or [os.path.basename(output_path)])
+    names += [momento['archivo'] for momento in resumen['momentos'] or []]
+    for name in names:
+        register_artifact(name, os.path.join(os.path.dirname(output_path), name))
+
+
+def _record_video(uid, resumen, response_data):
+    record_analysis(
+        analysis_id=uid,
+        client_id=history_client_id(request) or ANONYMOUS_CLIENT,
+        kind='video',
+        total_frames=resumen['total_frames'],
+        bad_frames=resumen['malas_posturas'],
+        fps=resumen['fps_procesamiento'],
+        media_url=response_data['data']['video_resultado_url']
+    )
+
+
+def _chunked_store():
+    return ChunkedUploadStore(CHUNKED_FOLDER, current_app.config['VIDEO_MAX_SIZE'])
+
+
+def _served_by_owner(view):
+    """Los datos de una subida por partes están en el disco del nodo que la creó: si es otro, se le reenvía"""
+    @wraps(view)
+    def wrapper(upload_id, *args, **kwargs):
+        if not os.path.exists(_chunked_store().data_path(upload_id)):
+            forwarded = forward_to_owner(upload_id)
+            if forwarded is not None:
+                return forwarded
+        return view(upload_id, *args, **kwargs)
+
+    return wrapper
+
+
+def _tus_response(status=204, headers=None, body=None):
+    response = make_response(body if body is not None else '', status)
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    response.headers['Cache-Control'] = 'no-store'
+    for key, value in (headers or {}).items():
+        response.headers[key] = str(value)
+    return response
+
+
+def _tus_error(error):
+    return _tus_response(error.status, body=jsonify({'error': error.message}))
+
+
+@analisis_postural_bp.route('/uploads', methods=['OPTIONS'])
+def uploads_options():
+    return _tus_response(204, {
+        'Tus-Version': TUS_VERSION,
+        'Tus-Extension': TUS_EXTENSIONS,
+        'Tus-Max-Size': current_app.config['VIDEO_MAX_SIZE'],
+        'Tus-Checksum-Algorithm': ','.join(CHECKSUM_ALGORITHMS)
+    })
+
+
+@analisis_postural_bp.route('/uploads', methods=['POST'])
+def create_upload():
+    try:
+        length = int(request.headers.get('Upload-Length', ''))
+    except ValueError:
+        return _tus_error(ChunkedUploadError('Falta Upload-Length', 400))
+
+    try:
+        metadata = parse_metadata(request.headers.get('Upload-Metadata'))
+        store = _chunked_store()
+        upload_id = store.create(length, os.path.basename(metadata.get('filename', 'video.mp4')))
+    except ChunkedUploadError as e:
+        return _tus_error(e)
+    register_artifact(upload_id, store.data_path(upload_id))
+
+    return _tus_response(201, {
+        'Location': url_for('analisis_postural.upload_chunk', upload_id=upload_id, _external=True),
+        'Upload-Offset': 0
+    })
+
+
+@analisis_postural_bp.route('/uploads/<upload_id>', methods=['HEAD'])
+@_served_by_owner
+def upload_offset(upload_id):
+    try:
+        meta = _chunked_store().info(upload_id)
+    except ChunkedUploadError as e:
+        return _tus_response(e.status)
+
+    return _tus_response(200, {'Upload-Offset': meta['offset'], 'Upload-Length': meta['length']})
+
+
+@analisis_postural_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+@_served_by_owner
+def upload_chunk(upload_id):
+    if request.mimetype != 'application/offset+octet-stream':
+        return _tus_error(ChunkedUploadError('Content-Type debe ser application/offset+octet-stream', 415))
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return _tus_error(ChunkedUploadError('Falta Upload-Offset', 400))
+
+    try:
+        # Se lee el cuerpo por bloques: la parte nunca se carga completa en memoria
+        new_offset = _chunked_store().append(
+            upload_id, offset, request.stream, request.headers.get('Upload-Checksum')
+        )
+    except ChunkedUploadError as e:
+        return _tus_error(e)
+
+    return _tus_response(204, {'Upload-Offset': new_offset})
+
+
+@analisis_postural_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@_served_by_owner
+def delete_upload(upload_id):
+    store = _chunked_store()
+    try:
+        store.info(upload_id)
+    except ChunkedUploadError as e:
+        return _tus_error(e)
+    store.delete(upload_id)
+    forget_artifact(upload_id)
+    return _tus_response(204)
+
+
+@analisis_postural_bp.route('/uploads/<upload_id>/analizar', methods=['POST'])
+@_served_by_owner
+@profiled
+@coalesced()
+def analizar_subida(upload_id):
+    """
+    Analiza un video subido por partes. Puede llamarse antes de que la subida
+    termine: el análisis avanza sobre lo ya recibido y espera el resto.
+    """
+    store = _chunked_store()
+    try:
+        store.info(upload_id)
+    except ChunkedUploadError as e:
+        return jsonify({'error': e.message}), e.status
+
+    try:
+        config = current_app.config
+        output_path = os.path.join(OUTPUT_FOLDER, f"{upload_id}_resultado.mp4")
+        storage = current_app.extensions['video_storage']
+        scheduler, client_id = get_scheduler(), get_client_id(request)
+        # El slot de CPU se ocupa solo mientras hay datos recibidos que decodificar: un
+        # cliente lento no bloquea el worker mientras se espera el resto de la subida
+        frames = iter_frames_while_uploading(
+            store, upload_id,
+            min_growth=config['VIDEO_EARLY_DECODE_BYTES'],
+            stall_timeout=config['VIDEO_UPLOAD_STALL_TIMEOUT'],
+            hold=lambda: scheduler.slot('video', client_id)
+        )
+
+        try:
+            resumen = process_video_posture(
+                store.data_path(upload_id), output_path, upload_id=upload_id, frames=frames,
+                **_video_options()
+            )
+        except AdmissionRejected:
+            storage.discard_outputs(output_path)
+            raise
+        finally:
+            # Si el análisis se cortó a mitad de una pasada, el slot se suelta aquí
+            frames.close()
+
+        # Si falla, los datos recibidos se conservan para reanudar la subida y reintentar
         if not resumen['success']:
+            storage.discard_outputs(output_path)
             return jsonify({'error': resumen['error']}), 500
 
-        return jsonify({
-            'id': uid,
-            'status': 'success',
-            'message': 'Análisis de video completado exitosamente',
-            'data': {
-                'resumen': {
-                    'total_frames': resumen['total_frames'],
-                    'malas_posturas': resumen['malas_posturas'],
-                    'porcentaje_malas_posturas': round(
-                        (resumen['malas_posturas'] / resumen['total_frames'] * 100)
-                        if resumen['total_frames'] > 0 else 0,
-                        2
-                    )
-                },
-                'video_resultado_url': resumen['cloudinary_url'],
-                'video_filename': os.path.basename(output_path)
-            }
-        }), 200
+        store.delete(upload_id)
+        forget_artifact(upload_id)
+        storage.sweep()
+        _register_outputs(output_path, resumen)
+        response_data = _video_response(upload_id, output_path, resumen)
+        _record_video(upload_id, resumen, response_data)
+        return encode_response(response_data)
+
+    except AdmissionRejected as e:
+        return rejection_response(e)
 
     except Exception as e:
-        return jsonify({
-            'error': f'Error al procesar la solicitud: {str(e)}'
-        }), 500
+        return _request_error(e)
 
 
 @analisis_postural_bp.route('/download/<filename>', methods=['GET'])
 def download_video(filename):
     try:
-        path = os.path.join(OUTPUT_FOLDER, filename)
+        path, estado = current_app.extensions['video_storage'].output_file(filename)
+        if estado == 'ok':
+            return send_file(os.path.abspath(path), as_attachment=True)
 
-        if not os.path.exists(path):
-            return jsonify({'error': 'Archivo no encontrado'}), 404
+        # El archivo local ya no está, pero puede estar en Cloudinary
+        manager = get_upload_manager()
+        upload = manager.status(os.path.splitext(filename)[0]) or manager.status(filename.split('_')[0])
+        if upload is not None and upload['status'] == 'completed':
+            return redirect(upload['url'])
 
-        return send_file(path, as_attachment=True)
+        # Con estado compartido, el archivo puede estar en el disco de otro nodo
+        forwarded = forward_to_owner(filename)
+        if forwarded is not None:
+            return forwarded
+
+        if estado == 'evicted':
+            return jsonify({'error': 'El archivo fue eliminado por la política de retención'}), 410
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+
+    except Exception as e:
+        return jsonify({'error': f'Error al descargar archivo: {str(e)}'}), 500
+
+
+@analisis_postural_bp.route('/momentos/<filename>', methods=['GET'])
+def momento(filename):
+    try:
+        path, estado = current_app.extensions['video_storage'].output_file(filename)
+        if estado == 'ok':
+            return send_file(os.path.abspath(path), mimetype='image/jpeg', max_age=3600)
+
+        forwarded = forward_to_owner(filename)
+        if forwarded is not None:
+            return forwarded
+
+        if estado == 'evicted':
+            return jsonify({'error': 'El archivo fue eliminado por la política de retención'}), 410
+        return jsonify({'error': 'Archivo no encontrado'}), 404
 
     except Exception as e:
         return jsonify({'error': f'Error al descargar archivo: {str(e)}'}), 500
 
 
+@analisis_postural_bp.route('/video/<video_id>', methods=['GET'])
+def video_status(video_id):
+    try:
+        uuid.UUID(video_id)
+    except ValueError:
+        return jsonify({'error': 'Identificador inválido'}), 400
+
+    manager = get_upload_manager()
+    upload = manager.status(video_id)
+    if upload is None:
+        return jsonify({'error': 'Video no encontrado'}), 404
+
+    if 'segments' in upload:
+        return jsonify(_segmented_status(video_id, upload, manager)), 200
+
+    filename = os.path.basename(upload['path'])
+    return jsonify({
+        'id': video_id,
+        'upload_status': upload['status'],
+        'video_resultado_url': upload['url'] or url_for(
+            'analisis_postural.download_video', filename=filename, _external=True
+        ),
+        'cloudinary_url': upload['url'],
+        'bytes_subidos': upload['offset'],
+        'intentos': upload['attempts'],
+        'error': upload.get('error')
+    }), 200
+
+
+def _segmented_status(video_id, manifest, manager):
+    status, parts = manager.segments_status(manifest)
+
+    # Las partes ya subidas desde el inicio se pueden reproducir mientras suben las demás
+    ready = []
+    for part in parts:
+        if part['status'] != 'completed':
+            break
+        ready.append(part['public_id'])
+    cloudinary_url = None
+    if ready:
+        cloudinary_url = spliced_video_url(ready, transformation=VIDEO_EAGER)
+
+    partes = []
+    for part in parts:
+        local_url = None
+        if part.get('path'):
+            local_url = url_for(
+                'analisis_postural.download_video', filename=os.path.basename(part['path']), _external=True
+            )
+        partes.append({
+            'upload_status': part['status'],
+            'url': part.get('url') or local_url,
+            'cloudinary_url': part.get('url')
+        })
+
+    return {
+        'id': video_id,
+        'upload_status': status,
+        'video_resultado_url': cloudinary_url or (partes[0]['url'] if partes else None),
+        'cloudinary_url': cloudinary_url,
+        'partes_subidas': len(ready),
+        'partes': partes,
+        'bytes_subidos': sum(p.get('offset', 0) for p in parts),
+        'intentos': sum(p.get('attempts', 0) for p in parts),
+        'error': next((p.get('error') for p in parts if p['status'] == 'failed'), None)
+    }
+
+
+@analisis_postural_bp.route('/almacenamiento', methods=['GET'])
+def almacenamiento():
+    return jsonify(current_app.extensions['video_storage'].stats()), 200
+
+
 @analisis_postural_bp.route('/test', methods=['GET'])
 def test():
     return jsonify({
@@ -88,7 +507,12 @@ def info():
         'description': 'Módulo para análisis de postura en tiempo real usando videos con MediaPipe y OpenCV',
         'endpoints': {
             'POST /analizar-postura': 'Analizar postura desde un video',
-            'GET /download/<filename>': 'Descargar video procesado',
+            'POST /uploads': 'Crear una subida reanudable por partes (protocolo tus: HEAD/PATCH/DELETE /uploads/<id>)',
+            'POST /uploads/<id>/analizar': 'Analizar un video subido por partes, incluso antes de que termine de llegar',
+            'GET /download/<filename>': 'Descargar video procesado (410 si ya fue eliminado)',
+            'GET /momentos/<filename>': 'Miniatura JPEG de uno de los peores momentos del video',
+            'GET /almacenamiento': 'Uso de disco de los archivos de trabajo',
+            'GET /video/<id>': 'Estado de la subida a Cloudinary y URL actual del video',
             'GET /test': 'Verificar estado del módulo',
             'GET /info': 'Información del módulo'
         },
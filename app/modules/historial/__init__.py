@@ -0,0 +1,3 @@
+"""
+Módulo de historial de análisis y tendencias por cliente
+"""
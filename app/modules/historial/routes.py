@@ -0,0 +1,162 @@
+from flask import Blueprint, current_app, request, jsonify
+import hmac
+import time
+from datetime import datetime, timedelta, timezone
+from app.utils.encoding import encode_response
+from app.utils.history import history_client_id
+from app.utils.upload_manager import get_upload_manager
+
+historial_bp = Blueprint('historial', __name__)
+
+TIPOS = ('imagen', 'video')
+
+
+def _history():
+    return current_app.extensions.get('history')
+
+
+def _client_scope():
+    """
+    Cliente cuyo historial se consulta: el usuario autenticado con X-User-Token. Con
+    HISTORY_ADMIN_TOKEN, ?cliente=<id> consulta otro y ?cliente=* todos.
+    """
+    requested = request.args.get('cliente')
+    if requested is None:
+        user_id = history_client_id(request)
+        if user_id is None:
+            raise PermissionError('Consultar el historial requiere un X-User-Token válido')
+        return user_id
+
+    token = current_app.config['HISTORY_ADMIN_TOKEN']
+    if not token or not hmac.compare_digest(request.headers.get('X-History-Token', ''), token):
+        raise PermissionError('Consultar otro cliente requiere X-History-Token')
+    return None if requested == '*' else requested
+
+
+def _parse_day(value):
+    """Fecha YYYY-MM-DD (UTC) o marca de tiempo en segundos"""
+    try:
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise ValueError(f'Fecha inválida: {value} (usa YYYY-MM-DD o segundos desde epoch)')
+
+
+def _kind():
+    kind = request.args.get('tipo')
+    if kind is not None and kind not in TIPOS:
+        raise ValueError(f'tipo debe ser uno de: {", ".join(TIPOS)}')
+    return kind
+
+
+@historial_bp.route('/analisis', methods=['GET'])
+def listar_analisis():
+    history = _history()
+    if history is None:
+        return jsonify({'error': 'El historial está desactivado'}), 404
+
+    try:
+        client_id = _client_scope()
+        kind = _kind()
+        since = _parse_day(request.args['desde']).timestamp() if 'desde' in request.args else None
+        until = None
+        if 'hasta' in request.args:
+            # hasta=YYYY-MM-DD incluye todo ese día
+            until_dt = _parse_day(request.args['hasta'])
+            until = (until_dt + timedelta(days=1)).timestamp() if '-' in request.args['hasta'] else until_dt.timestamp()
+        before = float(request.args['antes']) if 'antes' in request.args else None
+        limit = min(max(1, int(request.args.get('limite', 50))), 500)
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    started = time.perf_counter()
+    items = history.recent(client_id, since=since, until=until, kind=kind, before=before, limit=limit)
+    return encode_response({
+        'analisis': items,
+        # Cursor para la página siguiente: ?antes=<created_at del último>
+        'siguiente': items[-1]['created_at'] if len(items) == limit else None,
+        'query_ms': round((time.perf_counter() - started) * 1000, 2)
+    })
+
+
+@historial_bp.route('/analisis/<analysis_id>', methods=['GET'])
+def detalle_analisis(analysis_id):
+    history = _history()
+    if history is None:
+        return jsonify({'error': 'El historial está desactivado'}), 404
+
+    try:
+        client_id = _client_scope()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+
+    item = history.get(analysis_id)
+    if item is None or (client_id is not None and item['client_id'] != client_id):
+        return jsonify({'error': 'Análisis no encontrado'}), 404
+
+    if item['kind'] == 'video':
+        # La URL local caduca; si la subida a Cloudinary ya terminó se agrega la definitiva
+        state = get_upload_manager().status(analysis_id)
+        if state and state.get('status') == 'completed':
+            item['video_url'] = state.get('url')
+    return encode_response(item)
+
+
+@historial_bp.route('/tendencia', methods=['GET'])
+def tendencia():
+    history = _history()
+    if history is None:
+        return jsonify({'error': 'El historial está desactivado'}), 404
+
+    try:
+        client_id = _client_scope()
+        kind = _kind()
+        until_day = _parse_day(request.args['hasta']) if 'hasta' in request.args else datetime.now(timezone.utc)
+        since_day = (
+            _parse_day(request.args['desde']) if 'desde' in request.args
+            else until_day - timedelta(days=int(request.args.get('dias', 30)) - 1)
+        )
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    started = time.perf_counter()
+    points = history.trend(
+        client_id, since_day=since_day.strftime('%Y-%m-%d'), until_day=until_day.strftime('%Y-%m-%d'), kind=kind
+    )
+    return encode_response({
+        'desde': since_day.strftime('%Y-%m-%d'),
+        'hasta': until_day.strftime('%Y-%m-%d'),
+        'tendencia': points,
+        'query_ms': round((time.perf_counter() - started) * 1000, 2)
+    })
+
+
+@historial_bp.route('/test', methods=['GET'])
+def test():
+    return jsonify({
+        'module': 'historial',
+        'status': 'operational' if _history() is not None else 'disabled',
+        'version': '1.0.0'
+    }), 200
+
+
+@historial_bp.route('/info', methods=['GET'])
+def info():
+    return jsonify({
+        'module': 'Historial de análisis',
+        'description': 'Análisis de imágenes y videos guardados por usuario (X-User-Token firmado) y tendencias diarias precalculadas',
+        'endpoints': {
+            'GET /analisis': 'Análisis del cliente, más recientes primero (?desde, ?hasta, ?tipo, ?antes, ?limite)',
+            'GET /analisis/<id>': 'Detalle de un análisis: ángulos, veredicto, estadísticas y URL',
+            'GET /tendencia': 'Un punto por día con el porcentaje de posturas correctas y ángulos promedio (?desde, ?hasta, ?dias, ?tipo)',
+            'GET /test': 'Verificar estado del módulo',
+            'GET /info': 'Información del módulo'
+        }
+    }), 200
@@ -0,0 +1,3 @@
+"""
+Módulo de reevaluación de landmarks guardados con nuevos perfiles de umbrales
+"""
@@ -0,0 +1,142 @@
+from flask import Blueprint, current_app, request, jsonify
+import io
+import json
+import os
+import time
+import numpy as np
+from werkzeug.utils import secure_filename
+from app.utils.encoding import encode_response
+from app.utils.mediapipe_helper import LANDMARK_NAMES
+from app.utils.rescoring import CHECKS, Dataset, ProfileError, load_profiles, rescore, resolve_profile
+from app.utils.scheduler import AdmissionRejected, get_client_id, get_scheduler, rejection_response
+
+reevaluacion_bp = Blueprint('reevaluacion', __name__)
+
+
+def _datasets_folder():
+    return current_app.config['RESCORING_DATA_FOLDER']
+
+
+def _request_params():
+    """Parámetros del JSON o, si se sube un .npy, de los campos del formulario"""
+    if request.files:
+        custom = request.form.get('custom')
+        return {
+            'profiles': [p for p in request.form.get('profiles', '').split(',') if p],
+            'custom': json.loads(custom) if custom else {}
+        }
+    return request.get_json(silent=True) or {}
+
+
+def _load_landmarks(params):
+    """(landmarks, veredictos guardados o None, nombre)"""
+    if 'landmarks' in request.files:
+        landmarks = np.load(io.BytesIO(request.files['landmarks'].read()), allow_pickle=False)
+        if landmarks.ndim != 3 or landmarks.shape[1] != len(LANDMARK_NAMES) or landmarks.shape[2] < 2:
+            raise ValueError(f'El arreglo debe tener forma (N, {len(LANDMARK_NAMES)}, 3)')
+        return landmarks, None, request.files['landmarks'].filename
+
+    name = secure_filename(params.get('dataset') or '')
+    path = os.path.join(_datasets_folder(), name)
+    if not name or not os.path.exists(os.path.join(path, 'landmarks.npy')):
+        return None, None, name
+    dataset = Dataset(path)
+    return dataset.landmarks, dataset.verdicts, name
+
+
+@reevaluacion_bp.route('/reevaluar', methods=['POST'])
+def reevaluar():
+    try:
+        params = _request_params()
+        available = load_profiles(current_app.config['RESCORING_PROFILES_FILE'])
+
+        profiles = {}
+        for name in params.get('profiles') or []:
+            if name not in available:
+                return jsonify({'error': f'Perfil desconocido: {name}', 'disponibles': list(available)}), 400
+            profiles[name] = available[name]
+        for name, definition in (params.get('custom') or {}).items():
+            profiles[name] = resolve_profile(definition, available)
+        if not profiles:
+            profiles = available
+
+        landmarks, verdicts, dataset = _load_landmarks(params)
+        if landmarks is None:
+            return jsonify({'error': 'Indica un dataset existente o sube un archivo .npy en el campo landmarks'}), 404
+
+        started = time.perf_counter()
+        # Solo NumPy, sin inferencia, pero puede recorrer millones de filas: cede ante las interactivas
+        with get_scheduler().slot('batch', get_client_id(request)):
+            summaries = rescore(
+                landmarks, profiles, verdicts=verdicts,
+                chunk_rows=current_app.config['RESCORING_CHUNK_ROWS']
+            )
+        elapsed = time.perf_counter() - started
+
+        return encode_response({
+            'status': 'success',
+            'dataset': dataset,
+            'rows': len(landmarks),
+            'profiles': summaries,
+            'seconds': round(elapsed, 3)
+        })
+
+    except AdmissionRejected as e:
+        return rejection_response(e)
+
+    except (ProfileError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    except Exception as e:
+        return jsonify({'error': f'Error al reevaluar: {str(e)}'}), 500
+
+
+@reevaluacion_bp.route('/perfiles', methods=['GET'])
+def perfiles():
+    try:
+        available = load_profiles(current_app.config['RESCORING_PROFILES_FILE'])
+    except ProfileError as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'checks': {check: list(angles) for check, angles in CHECKS.items()},
+        'profiles': {
+            name: {check: list(limits) if limits else None for check, limits in thresholds.items()}
+            for name, thresholds in available.items()
+        }
+    }), 200
+
+
+@reevaluacion_bp.route('/datasets', methods=['GET'])
+def datasets():
+    folder = _datasets_folder()
+    result = []
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            if os.path.exists(os.path.join(folder, name, 'landmarks.npy')):
+                dataset = Dataset(os.path.join(folder, name))
+                result.append({'name': name, 'rows': len(dataset), 'verdicts': dataset.verdicts is not None})
+    return jsonify({'datasets': result}), 200
+
+
+@reevaluacion_bp.route('/test', methods=['GET'])
+def test():
+    return jsonify({
+        'module': 'reevaluacion',
+        'status': 'operational',
+        'version': '1.0.0'
+    }), 200
+
+
+@reevaluacion_bp.route('/info', methods=['GET'])
+def info():
+    return jsonify({
+        'module': 'Reevaluación de posturas',
+        'description': 'Recalcula ángulos y veredictos de landmarks guardados con otros umbrales, sin volver a ejecutar la inferencia',
+        'endpoints': {
+            'POST /reevaluar': 'Reevaluar un dataset ({"dataset", "profiles", "custom"}) o un .npy subido en el campo landmarks',
+            'GET /perfiles': 'Perfiles de umbrales disponibles',
+            'GET /datasets': 'Datasets de landmarks disponibles en el servidor',
+            'GET /test': 'Verificar estado del módulo',
+            'GET /info': 'Información del módulo'
+        }
+    }), 200
@@ -0,0 +1,321 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Rutas con versión async: endpoint de Flask -> corrutina
+ASYNC_VIEWS = {}
+
+# Cuerpos mayores que esto se guardan en disco mientras se reciben
+SPOOL_MAX_SIZE = 1024 * 1024
+
+_settings = {'cpu_threads': 0, 'blocking_threads': 64}
+_executors = {}
+_executors_pid = None
+_executors_lock = threading.Lock()
+_background_tasks = set()
+
+
+def async_view(endpoint):
+    """Registra la versión async de una ruta; solo se usa al servir con asgi:app"""
+    def decorator(view):
+        ASYNC_VIEWS[endpoint] = view
+        return view
+
+    return decorator
+
+
+def _executor(kind):
+    """Ejecutores del worker; sus hilos no sobreviven a un fork, así que se crean por pid"""
+    global _executors_pid
+
+    if _executors_pid != os.getpid():
+        with _executors_lock:
+            if _executors_pid != os.getpid():
+                _executors.clear()
+                _executors_pid = os.getpid()
+
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                if kind == 'cpu':
+                    size = _settings['cpu_threads'] or _cpu_slots()
+                else:
+                    size = _settings['blocking_threads']
+                executor = _executors[kind] = ThreadPoolExecutor(
+                    max_workers=max(1, size), thread_name_prefix=f'asgi-{kind}'
+                )
+    return executor
+
+
+def _cpu_slots():
+    # Los slots del planificador ya reflejan los núcleos asignados al worker en post_fork
+    from flask import current_app
+
+    try:
+        return current_app.extensions['scheduler'].cpu_slots
+    except (RuntimeError, KeyError):
+        return os.cpu_count() or 1
+
+
+def _run_in(kind, func, *args, **kwargs):
+    # El contexto (solicitud de Flask, perfil, memoria) viaja con la tarea al hilo
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return asyncio.get_running_loop().run_in_executor(_executor(kind), call)
+
+
+def run_cpu(func, *args, **kwargs):
+    """Ejecuta una etapa de CPU (inferencia, video, codificación) en el ejecutor acotado del worker"""
+    return _run_in('cpu', func, *args, **kwargs)
+
+
+def run_blocking(func, *args, **kwargs):
+    """Ejecuta código que espera (admisión, locks, rutas síncronas) sin bloquear el event loop"""
+    return _run_in('blocking', func, *args, **kwargs)
+
+
+def spawn(coro):
+    """Tarea en segundo plano que sigue después de responder (se guarda una referencia)"""
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def shutdown_executors():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
+
+
+class ClientDisconnected(Exception):
+    """El cliente cerró la conexión antes de terminar de enviar o recibir"""
+
+
+def _environ(scope, body, size):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _asgi_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+class AsgiApp:
+    """
+    Sirve la aplicación Flask por ASGI (uvicorn).
+
+    Las rutas con versión async (@async_view) corren en el event loop: la E/S de red
+    (Cloudinary, OpenAI) se espera sin ocupar un hilo y las etapas de CPU van a un
+    ejecutor acotado, así que un worker mantiene muchas solicitudes en curso. El resto
+    de las rutas se ejecuta tal cual, como WSGI, en el ejecutor de tareas bloqueantes.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.max_body = flask_app.config['MAX_CONTENT_LENGTH']
+        self.async_views = ASYNC_VIEWS if flask_app.config['ASGI_ASYNC_VIEWS'] else {}
+        _settings.update(
+            cpu_threads=flask_app.config['ASGI_CPU_THREADS'],
+            blocking_threads=flask_app.config['ASGI_BLOCKING_THREADS']
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        try:
+            body, size = await self._read_body(receive)
+        except ClientDisconnected:
+            return
+        if body is None:
+            await self._send_json(send, 413, {'error': 'La solicitud supera el tamaño máximo permitido'})
+            return
+
+        try:
+            environ = _environ(scope, body, size)
+            view = self._async_view(environ)
+            if view is not None:
+                await self._call_async(view, environ, send)
+            else:
+                await self._call_wsgi(environ, receive, send)
+        finally:
+            body.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Sin gunicorn (uvicorn asgi:app) no hay post_fork que inicie el calentamiento
+                from app.utils.models import registry
+                if not registry.ready:
+                    registry.start_warmup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                shutdown_executors()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        """(archivo, tamaño) con el cuerpo completo; (None, 0) si supera MAX_CONTENT_LENGTH"""
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body is not None and size > self.max_body:
+                body.close()
+                return None, 0
+            body.write(chunk)
+            if not message.get('more_body'):
+                body.seek(0)
+                return body, size
+
+    def _async_view(self, environ):
+        from werkzeug.exceptions import HTTPException
+
+        if not self.async_views:
+            return None
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None
+        return self.async_views.get(endpoint)
+
+    async def _call_async(self, view, environ, send):
+        from flask import request
+
+        app = self.flask_app
+        # El contexto de la solicitud vive en la tarea: se conserva entre los await
+        ctx = app.request_context(environ)
+        ctx.push()
+        try:
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        # El multipart se separa fuera del event loop
+                        await run_blocking(lambda: request.files)
+                        rv = await view(**request.view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                response = app.finalize_request(app.handle_exception(e), from_error_handler=True)
+
+            body = response.get_data()
+            await send({
+                'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': _asgi_headers(response.headers.items())
+            })
+            await send({'type': 'http.response.body', 'body': body})
+            response.close()
+        finally:
+            ctx.pop()
+
+    async def _call_wsgi(self, environ, receive, send):
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        def send_from_thread(message):
+            # Un stream (SSE) a un cliente que se fue se corta como con gthread: al escribir
+            if disconnected.is_set():
+                raise ClientDisconnected()
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            start = {}
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and start.get('sent'):
+                    raise exc_info[1].with_traceback(exc_info[2])
+                start['message'] = {
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': _asgi_headers(headers)
+                }
+                return write
+
+            def write(data):
+                if not start.get('sent'):
+                    send_from_thread(start['message'])
+                    start['sent'] = True
+                if data:
+                    send_from_thread({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+            result = self.flask_app(environ, start_response)
+            try:
+                for chunk in result:
+                    write(chunk)
+                write(b'')
+                send_from_thread({'type': 'http.response.body', 'body': b''})
+            except ClientDisconnected:
+                pass
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        watcher = loop.create_task(watch_disconnect())
+        try:
+            await run_blocking(run)
+        finally:
+            watcher.cancel()
+
+    async def _send_json(self, send, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,206 @@
+import base64
+import binascii
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import cv2
+
+from app.utils.metrics import UPLOAD_BYTES, observe_stage
+
+# Protocolo de subida reanudable basado en tus 1.0 (creation, checksum, termination)
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,checksum,termination'
+CHECKSUM_ALGORITHMS = ('sha1', 'md5', 'sha256')
+
+READ_SIZE = 1024 * 1024
+
+
+class ChunkedUploadError(Exception):
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class ChunkedUploadStore:
+    """
+    Subidas por partes escritas directamente a disco.
+
+    Cada subida tiene un archivo de datos (<id>.part) y uno de metadatos (<id>.json).
+    El offset es siempre el tamaño real del archivo de datos, así que cualquier
+    worker del nodo puede atender la siguiente parte o reanudar tras un corte.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(folder, exist_ok=True)
+
+    def data_path(self, upload_id):
+        return os.path.join(self.folder, f'{upload_id}.part')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.folder, f'{upload_id}.json')
+
+    def create(self, length, filename):
+        if length <= 0:
+            raise ChunkedUploadError('Upload-Length inválido', 400)
+        if length > self.max_size:
+            raise ChunkedUploadError(f'El video supera el máximo de {self.max_size} bytes', 413)
+
+        upload_id = str(uuid.uuid4())
+        with open(self._meta_path(upload_id), 'w') as f:
+            json.dump({'length': length, 'filename': filename, 'created_at': time.time()}, f)
+        open(self.data_path(upload_id), 'wb').close()
+        return upload_id
+
+    def info(self, upload_id):
+        try:
+            uuid.UUID(upload_id)
+            with open(self._meta_path(upload_id)) as f:
+                meta = json.load(f)
+            meta['offset'] = os.path.getsize(self.data_path(upload_id))
+        except (ValueError, OSError):
+            raise ChunkedUploadError('Subida no encontrada', 404)
+        meta['complete'] = meta['offset'] >= meta['length']
+        return meta
+
+    def append(self, upload_id, offset, stream, checksum=None):
+        """Escribe una parte en offset leyendo el stream por bloques; devuelve el nuevo offset"""
+        meta = self.info(upload_id)
+        hasher, expected = _parse_checksum(checksum)
+
+        with open(self.data_path(upload_id), 'r+b') as f:
+            # Dos partes de la misma subida no pueden escribirse a la vez
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise ChunkedUploadError('La subida está recibiendo otra parte', 423)
+
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise ChunkedUploadError(f'Upload-Offset no coincide (actual {current})', 409)
+
+            f.seek(offset)
+            written = 0
+            while True:
+                block = stream.read(READ_SIZE)
+                if not block:
+                    break
+                if offset + written + len(block) > meta['length']:
+                    f.truncate(offset)
+                    raise ChunkedUploadError('La parte excede Upload-Length', 413)
+                f.write(block)
+                if hasher is not None:
+                    hasher.update(block)
+                written += len(block)
+
+            if hasher is not None and hasher.digest() != expected:
+                f.truncate(offset)
+                raise ChunkedUploadError('Checksum de la parte no coincide', 460)
+
+            f.flush()
+
+        UPLOAD_BYTES.labels('chunked_video').inc(written)
+        return offset + written
+
+    def delete(self, upload_id):
+        for path in (self.data_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _parse_checksum(header):
+    if not header:
+        return None, None
+    algorithm, _, value = header.partition(' ')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ChunkedUploadError(f'Algoritmo de checksum no soportado: {algorithm}', 400)
+    try:
+        expected = base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise ChunkedUploadError('Upload-Checksum inválido', 400)
+    return hashlib.new(algorithm), expected
+
+
+def parse_metadata(header):
+    """Upload-Metadata: pares 'clave valor_base64' separados por comas"""
+    metadata = {}
+    for pair in (header or '').split(','):
+        key, _, value = pair.strip().partition(' ')
+        if key:
+            try:
+                metadata[key] = base64.b64decode(value).decode('utf-8') if value else ''
+            except (binascii.Error, UnicodeDecodeError):
+                raise ChunkedUploadError('Upload-Metadata inválido', 400)
+    return metadata
+
+
+def iter_frames_while_uploading(store, upload_id, min_growth=2 * 1024 * 1024,
+                                poll_interval=0.25, stall_timeout=120, hold=None):
+    """
+    Cuadros del video mientras la subida sigue llegando.
+
+    Decodifica el prefijo ya recibido, y cuando llegan min_growth bytes más vuelve a
+    abrir el archivo y continúa desde el último cuadro entregado. El último cuadro
+    decodificado de un archivo incompleto se descarta (puede estar truncado) y se
+    vuelve a leer en la siguiente pasada. Los contenedores con el índice al final
+    (MP4 sin faststart) no se pueden abrir hasta que la subida termina.
+
+    hold devuelve un context manager (p. ej. un slot del planificador) que se mantiene
+    mientras se decodifica una pasada y el consumidor procesa sus cuadros; se suelta
+    mientras se espera a que lleguen más datos.
+    """
+    hold = hold or contextlib.nullcontext
+    path = store.data_path(upload_id)
+    position = 0
+    last_size = -1
+    seen_size = -1
+    last_progress = time.monotonic()
+
+    while True:
+        meta = store.info(upload_id)
+        if meta['offset'] != seen_size:
+            seen_size = meta['offset']
+            last_progress = time.monotonic()
+
+        if meta['complete'] or meta['offset'] - max(last_size, 0) >= min_growth:
+            last_size = meta['offset']
+            with hold():
+                cap = cv2.VideoCapture(path)
+                if cap.isOpened():
+                    if position:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+                    pending = None
+                    while True:
+                        ret, frame = cap.read()
+                        if not ret:
+                            break
+                        if pending is not None:
+                            position += 1
+                            yield pending
+                        pending = frame
+                    cap.release()
+                    if pending is not None and meta['complete']:
+                        position += 1
+                        yield pending
+                elif meta['complete']:
+                    raise ValueError('No se pudo abrir el video')
+
+            if meta['complete']:
+                return
+
+        if time.monotonic() - last_progress > stall_timeout:
+            raise ValueError('La subida del video se detuvo')
+
+        start = time.perf_counter()
+        time.sleep(poll_interval)
+        observe_stage('upload_wait', time.perf_counter() - start)
@@ -1,38 +1,59 @@
 import cloudinary.uploader
-from io import BytesIO
-import base64
+from app.utils.memory import hold_buffer, release_buffer
+from app.utils.metrics import stage
+from app.utils.upload_manager import get_upload_manager
+
+def encode_image(image, extension='.jpg'):
+    import cv2
+
+    with stage('imencode'):
+        ok, buffer = cv2.imencode(extension, image)
+    if not ok:
+        raise ValueError('No se pudo codificar la imagen')
+    return buffer
+
 
 def upload_image(image_data, folder='uploads', public_id=None):
 
     try:
-        upload_options = {
-            'folder': folder,
-            'resource_type': 'image',
-            'overwrite': True
+        upload_options = _upload_options(folder, public_id)
+
+        # El JPEG se entrega al uploader como vista del buffer de imencode, sin copiarlo
+        if hasattr(image_data, 'shape'):
+            image_data = memoryview(encode_image(image_data)).cast('B')
+        elif hasattr(image_data, 'read'):
+            image_data = image_data.read()
+        hold_buffer('jpeg', image_data)
+
+        # El manager limita las subidas simultáneas del worker y reintenta los errores transitorios
+        result = get_upload_manager().upload(image_data, **upload_options)
+        return _upload_result(result)
+
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
         }
 
-        if public_id:
-            upload_options['public_id'] = public_id
+    finally:
+        release_buffer('jpeg')
 
 
-        if hasattr(image_data, 'shape'):
-            import cv2
+async def upload_image_async(image_data, folder='uploads', public_id=None):
+    """upload_image para el modo ASGI: la codificación va al ejecutor de CPU y la subida no detiene el event loop"""
+    from app.utils.asgi import run_cpu
 
-            _, buffer = cv2.imencode('.jpg', image_data)
-            image_bytes = BytesIO(buffer.tobytes())
-            result = cloudinary.uploader.upload(image_bytes, **upload_options)
+    try:
+        upload_options = _upload_options(folder, public_id)
 
-        else:
-            result = cloudinary.uploader.upload(image_data, **upload_options)
+        if hasattr(image_data, 'shape'):
+            image_data = memoryview(await run_cpu(encode_image, image_data)).cast('B')
+        elif hasattr(image_data, 'read'):
+            image_data = image_data.read()
+        hold_buffer('jpeg', image_data)
 
-        return {
-            'success': True,
-            'url': result['secure_url'],
-            'public_id': result['public_id'],
-            'format': result['format'],
-            'width': result['width'],
-            'height': result['height']
-        }
+        result = await get_upload_manager().upload_async(image_data, **upload_options)
+        return _upload_result(result)
 
     except Exception as e:
         return {
@@ -40,6 +61,32 @@ def upload_image(image_data, folder='uploads', public_id=None):
             'error': str(e)
         }
 
+    finally:
+        release_buffer('jpeg')
+
+
+def _upload_options(folder, public_id):
+    upload_options = {
+        'folder': folder,
+        'resource_type': 'image',
+        'overwrite': True
+    }
+
+    if public_id:
+        upload_options['public_id'] = public_id
+    return upload_options
+
+
+def _upload_result(result):
+    return {
+        'success': True,
+        'url': result['secure_url'],
+        'public_id': result['public_id'],
+        'format': result['format'],
+        'width': result['width'],
+        'height': result['height']
+    }
+
 
 def delete_image(public_id):
     """
@@ -64,6 +111,26 @@ def delete_image(public_id):
         }
 
 
+def spliced_video_url(public_ids, transformation=None):
+    """
+    URL de Cloudinary que concatena (fl_splice) varios videos ya subidos, en orden,
+    sin volver a subir el video completo.
+    """
+    from cloudinary.utils import cloudinary_url
+
+    steps = []
+    for public_id in public_ids[1:]:
+        steps.append({'overlay': 'video:' + public_id.replace('/', ':'), 'flags': 'splice'})
+        steps.append({'flags': 'layer_apply'})
+    if transformation:
+        steps.extend(transformation)
+
+    url, _ = cloudinary_url(
+        public_ids[0], resource_type='video', format='mp4', secure=True, transformation=steps
+    )
+    return url
+
+
 def get_image_url(public_id, transformations=None):
 
     try:
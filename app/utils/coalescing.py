@@ -0,0 +1,304 @@
+import asyncio
+import base64
+import fcntl
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from app.utils.metrics import COALESCED_REQUESTS
+
+# Cabeceras de la respuesta que se comparten con las solicitudes duplicadas
+SHARED_HEADERS = ('Content-Type', 'Retry-After', 'Vary', 'Server-Timing')
+
+
+class _Call:
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """
+    Coalescencia de solicitudes idénticas en curso.
+
+    Dentro del proceso, los duplicados esperan al hilo que calcula el resultado.
+    Entre workers del nodo, el primero toma un lock de archivo por clave y deja el
+    resultado en disco al terminar; los demás esperan ese lock y leen el resultado.
+    Los resultados solo se reutilizan durante `linger` segundos: no es una caché.
+    """
+
+    def __init__(self, folder, wait_timeout=300, linger=5):
+        self.folder = folder
+        self.wait_timeout = wait_timeout
+        self.linger = linger
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(folder, exist_ok=True)
+
+    def run(self, key, compute):
+        """Devuelve (resultado, compartido); compute() debe devolver un dict serializable"""
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            COALESCED_REQUESTS.labels('follower').inc()
+            call.event.wait(self.wait_timeout)
+            if call.result is not None:
+                return call.result, True
+            # El líder falló sin resultado: esta solicitud se calcula por su cuenta
+            return compute(), False
+
+        try:
+            call.result, shared = self._run_across_workers(key, compute)
+            return call.result, shared
+        finally:
+            call.event.set()
+            with self._lock:
+                self._inflight.pop(key, None)
+            self._sweep()
+
+    def _paths(self, key):
+        return os.path.join(self.folder, f'{key}.lock'), os.path.join(self.folder, f'{key}.json')
+
+    def _read_result(self, path, since):
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return result if result.get('finished_at', 0) >= since else None
+
+    def _run_across_workers(self, key, compute):
+        lock_path, result_path = self._paths(key)
+        started = time.time()
+
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Otro worker está calculando la misma solicitud
+                COALESCED_REQUESTS.labels('follower').inc()
+                deadline = time.monotonic() + self.wait_timeout
+                while True:
+                    time.sleep(0.05)
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() > deadline:
+                            return compute(), False
+
+                result = self._read_result(result_path, started)
+                if result is not None:
+                    return result, True
+            else:
+                # Un duplicado que llega justo después de terminar el líder
+                result = self._read_result(result_path, started - self.linger)
+                if result is not None:
+                    COALESCED_REQUESTS.labels('follower').inc()
+                    return result, True
+
+            COALESCED_REQUESTS.labels('leader').inc()
+            result = compute()
+            self._write_result(result_path, result)
+            return result, False
+
+    async def run_async(self, key, compute):
+        """
+        run() para corrutinas (modo ASGI): compute es async y las esperas a otra
+        solicitud o a otro worker se hacen con asyncio.sleep, sin ocupar hilos.
+        """
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            COALESCED_REQUESTS.labels('follower').inc()
+            deadline = time.monotonic() + self.wait_timeout
+            while not call.event.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            if call.result is not None:
+                return call.result, True
+            return await compute(), False
+
+        try:
+            call.result, shared = await self._run_across_workers_async(key, compute)
+            return call.result, shared
+        finally:
+            call.event.set()
+            with self._lock:
+                self._inflight.pop(key, None)
+            self._sweep()
+
+    async def _run_across_workers_async(self, key, compute):
+        lock_path, result_path = self._paths(key)
+        started = time.time()
+
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                COALESCED_REQUESTS.labels('follower').inc()
+                deadline = time.monotonic() + self.wait_timeout
+                while True:
+                    await asyncio.sleep(0.05)
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() > deadline:
+                            return await compute(), False
+
+                result = self._read_result(result_path, started)
+                if result is not None:
+                    return result, True
+            else:
+                result = self._read_result(result_path, started - self.linger)
+                if result is not None:
+                    COALESCED_REQUESTS.labels('follower').inc()
+                    return result, True
+
+            COALESCED_REQUESTS.labels('leader').inc()
+            result = await compute()
+            self._write_result(result_path, result)
+            return result, False
+
+    def _write_result(self, result_path, result):
+        result['finished_at'] = time.time()
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, result_path)
+
+    def _sweep(self):
+        """Elimina resultados y locks viejos, como máximo una vez por minuto"""
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                age = now - os.path.getmtime(path)
+                if name.endswith('.json') and age > max(60, self.linger):
+                    os.remove(path)
+                elif name.endswith('.lock') and age > 2 * self.wait_timeout:
+                    with open(path, 'a') as f:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.remove(path)
+            except (OSError, BlockingIOError):
+                pass
+
+
+def _request_key(file_field):
+    """
+    Clave de la solicitud: Idempotency-Key del cliente si la envía o, si no, el
+    hash del archivo subido. Incluye la ruta, los parámetros, el formato pedido y
+    el cliente: la respuesta (id del análisis, historial, URLs) es de quien la pidió.
+    """
+    from app.utils.history import history_client_id
+    from app.utils.scheduler import get_client_id
+
+    digest = hashlib.sha256()
+    digest.update(request.path.encode())
+    digest.update(request.query_string)
+    digest.update(request.headers.get('Accept', '').encode())
+    digest.update(b'\0' + get_client_id(request).encode() + b'\0' + (history_client_id(request) or '').encode())
+
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        digest.update(b'idempotency\0' + idempotency_key.encode())
+    elif file_field:
+        file = request.files.get(file_field)
+        if file is None:
+            return None
+        stream = file.stream
+        for block in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(block)
+        stream.seek(0)
+
+    return digest.hexdigest()
+
+
+def _serialize(response):
+    return {
+        'status': response.status_code,
+        'headers': {k: response.headers[k] for k in SHARED_HEADERS if k in response.headers},
+        'body': base64.b64encode(response.get_data()).decode('ascii')
+    }
+
+
+def _deserialize(result, shared):
+    response = make_response(base64.b64decode(result['body']), result['status'])
+    for key, value in result['headers'].items():
+        response.headers[key] = value
+    if shared:
+        response.headers['X-Coalesced'] = 'true'
+    return response
+
+
+def coalesced(file_field=None):
+    """
+    Las solicitudes idénticas en curso (mismo archivo o mismo Idempotency-Key)
+    comparten un único cálculo y reciben la misma respuesta.
+    """
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                from app.utils.asgi import run_blocking
+
+                single_flight = current_app.extensions.get('single_flight')
+                key = await run_blocking(_request_key, file_field) if single_flight is not None else None
+                if key is None:
+                    return await view(*args, **kwargs)
+
+                async def compute():
+                    return _serialize(make_response(await view(*args, **kwargs)))
+
+                result, shared = await single_flight.run_async(key, compute)
+                return _deserialize(result, shared)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            single_flight = current_app.extensions.get('single_flight')
+            key = _request_key(file_field) if single_flight is not None else None
+            if key is None:
+                return view(*args, **kwargs)
+
+            result, shared = single_flight.run(key, lambda: _serialize(make_response(view(*args, **kwargs))))
+            return _deserialize(result, shared)
+
+        return wrapper
+
+    return decorator
+
+
+def init_coalescing(app):
+    single_flight = None
+    if app.config['COALESCING_ENABLED']:
+        single_flight = SingleFlight(
+            app.config['COALESCING_FOLDER'],
+            wait_timeout=app.config['COALESCING_WAIT_TIMEOUT'],
+            linger=app.config['COALESCING_LINGER']
+        )
+    app.extensions['single_flight'] = single_flight
+    return single_flight
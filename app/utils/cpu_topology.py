@@ -0,0 +1,120 @@
+import math
+import os
+
+
+def _cgroup_cpu_limit():
+    """Núcleos permitidos por la cuota de CPU del contenedor (cgroup v2 o v1), o None"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus():
+    """CPUs en las que puede ejecutarse el proceso (afinidad heredada, p. ej. cpuset)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class CpuTopology:
+    """
+    Reparto de los núcleos del nodo entre los workers de gunicorn.
+
+    Cada worker recibe núcleos / workers hilos de cómputo: el pool de hilos de
+    OpenCV, los slots del planificador y el pool de Pose se limitan a ese número en
+    lugar de dimensionarse cada uno con todos los núcleos del nodo. (MediaPipe ejecuta
+    el grafo en el hilo que llama y TFLite/XNNPACK usa un hilo por inferencia, así que
+    su paralelismo lo fijan los slots.) Con pin=True, cada worker además queda fijado
+    a su propio conjunto de núcleos (solo tiene sentido con núcleos dedicados).
+    """
+
+    def __init__(self, threads_per_worker=0, pin=False, enabled=True):
+        self.threads_per_worker = threads_per_worker
+        self.pin = pin
+        self.enabled = enabled
+        self.cpus = available_cpus()
+        self.cgroup_limit = _cgroup_cpu_limit()
+        self.layout = None
+
+    def plan(self, workers=1, slot=None):
+        cpus = self.cpus
+        budget = len(cpus)
+        if self.cgroup_limit:
+            budget = min(budget, max(1, math.ceil(self.cgroup_limit)))
+
+        workers = max(1, workers)
+        threads = self.threads_per_worker or max(1, budget // workers)
+
+        cores = None
+        if self.pin and slot is not None:
+            # Bloques contiguos; si hay más workers que núcleos, los bloques se repiten
+            start = (slot * threads) % len(cpus)
+            cores = sorted({cpus[(start + i) % len(cpus)] for i in range(threads)})
+
+        return {
+            'enabled': self.enabled,
+            'pid': os.getpid(),
+            'workers': workers,
+            'slot': slot,
+            'cpus_available': len(cpus),
+            'cgroup_cpu_limit': self.cgroup_limit,
+            'threads': threads if self.enabled else None,
+            'cores': cores if self.enabled else None
+        }
+
+    def apply(self, workers=1, slot=None):
+        """Aplica el reparto al proceso actual; llamar antes de crear hilos o grafos"""
+        layout = self.plan(workers, slot)
+        if self.enabled:
+            import cv2
+
+            if layout['cores'] and hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, layout['cores'])
+            cv2.setNumThreads(layout['threads'])
+            layout['opencv_threads'] = cv2.getNumThreads()
+        self.layout = layout
+        return layout
+
+
+def apply_worker_layout(app, workers=1, slot=None):
+    """
+    Aplica el reparto de núcleos y ajusta a él el pool de Pose y los slots del
+    planificador, salvo que POSE_POOL_SIZE o SCHEDULER_CPU_SLOTS estén fijados.
+    """
+    from app.utils.models import registry
+
+    topology = app.extensions['cpu_topology']
+    layout = topology.apply(workers, slot)
+    threads = layout['threads'] or os.cpu_count() or 1
+
+    registry.configure(app.config['POSE_POOL_SIZE'] or threads)
+    scheduler = app.extensions.get('scheduler')
+    if scheduler is not None and not app.config['SCHEDULER_CPU_SLOTS']:
+        scheduler.resize(threads)
+    return layout
+
+
+def init_cpu_topology(app):
+    topology = CpuTopology(
+        threads_per_worker=app.config['CPU_THREADS_PER_WORKER'],
+        pin=app.config['CPU_PINNING'],
+        enabled=app.config['CPU_BUDGET_ENABLED']
+    )
+    app.extensions['cpu_topology'] = topology
+    return topology
@@ -0,0 +1,151 @@
+import gzip
+import struct
+
+from flask import current_app, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+from app.utils.metrics import stage
+
+# Dependencias opcionales: sin ellas se usa json estándar, solo JSON y solo gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+# Tipos que no vale la pena comprimir
+NO_COMPRESS_PREFIXES = ('text/event-stream', 'image/', 'video/', 'application/zip', 'application/gzip')
+
+LANDMARK_FIELDS = ('x', 'y', 'z')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask basado en orjson (serializa también arrays de NumPy)"""
+
+    sort_keys = False
+
+    def _dumps_bytes(self, obj):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def pack_landmarks(landmarks):
+    """
+    Landmarks como arreglo float32 little-endian de N x 3 (x, y, z)
+    más la lista de nombres, en lugar de un dict por punto.
+    """
+    names = list(landmarks)
+    values = []
+    for name in names:
+        point = landmarks[name]
+        values.extend(float(point[field]) for field in LANDMARK_FIELDS)
+    return {
+        'names': names,
+        'fields': list(LANDMARK_FIELDS),
+        'values': struct.pack(f'<{len(values)}f', *values)
+    }
+
+
+def wants_msgpack():
+    if msgpack is None:
+        return False
+    best = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES)
+    return best in MSGPACK_MIMETYPES
+
+
+def encode_response(payload, status=200, landmarks=None):
+    """
+    Respuesta negociada según Accept: MessagePack (con landmarks empaquetados)
+    o JSON. Los landmarks solo se incluyen si se piden con ?landmarks=1.
+    """
+    include_landmarks = landmarks is not None and request.args.get('landmarks') in ('1', 'true')
+
+    if wants_msgpack():
+        if include_landmarks:
+            payload = dict(payload, landmarks=pack_landmarks(landmarks))
+        with stage('serialize'):
+            body = msgpack.packb(payload, use_bin_type=True)
+        response = current_app.response_class(body, status=status, mimetype='application/msgpack')
+    else:
+        if include_landmarks:
+            payload = dict(payload, landmarks=landmarks)
+        with stage('serialize'):
+            response = jsonify(payload)
+        response.status_code = status
+
+    response.vary.add('Accept')
+    return response
+
+
+def _choose_encoding(accept_encodings):
+    """La codificación con mayor q para el cliente (brotli si empatan); None si ninguna tiene q > 0"""
+    candidates = ('br', 'gzip') if brotli is not None else ('gzip',)
+    best = max(candidates, key=accept_encodings.quality)
+    return best if accept_encodings.quality(best) > 0 else None
+
+
+def compress_response(response, min_size=1024, gzip_level=5, brotli_quality=4):
+    """Comprime el cuerpo con brotli o gzip si el cliente lo acepta y supera min_size bytes"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or (response.mimetype or '').startswith(NO_COMPRESS_PREFIXES)):
+        return response
+
+    encoding = _choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    with stage('compress'):
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=brotli_quality)
+        else:
+            compressed = gzip.compress(data, compresslevel=gzip_level)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_encoding(app):
+    if app.config['FAST_JSON'] and orjson is not None:
+        app.json_provider_class = OrjsonProvider
+        app.json = OrjsonProvider(app)
+
+    if app.config['COMPRESSION_ENABLED']:
+        @app.after_request
+        def _compress(response):
+            return compress_response(
+                response,
+                min_size=app.config['COMPRESSION_MIN_SIZE'],
+                gzip_level=app.config['COMPRESSION_GZIP_LEVEL'],
+                brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY']
+            )
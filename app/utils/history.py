@@ -0,0 +1,288 @@
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+
+from app.utils.mediapipe_helper import ANGLE_NAMES, LANDMARK_NAMES
+from app.utils.metrics import stage
+
+_ANGLE_COLUMNS = ', '.join(f'sum_{name} REAL NOT NULL DEFAULT 0' for name in ANGLE_NAMES)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS analyses (
+    id TEXT PRIMARY KEY,
+    client_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    is_good_posture INTEGER,
+    angles TEXT,
+    failed_checks TEXT,
+    total_frames INTEGER,
+    bad_frames INTEGER,
+    fps REAL,
+    media_url TEXT,
+    landmarks BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_client_time ON analyses (client_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_analyses_time ON analyses (created_at);
+
+CREATE TABLE IF NOT EXISTS daily_aggregates (
+    client_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    analyses INTEGER NOT NULL DEFAULT 0,
+    good INTEGER NOT NULL DEFAULT 0,
+    frames INTEGER NOT NULL DEFAULT 0,
+    bad_frames INTEGER NOT NULL DEFAULT 0,
+    angle_count INTEGER NOT NULL DEFAULT 0,
+    {_ANGLE_COLUMNS},
+    PRIMARY KEY (client_id, day, kind)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_day ON daily_aggregates (day);
+"""
+
+_SUMMARY_COLUMNS = (
+    'id', 'client_id', 'kind', 'created_at', 'is_good_posture', 'failed_checks',
+    'total_frames', 'bad_frames', 'fps', 'media_url'
+)
+
+
+def _day(timestamp):
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+def pack_landmarks(landmarks):
+    """Landmarks {nombre: {x, y, z}} como float32 en el orden de LANDMARK_NAMES (252 bytes)"""
+    values = [landmarks[name][axis] for name in LANDMARK_NAMES.values() for axis in ('x', 'y', 'z')]
+    return np.asarray(values, dtype=np.float32).tobytes()
+
+
+class HistoryStore:
+    """
+    Historial local de análisis en SQLite (modo WAL, compartido por los workers del nodo).
+
+    Cada análisis se guarda una sola vez y, en la misma transacción, se suma al agregado
+    diario de su cliente: las consultas de tendencia leen esos agregados en lugar de
+    recorrer los análisis.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _connection(self):
+        # Una conexión por hilo y por proceso (las de antes del fork no se reutilizan)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = self._connect()
+            self._local.pid = os.getpid()
+        return conn
+
+    def record(self, analysis_id, client_id, kind, created_at=None, angles=None, is_good_posture=None,
+               failed_checks=None, total_frames=None, bad_frames=None, fps=None, media_url=None,
+               landmarks=None):
+        """Guarda un análisis; si el id ya existe no hace nada (ni se cuenta dos veces)"""
+        created_at = time.time() if created_at is None else created_at
+        day = _day(created_at)
+        angles = {name: float(value) for name, value in (angles or {}).items()}
+
+        with stage('history_write'):
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                inserted = conn.execute(
+                    'INSERT OR IGNORE INTO analyses (id, client_id, kind, created_at, day, is_good_posture, '
+                    'angles, failed_checks, total_frames, bad_frames, fps, media_url, landmarks) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        analysis_id, client_id, kind, created_at, day,
+                        None if is_good_posture is None else int(bool(is_good_posture)),
+                        json.dumps(angles) if angles else None,
+                        json.dumps(failed_checks, ensure_ascii=False) if failed_checks is not None else None,
+                        total_frames, bad_frames, fps, media_url,
+                        pack_landmarks(landmarks) if landmarks else None
+                    )
+                ).rowcount
+
+                if inserted:
+                    sums = [angles.get(name, 0.0) for name in ANGLE_NAMES]
+                    updates = ', '.join(f'sum_{name} = sum_{name} + excluded.sum_{name}' for name in ANGLE_NAMES)
+                    conn.execute(
+                        f'INSERT INTO daily_aggregates (client_id, day, kind, analyses, good, frames, bad_frames, '
+                        f'angle_count, {", ".join(f"sum_{name}" for name in ANGLE_NAMES)}) '
+                        f'VALUES (?, ?, ?, 1, ?, ?, ?, ?, {", ".join("?" * len(ANGLE_NAMES))}) '
+                        f'ON CONFLICT (client_id, day, kind) DO UPDATE SET '
+                        f'analyses = analyses + 1, good = good + excluded.good, frames = frames + excluded.frames, '
+                        f'bad_frames = bad_frames + excluded.bad_frames, '
+                        f'angle_count = angle_count + excluded.angle_count, {updates}',
+                        [client_id, day, kind, int(bool(is_good_posture)), total_frames or 0, bad_frames or 0,
+                         int(bool(angles))] + sums
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return bool(inserted)
+
+    def recent(self, client_id=None, since=None, until=None, kind=None, before=None, limit=50):
+        """Análisis más recientes primero; `before` (created_at) pagina hacia atrás"""
+        clauses, params = [], []
+        if client_id is not None:
+            clauses.append('client_id = ?')
+            params.append(client_id)
+        if since is not None:
+            clauses.append('created_at >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('created_at < ?')
+            params.append(until)
+        if before is not None:
+            clauses.append('created_at < ?')
+            params.append(before)
+        if kind is not None:
+            clauses.append('kind = ?')
+            params.append(kind)
+
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = self._connection().execute(
+            f'SELECT {", ".join(_SUMMARY_COLUMNS)} FROM analyses {where} ORDER BY created_at DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+        return [_row_dict(row) for row in rows]
+
+    def get(self, analysis_id):
+        row = self._connection().execute(
+            f'SELECT {", ".join(_SUMMARY_COLUMNS)}, angles FROM analyses WHERE id = ?', (analysis_id,)
+        ).fetchone()
+        return _row_dict(row) if row is not None else None
+
+    def trend(self, client_id=None, since_day=None, until_day=None, kind=None):
+        """Un punto por día a partir de los agregados diarios"""
+        clauses, params = [], []
+        if client_id is not None:
+            clauses.append('client_id = ?')
+            params.append(client_id)
+        if since_day is not None:
+            clauses.append('day >= ?')
+            params.append(since_day)
+        if until_day is not None:
+            clauses.append('day <= ?')
+            params.append(until_day)
+        if kind is not None:
+            clauses.append('kind = ?')
+            params.append(kind)
+
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        sums = ', '.join(f'SUM(sum_{name}) AS sum_{name}' for name in ANGLE_NAMES)
+        rows = self._connection().execute(
+            f'SELECT day, SUM(analyses) AS analyses, SUM(good) AS good, SUM(frames) AS frames, '
+            f'SUM(bad_frames) AS bad_frames, SUM(angle_count) AS angle_count, {sums} '
+            f'FROM daily_aggregates {where} GROUP BY day ORDER BY day',
+            params
+        ).fetchall()
+
+        points = []
+        for row in rows:
+            count = row['angle_count']
+            points.append({
+                'day': row['day'],
+                'analyses': row['analyses'],
+                'good_ratio': round(row['good'] / count, 4) if count else None,
+                'frames': row['frames'],
+                'bad_frame_ratio': round(row['bad_frames'] / row['frames'], 4) if row['frames'] else None,
+                'avg_angles': {
+                    name: round(row[f'sum_{name}'] / count, 2) for name in ANGLE_NAMES
+                } if count else None
+            })
+        return points
+
+
+def _row_dict(row):
+    result = dict(row)
+    for key in ('angles', 'failed_checks'):
+        if result.get(key) is not None:
+            result[key] = json.loads(result[key])
+    if result.get('is_good_posture') is not None:
+        result['is_good_posture'] = bool(result['is_good_posture'])
+    return result
+
+
+# Análisis sin usuario autenticado: cuentan en los agregados, pero solo los ve el administrador
+ANONYMOUS_CLIENT = ''
+
+
+def sign_user_token(user_id, secret, ttl=24 * 3600):
+    """
+    Token X-User-Token para user_id, válido ttl segundos. Lo emite el backend que
+    autentica a los usuarios, con el mismo HISTORY_USER_SECRET que la API.
+    """
+    expires = int(time.time() + ttl)
+    signature = hmac.new(secret.encode(), f'{user_id}.{expires}'.encode(), hashlib.sha256).hexdigest()
+    return f'{user_id}.{expires}.{signature}'
+
+
+def verify_user_token(token, secret):
+    """user_id de un token firmado y vigente; None si no es válido"""
+    try:
+        user_id, expires, signature = token.rsplit('.', 2)
+        expired = int(expires) < time.time()
+    except ValueError:
+        return None
+    expected = hmac.new(secret.encode(), f'{user_id}.{expires}'.encode(), hashlib.sha256).hexdigest()
+    if not user_id or expired or not hmac.compare_digest(signature, expected):
+        return None
+    return user_id
+
+
+def history_client_id(req):
+    """
+    Usuario autenticado dueño del historial: el de X-User-Token, firmado con
+    HISTORY_USER_SECRET. None sin token válido (o sin secreto configurado).
+    """
+    from flask import current_app
+
+    secret = current_app.config['HISTORY_USER_SECRET']
+    token = req.headers.get('X-User-Token')
+    if not secret or not token:
+        return None
+    return verify_user_token(token, secret)
+
+
+def record_analysis(**fields):
+    """Guarda en el historial si está activo; un fallo nunca afecta a la respuesta"""
+    from flask import current_app
+
+    history = current_app.extensions.get('history')
+    if history is None:
+        return
+    try:
+        history.record(**fields)
+    except Exception as e:
+        print(f'No se pudo guardar el análisis {fields.get("analysis_id")} en el historial: {e}')
+
+
+def init_history(app):
+    history = None
+    if app.config['HISTORY_ENABLED']:
+        history = HistoryStore(app.config['HISTORY_DB_PATH'])
+    app.extensions['history'] = history
+    return history
@@ -0,0 +1,100 @@
+import heapq
+import os
+
+import cv2
+import numpy as np
+
+from app.utils.mediapipe_helper import LANDMARK_NAMES
+from app.utils.rescoring import compute_angles, deviations
+
+_LANDMARK_IDS = list(LANDMARK_NAMES)
+
+
+def frame_deviations(pose_landmarks, thresholds):
+    """Grados fuera de rango por comprobación de un cuadro, con los umbrales de un perfil"""
+    points = np.array(
+        [[(pose_landmarks.landmark[i].x, pose_landmarks.landmark[i].y) for i in _LANDMARK_IDS]],
+        dtype=np.float64
+    )
+    return {check: float(value[0]) for check, value in deviations(compute_angles(points), thresholds).items()}
+
+
+class KeyframeSelector:
+    """
+    Los peores momentos de un video: los k cuadros con mayor severidad (suma de grados
+    fuera de rango), separados al menos min_gap segundos para que no sean casi iguales.
+
+    Montículo acotado con el menos grave en la raíz. Un candidato a menos de min_gap de
+    uno ya elegido solo lo reemplaza si es más grave. De cada elegido se guarda una
+    miniatura de width píxeles de ancho; los JPEG se codifican una vez, al final.
+    """
+
+    def __init__(self, k=5, min_gap=2.0, width=320):
+        self.k = k
+        self.min_gap = min_gap
+        self.width = width
+        self._heap = []  # (severidad, cuadro, segundo, miniatura, desviaciones, mala_postura)
+
+    def offer(self, frame_index, timestamp, frame, frame_deviations, bad_posture=False):
+        severity = sum(frame_deviations.values())
+        if self.k <= 0 or severity <= 0:
+            return False
+
+        near = [entry for entry in self._heap if abs(entry[2] - timestamp) < self.min_gap]
+        if near:
+            if severity <= max(entry[0] for entry in near):
+                return False
+            self._heap = [entry for entry in self._heap if abs(entry[2] - timestamp) >= self.min_gap]
+            heapq.heapify(self._heap)
+        elif len(self._heap) >= self.k and severity <= self._heap[0][0]:
+            return False
+
+        entry = (severity, frame_index, timestamp, self._thumbnail(frame), frame_deviations, bad_posture)
+        if len(self._heap) >= self.k:
+            heapq.heapreplace(self._heap, entry)
+        else:
+            heapq.heappush(self._heap, entry)
+        return True
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        if w <= self.width:
+            return frame.copy()
+        return cv2.resize(frame, (self.width, max(1, round(h * self.width / w))), interpolation=cv2.INTER_AREA)
+
+    def save(self, output_path, quality=80):
+        """Escribe las miniaturas junto a output_path, de la más grave a la menos, y las describe"""
+        base = os.path.splitext(output_path)[0]
+        keyframes = []
+        for rank, entry in enumerate(sorted(self._heap, key=lambda e: (-e[0], e[1]))):
+            severity, frame_index, timestamp, thumbnail, frame_deviations, bad_posture = entry
+            _stamp(thumbnail, f'{int(timestamp // 60):02d}:{timestamp % 60:04.1f}  +{severity:.0f} grados')
+
+            path = f'{base}_momento{rank:02d}.jpg'
+            ok, buffer = cv2.imencode('.jpg', thumbnail, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                continue
+            with open(path, 'wb') as f:
+                f.write(buffer)
+
+            keyframes.append({
+                'archivo': os.path.basename(path),
+                'frame': frame_index,
+                'segundo': round(timestamp, 2),
+                'severidad': round(severity, 1),
+                'mala_postura': bad_posture,
+                'desviaciones': {
+                    check: round(value, 1)
+                    for check, value in sorted(frame_deviations.items(), key=lambda item: -item[1])
+                    if value > 0
+                }
+            })
+        return keyframes
+
+
+def _stamp(image, text):
+    h, w = image.shape[:2]
+    scale = max(0.35, w / 800)
+    (tw, th), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)
+    cv2.rectangle(image, (0, h - th - baseline - 6), (min(w, tw + 8), h), (0, 0, 0), -1)
+    cv2.putText(image, text, (4, h - baseline - 3), cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), 1, cv2.LINE_AA)
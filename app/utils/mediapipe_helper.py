@@ -1,6 +1,9 @@
 import cv2
 import numpy as np
 import mediapipe as mp
+from app.utils.memory import hold_buffer, release_buffer
+from app.utils.metrics import stage
+from app.utils.models import image_pose
 
 
 mp_pose = mp.solutions.pose
@@ -9,6 +12,38 @@ mp_pose = mp.solutions.pose
 GREEN = (0, 255, 0)
 RED = (0, 0, 255)
 
+# Landmarks de MediaPipe que se usan (índice -> nombre)
+LANDMARK_NAMES = {
+    0: 'nose',
+    7: 'left_ear',
+    8: 'right_ear',
+    11: 'left_shoulder',
+    12: 'right_shoulder',
+    13: 'left_elbow',
+    14: 'right_elbow',
+    15: 'left_wrist',
+    16: 'right_wrist',
+    17: 'left_pinky',
+    18: 'right_pinky',
+    19: 'left_index',
+    20: 'right_index',
+    23: 'left_hip',
+    24: 'right_hip',
+    25: 'left_knee',
+    26: 'right_knee',
+    27: 'left_ankle',
+    28: 'right_ankle',
+    31: 'left_foot_index',
+    32: 'right_foot_index'
+}
+
+# Ángulos que devuelve calculate_angles
+ANGLE_NAMES = (
+    'left_hip', 'right_hip', 'left_knee', 'right_knee', 'left_ankle', 'right_ankle',
+    'left_elbow', 'right_elbow', 'neck', 'left_shoulder', 'right_shoulder',
+    'left_wrist', 'right_wrist', 'visual'
+)
+
 
 def get_segment_colors(angles):
 
@@ -182,81 +217,115 @@ def get_landmark_color(idx, segment_colors):
     # Por defecto, verde
     return GREEN
 
-def analyze_posture(image_file):
-    try:
-        image_bytes = image_file.read()
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+def draw_pose(image, pose_landmarks, angles):
+    h, w, _ = image.shape
 
-        if image is None:
-            return {
-                'success': False,
-                'error': 'No se pudo leer la imagen'
-            }
 
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    segment_colors = get_segment_colors(angles)
 
-        with mp_pose.Pose(
-            static_image_mode=True,
-            model_complexity=1,
-            enable_segmentation=False,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        ) as pose:
-            results = pose.process(image_rgb)
 
-            if not results.pose_landmarks:
-                return {
-                    'success': False,
-                    'error': 'No se detectó ninguna persona en la imagen'
-                }
+    for connection in mp_pose.POSE_CONNECTIONS:
+        start_idx = connection[0]
+        end_idx = connection[1]
 
-            landmarks = extract_landmarks(results.pose_landmarks)
-            angles = calculate_angles(landmarks)
-            is_good_posture = evaluate_posture(angles)
+        start_landmark = pose_landmarks.landmark[start_idx]
+        end_landmark = pose_landmarks.landmark[end_idx]
 
-            annotated_image = image.copy()
+        start_x = int(start_landmark.x * w)
+        start_y = int(start_landmark.y * h)
+        end_x = int(end_landmark.x * w)
+        end_y = int(end_landmark.y * h)
 
 
-            h, w, _ = annotated_image.shape
+        connection_color = get_connection_color(start_idx, end_idx, segment_colors)
 
+        cv2.line(image, (start_x, start_y), (end_x, end_y), connection_color, 10)
 
-            segment_colors = get_segment_colors(angles)
+    for idx, landmark in enumerate(pose_landmarks.landmark):
+        x = int(landmark.x * w)
+        y = int(landmark.y * h)
 
+        landmark_color = get_landmark_color(idx, segment_colors)
 
-            for connection in mp_pose.POSE_CONNECTIONS:
-                start_idx = connection[0]
-                end_idx = connection[1]
+        cv2.circle(image, (x, y), 3, landmark_color, 1)
 
-                start_landmark = results.pose_landmarks.landmark[start_idx]
-                end_landmark = results.pose_landmarks.landmark[end_idx]
+    return image
 
-                start_x = int(start_landmark.x * w)
-                start_y = int(start_landmark.y * h)
-                end_x = int(end_landmark.x * w)
-                end_y = int(end_landmark.y * h)
 
+def _read_upload(image_file):
+    """
+    Bytes de la imagen subida. Si el archivo ya está en memoria (BytesIO) se usa su
+    buffer directamente en lugar de copiarlo con read().
+    """
+    stream = getattr(image_file, 'stream', image_file)
+    if hasattr(stream, 'getbuffer'):
+        return stream.getbuffer()
+    return stream.read()
 
-                connection_color = get_connection_color(start_idx, end_idx, segment_colors)
 
-                cv2.line(annotated_image, (start_x, start_y), (end_x, end_y), connection_color, 10)
+def analyze_posture(image_file):
+    """
+    Solo hay una imagen de tamaño completo viva a la vez: los bytes subidos se liberan
+    al decodificar, el cambio BGR -> RGB para MediaPipe se hace en el mismo arreglo
+    (y se deshace después) y el esqueleto se dibuja sobre la imagen original.
+    """
+    try:
+        with stage('image_read'):
+            image_bytes = hold_buffer('upload', _read_upload(image_file))
+
+        with stage('imdecode'):
+            nparr = np.frombuffer(image_bytes, np.uint8)
+            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            del nparr
+            if isinstance(image_bytes, memoryview):
+                image_bytes.release()
+            del image_bytes
+            release_buffer('upload')
 
-            for idx, landmark in enumerate(results.pose_landmarks.landmark):
-                x = int(landmark.x * w)
-                y = int(landmark.y * h)
+        if image is None:
+            return {
+                'success': False,
+                'error': 'No se pudo leer la imagen'
+            }
+        hold_buffer('image', image)
 
-                landmark_color = get_landmark_color(idx, segment_colors)
+        with stage('cvtcolor'):
+            cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
 
-                cv2.circle(annotated_image, (x, y), 3, landmark_color, 1)
+        with image_pose() as pose:
+            with stage('pose_process'):
+                # MediaPipe copia la entrada a su propio ImageFrame mientras procesa
+                hold_buffer('pose_input', image)
+                results = pose.process(image)
+                release_buffer('pose_input')
 
-            recommendations = generate_recommendations(angles)
+            with stage('cvtcolor'):
+                cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=image)
+
+            if not results.pose_landmarks:
+                release_buffer('image')
+                return {
+                    'success': False,
+                    'error': 'No se detectó ninguna persona en la imagen'
+                }
+
+            with stage('angles'):
+                landmarks = extract_landmarks(results.pose_landmarks)
+                angles = calculate_angles(landmarks)
+                is_good_posture = evaluate_posture(angles)
+
+            with stage('draw'):
+                draw_pose(image, results.pose_landmarks, angles)
+
+            with stage('recommendations'):
+                recommendations = generate_recommendations(angles)
 
             return {
                 'success': True,
                 'landmarks': landmarks,
                 'angles': angles,
                 'recommendations': recommendations,
-                'processed_image': annotated_image,
+                'processed_image': image,
                 'is_good_posture': is_good_posture
             }
 
@@ -269,31 +338,7 @@ def analyze_posture(image_file):
 def extract_landmarks(pose_landmarks):
     landmarks = {}
 
-    landmark_names = {
-        0: 'nose',
-        7: 'left_ear',
-        8: 'right_ear',
-        11: 'left_shoulder',
-        12: 'right_shoulder',
-        13: 'left_elbow',
-        14: 'right_elbow',
-        15: 'left_wrist',
-        16: 'right_wrist',
-        17: 'left_pinky',
-        18: 'right_pinky',
-        19: 'left_index',
-        20: 'right_index',
-        23: 'left_hip',
-        24: 'right_hip',
-        25: 'left_knee',
-        26: 'right_knee',
-        27: 'left_ankle',
-        28: 'right_ankle',
-        31: 'left_foot_index',
-        32: 'right_foot_index'
-    }
-
-    for idx, name in landmark_names.items():
+    for idx, name in LANDMARK_NAMES.items():
         landmark = pose_landmarks.landmark[idx]
         landmarks[name] = {
             'x': landmark.x,
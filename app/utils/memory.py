@@ -0,0 +1,133 @@
+import contextvars
+import inspect
+import resource
+from functools import wraps
+
+from app.utils.metrics import REQUEST_PEAK_MEMORY
+from app.utils.profiling import record_memory
+
+_current_memory = contextvars.ContextVar('request_memory', default=None)
+
+
+class RequestMemory:
+    """
+    Buffers grandes que mantiene una solicitud (bytes subidos, imagen decodificada,
+    JPEG, ...). El pico es la suma máxima de los buffers vivos a la vez.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.current = 0
+        self.peak = 0
+        self.max_rss_start = _max_rss()
+
+    def hold(self, name, nbytes):
+        self.release(name)
+        self.buffers[name] = nbytes
+        self.current += nbytes
+        self.peak = max(self.peak, self.current)
+
+    def release(self, name):
+        self.current -= self.buffers.pop(name, 0)
+
+
+def _max_rss():
+    """Pico de memoria residente del proceso en bytes (ru_maxrss está en KB en Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _nbytes(buffer):
+    if hasattr(buffer, 'nbytes'):
+        return buffer.nbytes
+    return len(buffer)
+
+
+def hold_buffer(name, buffer):
+    """Registra un buffer vivo de la solicitud actual, si se está midiendo"""
+    memory = _current_memory.get()
+    if memory is not None and buffer is not None:
+        memory.hold(name, _nbytes(buffer))
+    return buffer
+
+
+def release_buffer(name):
+    memory = _current_memory.get()
+    if memory is not None:
+        memory.release(name)
+
+
+def _tracked_stream(chunks, memory, finish):
+    """
+    Itera la respuesta en streaming con la medición activa en cada paso (los buffers
+    del reporte de IA se crean dentro del generador) y la publica al terminar.
+    """
+    iterator = iter(chunks)
+    try:
+        while True:
+            token = _current_memory.set(memory)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current_memory.reset(token)
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+        finish(memory)
+
+
+def memory_tracked(endpoint):
+    """
+    Publica el pico de memoria en buffers de cada solicitud de la ruta. Si la respuesta
+    es un stream, la medición sigue hasta que el stream termina.
+
+    Con X-Profile el perfil incluye además cuánto subió el pico de RSS del proceso durante
+    la solicitud: es una medición real, pero del proceso entero (suma lo que hacen otras
+    solicitudes a la vez y vale 0 si el proceso ya había llegado a ese pico).
+    """
+    def decorator(view):
+        def finish(memory):
+            REQUEST_PEAK_MEMORY.labels(endpoint).observe(memory.peak)
+            record_memory(
+                buffers_peak_mb=round(memory.peak / (1024 * 1024), 3),
+                rss_peak_growth_mb=round((_max_rss() - memory.max_rss_start) / (1024 * 1024), 3)
+            )
+
+        def track_stream(response, memory):
+            if not getattr(response, 'is_streamed', False):
+                return False
+            response.response = _tracked_stream(response.response, memory, finish)
+            return True
+
+        if inspect.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                memory = RequestMemory()
+                token = _current_memory.set(memory)
+                try:
+                    return await view(*args, **kwargs)
+                finally:
+                    _current_memory.reset(token)
+                    finish(memory)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            memory = RequestMemory()
+            token = _current_memory.set(memory)
+            streamed = False
+            try:
+                response = view(*args, **kwargs)
+                streamed = track_stream(response, memory)
+                return response
+            finally:
+                _current_memory.reset(token)
+                if not streamed:
+                    finish(memory)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,236 @@
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from app.utils.profiling import record_stage
+
+# Buckets pensados para etapas que van desde microsegundos (dibujo) hasta minutos (videos)
+STAGE_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0
+)
+
+STAGE_SECONDS = Histogram(
+    'posture_stage_seconds',
+    'Duración de cada etapa del procesamiento',
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+
+STAGE_ERRORS = Counter(
+    'posture_stage_errors_total',
+    'Etapas que terminaron con excepción',
+    ['stage']
+)
+
+HTTP_REQUESTS = Counter(
+    'posture_http_requests_total',
+    'Solicitudes HTTP atendidas',
+    ['endpoint', 'status']
+)
+
+HTTP_SECONDS = Histogram(
+    'posture_http_request_seconds',
+    'Duración total de las solicitudes HTTP',
+    ['endpoint'],
+    buckets=STAGE_BUCKETS
+)
+
+VIDEO_FRAMES = Counter(
+    'posture_video_frames_total',
+    'Frames de video procesados',
+    ['result']
+)
+
+VIDEO_FPS = Histogram(
+    'posture_video_fps',
+    'Frames por segundo logrados al procesar cada video',
+    buckets=(1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120)
+)
+
+OPENAI_TOKENS = Counter(
+    'posture_openai_tokens_total',
+    'Tokens consumidos en reportes de IA',
+    ['kind']
+)
+
+VISION_DETAIL = Counter(
+    'posture_vision_images_total',
+    'Imágenes enviadas al modelo de visión por nivel de detalle',
+    ['detail']
+)
+
+AI_REPORTS = Counter(
+    'posture_ai_reports_total',
+    'Reportes de IA según cómo se resolvieron (ai, cache, fallback, late, error)',
+    ['result']
+)
+
+UPLOAD_ATTEMPTS = Counter(
+    'posture_upload_attempts_total',
+    'Intentos de subida a Cloudinary por resultado (ok, retry, failed)',
+    ['resource_type', 'result']
+)
+
+STORAGE_BYTES = Gauge(
+    'posture_storage_bytes',
+    'Bytes ocupados por los archivos de trabajo del análisis de video',
+    ['area'],
+    multiprocess_mode='livemostrecent'
+)
+
+STORAGE_EVICTIONS = Counter(
+    'posture_storage_evictions_total',
+    'Archivos eliminados por la política de retención (ttl, quota, upload_abandonado)',
+    ['reason']
+)
+
+COALESCED_REQUESTS = Counter(
+    'posture_coalesced_requests_total',
+    'Solicitudes idénticas en curso: leader calcula, follower recibe el resultado compartido',
+    ['role']
+)
+
+REPORT_CACHE_REQUESTS = Counter(
+    'posture_cache_requests_total',
+    'Consultas a cachés por resultado',
+    ['result']
+)
+
+REPORT_CACHE_ENTRIES = Gauge(
+    'posture_cache_entries',
+    'Entradas almacenadas en cada caché',
+    ['cache'],
+    multiprocess_mode='livesum'
+)
+
+UPLOAD_BYTES = Counter(
+    'posture_upload_bytes_total',
+    'Bytes enviados a Cloudinary',
+    ['resource_type']
+)
+
+QUEUE_DEPTH = Gauge(
+    'posture_scheduler_queue_depth',
+    'Solicitudes esperando turno de CPU',
+    ['job_class'],
+    multiprocess_mode='livesum'
+)
+
+QUEUE_RUNNING = Gauge(
+    'posture_scheduler_running',
+    'Solicitudes ejecutando una etapa de CPU',
+    ['job_class'],
+    multiprocess_mode='livesum'
+)
+
+QUEUE_WAIT = Histogram(
+    'posture_scheduler_wait_seconds',
+    'Tiempo de espera en cola antes de obtener turno de CPU',
+    ['job_class'],
+    buckets=STAGE_BUCKETS
+)
+
+QUEUE_REJECTED = Counter(
+    'posture_scheduler_rejected_total',
+    'Solicitudes rechazadas por el planificador',
+    ['job_class']
+)
+
+REQUEST_PEAK_MEMORY = Histogram(
+    'posture_request_peak_memory_bytes',
+    'Pico de memoria en buffers de imagen por solicitud (para dimensionar la concurrencia)',
+    ['endpoint'],
+    buckets=tuple(mb * 1024 * 1024 for mb in (1, 2, 4, 8, 16, 32, 64, 128, 256))
+)
+
+PROCESS_RSS = Gauge(
+    'posture_process_rss_bytes',
+    'Memoria residente de cada worker',
+    multiprocess_mode='liveall'
+)
+
+
+@contextmanager
+def stage(name):
+    """
+    Mide una etapa y la registra en el histograma posture_stage_seconds
+
+    Args:
+        name: Nombre de la etapa (imdecode, pose_process, ...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def observe_stage(name, seconds):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    record_stage(name, seconds)
+
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Fuera de Linux solo se dispone del pico (ru_maxrss en KB)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def update_process_metrics():
+    PROCESS_RSS.set(current_rss_bytes())
+
+
+def render_metrics():
+    update_process_metrics()
+
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Con gunicorn cada worker escribe sus valores en el directorio compartido
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        from prometheus_client import REGISTRY as registry
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_metrics(app):
+    from flask import Response, g, request
+
+    update_process_metrics()
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        endpoint = request.endpoint or 'desconocido'
+        if start is not None and endpoint != 'metrics':
+            HTTP_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(endpoint, str(response.status_code)).inc()
+            update_process_metrics()
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        data, content_type = render_metrics()
+        return Response(data, content_type=content_type)
@@ -0,0 +1,187 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.utils.metrics import observe_stage
+
+# Opciones del modelo usado para imágenes estáticas (/analyze)
+IMAGE_POSE_OPTIONS = {
+    'static_image_mode': True,
+    'model_complexity': 1,
+    'enable_segmentation': False,
+    'min_detection_confidence': 0.5,
+    'min_tracking_confidence': 0.5
+}
+
+
+def preload_modules():
+    """
+    Importa los módulos pesados sin crear grafos ni hilos.
+
+    Es seguro llamarlo en el master de gunicorn (preload_app): los workers heredan
+    los módulos ya cargados y comparten esas páginas por copy-on-write.
+    """
+    import cv2  # noqa: F401
+    import mediapipe as mp
+    import openai  # noqa: F401
+    import cloudinary.uploader  # noqa: F401
+
+    # Carga perezosa de mediapipe: forzar la carga de las soluciones que usamos
+    mp.solutions.pose
+    mp.solutions.drawing_utils
+
+
+class PosePool:
+    """
+    Pool de instancias de mp.solutions.pose.Pose reutilizables entre solicitudes.
+
+    Un grafo de MediaPipe no es seguro entre hilos ni sobrevive a un fork, así
+    que cada instancia se presta a un solo hilo a la vez y el pool pertenece al
+    proceso que lo creó.
+    """
+
+    def __init__(self, size, **pose_options):
+        self.size = max(1, size)
+        self.pose_options = pose_options
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        import mediapipe as mp
+
+        start = time.perf_counter()
+        pose = mp.solutions.pose.Pose(**self.pose_options)
+        observe_stage('pose_init', time.perf_counter() - start)
+        return pose
+
+    def _take(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+
+        if create:
+            try:
+                return self._create()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return self._idle.get()
+
+    @contextmanager
+    def acquire(self):
+        pose = self._take()
+        try:
+            yield pose
+        finally:
+            self._idle.put(pose)
+
+    def warm_up(self):
+        """Crea todas las instancias y ejecuta una inferencia para inicializar TFLite"""
+        blank = np.zeros((256, 256, 3), dtype=np.uint8)
+        poses = [self._take() for _ in range(self.size)]
+        try:
+            for pose in poses:
+                pose.process(blank)
+        finally:
+            for pose in poses:
+                self._idle.put(pose)
+
+
+class ModelRegistry:
+
+    def __init__(self):
+        self.pool_size = 1
+        self._pool = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._warmup_thread = None
+        self._warmup_error = None
+        self._warmup_seconds = None
+        # Instancias heredadas de otro proceso: se conservan sin cerrarlas porque
+        # cerrar un grafo cuyos hilos no existen tras el fork puede bloquearse
+        self._abandoned = []
+
+    def configure(self, pool_size):
+        self.pool_size = pool_size
+
+    def image_pool(self):
+        pool = self._pool
+        if pool is None or pool.pid != os.getpid():
+            with self._lock:
+                pool = self._pool
+                if pool is None or pool.pid != os.getpid():
+                    if pool is not None:
+                        self._abandoned.append(pool)
+                    pool = self._pool = PosePool(self.pool_size, **IMAGE_POSE_OPTIONS)
+        return pool
+
+    def start_warmup(self):
+        """Calienta los modelos en segundo plano; llamar después del fork"""
+        with self._lock:
+            if self._warmup_thread is not None and self._warmup_thread.is_alive():
+                return
+            self._ready.clear()
+            self._warmup_error = None
+            self._warmup_thread = threading.Thread(target=self._warm, name='model-warmup', daemon=True)
+            self._warmup_thread.start()
+
+    def _warm(self):
+        start = time.perf_counter()
+        try:
+            preload_modules()
+            self.image_pool().warm_up()
+            self._warmup_seconds = time.perf_counter() - start
+            self._ready.set()
+        except Exception as e:
+            self._warmup_error = str(e)
+
+    def _after_fork(self):
+        # Los hilos y grafos del padre no existen en el hijo
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._warmup_thread = None
+        self._warmup_error = None
+        self._warmup_seconds = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def status(self):
+        pool = self._pool
+        result = {
+            'ready': self.ready,
+            'pid': os.getpid(),
+            'pose_pool_size': self.pool_size,
+            'pose_instances': pool._created if pool is not None and pool.pid == os.getpid() else 0
+        }
+        if self._warmup_seconds is not None:
+            result['warmup_seconds'] = round(self._warmup_seconds, 3)
+        if self._warmup_error:
+            result['error'] = self._warmup_error
+        return result
+
+
+registry = ModelRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+
+def image_pose():
+    """Presta una instancia de Pose para imágenes estáticas"""
+    return registry.image_pool().acquire()
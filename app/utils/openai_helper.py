@@ -1,21 +1,213 @@
+import asyncio
 import base64
-from openai import OpenAI
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+from app.utils.memory import hold_buffer, release_buffer
+from app.utils.metrics import OPENAI_TOKENS, VISION_DETAIL, observe_stage, stage
 
+_client_lock = threading.Lock()
+_client = None
+_client_pid = None
+_executor = None
+_executor_pid = None
+_async_client = None
+_async_client_loop = None
 
-def generate_ergonomic_report(client, image_url, angles, angle_details, recommendations, is_good_posture):
 
-    try:
+def get_openai_client(api_key, base_url=None, timeout=90, max_connections=10):
+    """
+    Cliente de OpenAI compartido por el worker, con conexiones keep-alive.
+
+    httpx no es seguro tras un fork, así que el cliente se recrea si cambia el pid.
+    """
+    global _client, _client_pid
+
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                import httpx
+                from openai import OpenAI
+
+                http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_connections,
+                        keepalive_expiry=120
+                    ),
+                    timeout=httpx.Timeout(timeout, connect=10)
+                )
+                _client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=http_client,
+                    timeout=timeout,
+                    max_retries=1
+                )
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_async_openai_client(api_key, base_url=None, timeout=90, max_connections=10):
+    """
+    Cliente AsyncOpenAI del worker para el modo ASGI. Sus conexiones pertenecen al
+    event loop, así que se recrea si cambia el loop o el pid.
+    """
+    global _async_client, _async_client_loop
+
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        import httpx
+        from openai import AsyncOpenAI
+
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=120
+            ),
+            timeout=httpx.Timeout(timeout, connect=10)
+        )
+        _async_client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            timeout=timeout,
+            max_retries=1
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+def submit_ergonomic_report(max_workers=8, **kwargs):
+    """Ejecuta generate_ergonomic_report en segundo plano y devuelve un Future"""
+    global _executor, _executor_pid
+
+    if _executor is None or _executor_pid != os.getpid():
+        with _client_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-report')
+                _executor_pid = os.getpid()
+    # Con el contexto de la solicitud: el perfil y la medición de memoria siguen en el hilo
+    return _executor.submit(contextvars.copy_context().run, generate_ergonomic_report, **kwargs)
+
+
+def vision_tiles(width, height):
+    """Tiles de 512px que cobra el modelo en detail=high"""
+    return math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def fit_to_tile_budget(width, height, max_tiles):
+    """
+    Tamaño final de la imagen para detail=high: como hace la API, lado corto como
+    máximo 768px y lado largo 2048px, reduciendo después hasta caber en max_tiles.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    scale = min(scale, 768 / min(width * scale, height * scale))
+    new_w, new_h = max(1, int(width * scale)), max(1, int(height * scale))
+
+    while vision_tiles(new_w, new_h) > max_tiles and max(new_w, new_h) > 512:
+        new_w, new_h = max(1, int(new_w * 0.9)), max(1, int(new_h * 0.9))
+
+    return new_w, new_h
+
+
+def crop_to_person(image, landmarks, margin_x=0.35, margin_y=0.15):
+    """
+    Recorta la imagen alrededor de los landmarks, con margen horizontal extra para
+    conservar el escritorio, el monitor y la silla.
+    """
+    h, w = image.shape[:2]
+    xs = [p['x'] for p in landmarks.values()]
+    ys = [p['y'] for p in landmarks.values()]
+    if not xs:
+        return image
+
+    min_x, max_x = min(xs), max(xs)
+    min_y, max_y = min(ys), max(ys)
+    box_w, box_h = max_x - min_x, max_y - min_y
+
+    left = int(max(0.0, min_x - box_w * margin_x) * w)
+    right = int(min(1.0, max_x + box_w * margin_x) * w)
+    top = int(max(0.0, min_y - box_h * margin_y) * h)
+    bottom = int(min(1.0, max_y + box_h * margin_y) * h)
+
+    if right - left < 32 or bottom - top < 32:
+        return image
+    return image[top:bottom, left:right]
+
+
+def build_vision_image(image, landmarks=None, max_tiles=4, context_margin=0.35, quality=85):
+    """
+    Versión de la imagen para el modelo de visión: recortada a la persona,
+    redimensionada al presupuesto de tiles y con detail elegido según su tamaño.
+
+    Returns:
+        dict: URL data: en JPEG, detail, dimensiones y tokens de imagen estimados
+    """
+    if landmarks:
+        image = crop_to_person(image, landmarks, margin_x=context_margin)
 
-        angles_summary = "\n".join([
-            f"- {detail['segment']}: {detail['current_angle']}° (óptimo: {detail['optimal_range']}) - {detail['status'].upper()}"
-            for detail in angle_details
-        ])
-        basic_recommendations = "\n".join([
-            f"- [{rec['type']}] {rec['area']}: {rec['message']}"
-            for rec in recommendations
-        ])
-        prompt = f"""Eres un experto en ergonomía ocupacional y salud laboral. Analiza esta imagen de una persona en su estación de trabajo junto con los datos ergonómicos calculados.
+    h, w = image.shape[:2]
+    if max(w, h) <= 512:
+        # En low la API usa una sola imagen de 512px: no hay nada que ganar con high
+        detail = 'low'
+        new_w, new_h = w, h
+        estimated_tokens = 85
+    else:
+        detail = 'high'
+        new_w, new_h = fit_to_tile_budget(w, h, max_tiles)
+        estimated_tokens = 85 + 170 * vision_tiles(new_w, new_h)
+
+    if (new_w, new_h) != (w, h):
+        image = hold_buffer('vision_image', cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA))
+
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        release_buffer('vision_image')
+        raise ValueError('No se pudo codificar la imagen para el modelo')
+    hold_buffer('vision_jpeg', buffer)
+
+    # La URL en base64 vive en los mensajes hasta que termina la solicitud
+    url = hold_buffer('vision_url', 'data:image/jpeg;base64,' + base64.b64encode(buffer).decode('ascii'))
+    release_buffer('vision_image')
+    release_buffer('vision_jpeg')
+
+    return {
+        'url': url,
+        'detail': detail,
+        'width': new_w,
+        'height': new_h,
+        'bytes': int(buffer.nbytes),
+        'estimated_tokens': estimated_tokens
+    }
+
+
+def build_report_messages(image_url, angle_details, recommendations, is_good_posture,
+                          image=None, landmarks=None, max_tiles=4, context_margin=0.35):
+    """Mensajes para el modelo y la imagen de visión usada (común al reporte completo y al streaming)"""
+    # Con la imagen en memoria se envía una versión reducida en lugar de la URL original
+    if image is not None:
+        with stage('vision_image'):
+            vision_image = build_vision_image(image, landmarks, max_tiles, context_margin)
+    else:
+        vision_image = {'url': image_url, 'detail': 'high'}
+    VISION_DETAIL.labels(vision_image['detail']).inc()
+
+    angles_summary = "\n".join([
+        f"- {detail['segment']}: {detail['current_angle']}° (óptimo: {detail['optimal_range']}) - {detail['status'].upper()}"
+        for detail in angle_details
+    ])
+    basic_recommendations = "\n".join([
+        f"- [{rec['type']}] {rec['area']}: {rec['message']}"
+        for rec in recommendations
+    ])
+    prompt = f"""Eres un experto en ergonomía ocupacional y salud laboral. Analiza esta imagen de una persona en su estación de trabajo junto con los datos ergonómicos calculados.
 
 **ANÁLISIS BIOMECÁNICO CALCULADO:**
 {angles_summary}
@@ -70,50 +262,336 @@ def generate_ergonomic_report(client, image_url, angles, angle_details, recommen
 
 Sé específico, práctico y profesional. Usa lenguaje claro y accesible."""
 
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Modelo con capacidad de visión
-            messages=[
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt
+                },
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_url,
-                                "detail": "high"
-                            }
-                        }
-                    ]
+                    "type": "image_url",
+                    "image_url": {
+                        "url": vision_image['url'],
+                        "detail": vision_image['detail']
+                    }
                 }
-            ],
-            max_tokens=2000,
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
+            ]
+        }
+    ]
+    return messages, vision_image
 
 
-        ai_report = response.choices[0].message.content
+def generate_ergonomic_report(client, image_url, angles, angle_details, recommendations, is_good_posture,
+                              image=None, landmarks=None, max_tiles=4, context_margin=0.35):
 
+    try:
+        messages, vision_image = build_report_messages(
+            image_url, angle_details, recommendations, is_good_posture,
+            image=image, landmarks=landmarks, max_tiles=max_tiles, context_margin=context_margin
+        )
 
-        import json
-        try:
-            ai_report_json = json.loads(ai_report)
-        except:
-            ai_report_json = {"raw_response": ai_report}
+        started = time.perf_counter()
+        with stage('openai_report'):
+            response = client.chat.completions.create(**_report_request(messages))
+
+        return _report_result(response, time.perf_counter() - started, vision_image)
 
+    except Exception as e:
         return {
-            'success': True,
-            'report': ai_report_json,
-            'tokens_used': response.usage.total_tokens
+            'success': False,
+            'error': f'Error al generar reporte con IA: {str(e)}'
         }
 
+
+async def agenerate_ergonomic_report(client, image_url, angles, angle_details, recommendations, is_good_posture,
+                                     image=None, landmarks=None, max_tiles=4, context_margin=0.35):
+    """generate_ergonomic_report con AsyncOpenAI (modo ASGI): la espera al modelo no ocupa un hilo"""
+    from app.utils.asgi import run_cpu
+
+    try:
+        messages, vision_image = await run_cpu(
+            build_report_messages, image_url, angle_details, recommendations, is_good_posture,
+            image=image, landmarks=landmarks, max_tiles=max_tiles, context_margin=context_margin
+        )
+
+        started = time.perf_counter()
+        with stage('openai_report'):
+            response = await client.chat.completions.create(**_report_request(messages))
+
+        return _report_result(response, time.perf_counter() - started, vision_image)
+
     except Exception as e:
         return {
             'success': False,
             'error': f'Error al generar reporte con IA: {str(e)}'
         }
 
+
+def _report_request(messages):
+    return {
+        'model': "gpt-4o",  # Modelo con capacidad de visión
+        'messages': messages,
+        'max_tokens': 2000,
+        'temperature': 0.7,
+        'response_format': {"type": "json_object"}
+    }
+
+
+def _report_result(response, latency, vision_image):
+    ai_report = response.choices[0].message.content
+    OPENAI_TOKENS.labels('prompt').inc(response.usage.prompt_tokens)
+    OPENAI_TOKENS.labels('completion').inc(response.usage.completion_tokens)
+
+    try:
+        ai_report_json = json.loads(ai_report)
+    except:
+        ai_report_json = {"raw_response": ai_report}
+
+    return {
+        'success': True,
+        'report': ai_report_json,
+        'tokens_used': response.usage.total_tokens,
+        'usage': {
+            'prompt_tokens': response.usage.prompt_tokens,
+            'completion_tokens': response.usage.completion_tokens,
+            'total_tokens': response.usage.total_tokens,
+            'latency_seconds': round(latency, 3),
+            'image': {k: v for k, v in vision_image.items() if k != 'url'}
+        }
+    }
+
+
+class ReportSectionParser:
+    """
+    Parser incremental del objeto JSON del reporte: devuelve cada sección de primer
+    nivel ("resumen_ejecutivo", "puntos_criticos", ...) en cuanto su valor se cierra,
+    sin esperar al resto de la respuesta.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        text = self.text
+        sections = []
+
+        for i in range(self._pos, len(text)):
+            c = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:i + 1])
+                        self._key_start = None
+                    elif self._depth == 1 and self._value_start is not None:
+                        self._emit(sections, i + 1)
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._key is None:
+                    self._key_start = i
+            elif c in '{[':
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None:
+                    self._emit(sections, i + 1)
+                elif self._depth == 0 and self._value_start is not None:
+                    # Número o literal como último valor del objeto
+                    self._emit(sections, i)
+            elif c == ':' and self._depth == 1 and self._key is not None and self._value_start is None:
+                self._value_start = i + 1
+            elif c == ',' and self._depth == 1 and self._value_start is not None:
+                self._emit(sections, i)
+
+        self._pos = len(text)
+        return sections
+
+    def _emit(self, sections, end):
+        try:
+            sections.append((self._key, json.loads(self.text[self._value_start:end])))
+        except ValueError:
+            pass
+        self._key = None
+        self._value_start = None
+
+
+def stream_ergonomic_report(client, image_url, angles, angle_details, recommendations, is_good_posture,
+                            image=None, landmarks=None, max_tiles=4, context_margin=0.35):
+    """
+    Variante de generate_ergonomic_report con stream=True.
+
+    Genera eventos {'event': ..., 'data': ...}: 'section' por cada sección completa
+    del reporte, y al final 'done' con el reporte y el uso de tokens, o 'error'.
+    """
+    try:
+        messages, vision_image = build_report_messages(
+            image_url, angle_details, recommendations, is_good_posture,
+            image=image, landmarks=landmarks, max_tiles=max_tiles, context_margin=context_margin
+        )
+
+        started = time.perf_counter()
+        stream = client.chat.completions.create(
+            model="gpt-4o",  # Modelo con capacidad de visión
+            messages=messages,
+            max_tokens=2000,
+            temperature=0.7,
+            response_format={"type": "json_object"},
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        parser = ReportSectionParser()
+        usage = None
+        first_token = None
+        first_section = None
+
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+
+            if first_token is None:
+                first_token = time.perf_counter() - started
+                observe_stage('openai_first_token', first_token)
+
+            for name, value in parser.feed(content):
+                if first_section is None:
+                    first_section = time.perf_counter() - started
+                    observe_stage('openai_first_section', first_section)
+                yield {'event': 'section', 'data': {'name': name, 'content': value}}
+
+        latency = time.perf_counter() - started
+        observe_stage('openai_report', latency)
+
+        try:
+            report = json.loads(parser.text)
+        except ValueError:
+            report = {"raw_response": parser.text}
+
+        result_usage = {
+            'latency_seconds': round(latency, 3),
+            'first_token_seconds': round(first_token, 3) if first_token is not None else None,
+            'first_section_seconds': round(first_section, 3) if first_section is not None else None,
+            'image': {k: v for k, v in vision_image.items() if k != 'url'}
+        }
+        if usage is not None:
+            OPENAI_TOKENS.labels('prompt').inc(usage.prompt_tokens)
+            OPENAI_TOKENS.labels('completion').inc(usage.completion_tokens)
+            result_usage.update({
+                'prompt_tokens': usage.prompt_tokens,
+                'completion_tokens': usage.completion_tokens,
+                'total_tokens': usage.total_tokens
+            })
+
+        yield {'event': 'done', 'data': {'report': report, 'usage': result_usage}}
+
+    except Exception as e:
+        yield {'event': 'error', 'data': {'error': f'Error al generar reporte con IA: {str(e)}'}}
+
+
+
+# Textos del reporte local por área de generate_recommendations
+RIESGOS_POR_AREA = {
+    'Cadera': 'Sobrecarga lumbar por flexión o extensión sostenida del tronco',
+    'Rodillas': 'Compresión de la circulación en muslos y piernas',
+    'Tobillos': 'Edema y fatiga en pies por falta de apoyo',
+    'Codos': 'Epicondilitis y tensión en antebrazos',
+    'Cuello': 'Cervicalgia y cefaleas tensionales',
+    'Hombros': 'Tendinitis del manguito rotador y contracturas del trapecio',
+    'Muñecas': 'Síndrome del túnel carpiano',
+    'Ángulo visual': 'Fatiga visual y sobrecarga cervical'
+}
+
+EJERCICIOS_POR_AREA = {
+    'Cadera': 'Ponerse de pie y extender la cadera llevando la pelvis hacia adelante durante 20 segundos',
+    'Rodillas': 'Extender alternadamente cada pierna sentado durante 10 repeticiones',
+    'Tobillos': 'Círculos de tobillo en ambos sentidos, 10 repeticiones por pie',
+    'Codos': 'Estirar los flexores del antebrazo con la palma hacia afuera durante 15 segundos',
+    'Cuello': 'Retracción cervical (llevar el mentón hacia atrás) 10 veces cada hora',
+    'Hombros': 'Rotaciones de hombros hacia atrás, 10 repeticiones',
+    'Muñecas': 'Flexión y extensión suave de muñecas durante 15 segundos',
+    'Ángulo visual': 'Regla 20-20-20: cada 20 minutos mirar a 6 metros durante 20 segundos'
+}
+
+MEJORAS_POR_AREA = {
+    'Cadera': 'Silla con respaldo regulable y apoyo lumbar',
+    'Rodillas': 'Silla con altura regulable o reposapiés',
+    'Tobillos': 'Reposapiés con inclinación ajustable',
+    'Codos': 'Escritorio o bandeja de teclado a la altura de los codos',
+    'Cuello': 'Soporte para elevar el monitor a la altura de los ojos',
+    'Hombros': 'Reposabrazos regulables en altura',
+    'Muñecas': 'Teclado y mouse ergonómicos con reposamuñecas',
+    'Ángulo visual': 'Brazo articulado para monitor'
+}
+
+
+def generate_local_report(angle_details, recommendations, is_good_posture):
+    """
+    Reporte determinista con el mismo formato que el de IA, construido solo con
+    los ángulos calculados. Se usa cuando el reporte de IA no llega a tiempo.
+    """
+    incorrectos = [d for d in angle_details if d['status'] == 'incorrecto']
+    areas = [r['area'] for r in recommendations if r['type'] == 'warning']
+    total = len(angle_details)
+    correctos = total - len(incorrectos)
+
+    if is_good_posture or not incorrectos:
+        resumen = 'La postura evaluada se encuentra dentro de los rangos ergonómicos recomendados.'
+    else:
+        resumen = (
+            f'{len(incorrectos)} de {total} segmentos evaluados están fuera del rango óptimo '
+            f'({", ".join(d["segment"] for d in incorrectos)}). Se recomienda corregir la postura.'
+        )
+
+    inmediatas = [r['message'] for r in recommendations if r['type'] == 'warning']
+    if not inmediatas:
+        inmediatas = [r['message'] for r in recommendations]
+
+    puntuacion_postura = round(25 * correctos / total) if total else 25
+    no_disponible = 'No disponible en el reporte local'
+
+    return {
+        'resumen_ejecutivo': resumen,
+        'analisis_espacio_trabajo': {
+            'mobiliario': no_disponible,
+            'equipamiento': no_disponible,
+            'iluminacion_entorno': no_disponible
+        },
+        'puntos_criticos': [
+            f"{d['segment']}: {d['current_angle']}° (óptimo: {d['optimal_range']})"
+            for d in incorrectos
+        ],
+        'recomendaciones_inmediatas': inmediatas,
+        'recomendaciones_largo_plazo': [MEJORAS_POR_AREA[a] for a in areas if a in MEJORAS_POR_AREA],
+        'riesgos_identificados': [RIESGOS_POR_AREA[a] for a in areas if a in RIESGOS_POR_AREA],
+        'ejercicios_recomendados': [EJERCICIOS_POR_AREA[a] for a in areas if a in EJERCICIOS_POR_AREA],
+        'puntuacion_ergonomica': {
+            'total': 'N/D',
+            'postura': f'{puntuacion_postura}/25',
+            'mobiliario': 'N/D',
+            'equipamiento': 'N/D',
+            'entorno': 'N/D'
+        },
+        'origen': 'local'
+    }
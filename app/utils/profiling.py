@@ -0,0 +1,234 @@
+import cProfile
+import contextvars
+import hmac
+import inspect
+import itertools
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+MODOS = ('stages', 'cprofile', 'tracemalloc')
+
+_current_profile = contextvars.ContextVar('request_profile', default=None)
+_sample_counter = itertools.count(1)
+# tracemalloc es global al proceso: solo una solicitud puede usarlo a la vez
+_tracemalloc_lock = threading.Lock()
+
+
+class RequestProfile:
+    """Acumula el tiempo de cada etapa durante una solicitud"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.started_at = time.perf_counter()
+        self.stages = {}
+        self.order = []
+        self.artifact = None
+        self.memory = None
+
+    def record(self, name, seconds):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+            self.order.append(name)
+        entry['count'] += 1
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+
+    def summary(self):
+        total = time.perf_counter() - self.started_at
+        stages = []
+        for name in self.order:
+            entry = self.stages[name]
+            stages.append({
+                'stage': name,
+                'count': entry['count'],
+                'total_ms': round(entry['total'] * 1000, 3),
+                'max_ms': round(entry['max'] * 1000, 3),
+                'percent': round(entry['total'] / total * 100, 2) if total > 0 else 0.0
+            })
+        result = {
+            'mode': self.mode,
+            'total_ms': round(total * 1000, 3),
+            'stages': stages
+        }
+        if self.memory:
+            result['memory'] = self.memory
+        if self.artifact:
+            result['artifact'] = self.artifact
+        return result
+
+    def server_timing(self):
+        return ', '.join(
+            f"{name};dur={self.stages[name]['total'] * 1000:.3f}"
+            for name in self.order
+        )
+
+
+def record_stage(name, seconds):
+    """Registra una etapa en el perfil de la solicitud actual, si lo hay"""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.record(name, seconds)
+
+
+def record_memory(**values):
+    """Agrega cifras de memoria al perfil de la solicitud actual, si lo hay"""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.memory = dict(profile.memory or {}, **values)
+
+
+def _requested_mode():
+    config = current_app.config
+    if not config['PROFILING_ENABLED']:
+        return None
+
+    value = request.headers.get('X-Profile') or request.args.get('profile')
+    if not value:
+        return None
+
+    token = config['PROFILING_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('X-Profile-Token', ''), token):
+        return None
+
+    value = value.lower()
+    if value in MODOS:
+        return value
+    return 'stages'
+
+
+def _is_sampled():
+    rate = current_app.config['PROFILING_SAMPLE_RATE']
+    return rate > 0 and next(_sample_counter) % rate == 0
+
+
+def _artifact_path(extension):
+    directory = current_app.config['PROFILING_DIR']
+    os.makedirs(directory, exist_ok=True)
+    endpoint = (request.endpoint or 'request').replace('.', '_')
+    filename = f"{endpoint}_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}.{extension}"
+    return os.path.join(directory, filename)
+
+
+def profiled(view):
+    """
+    Perfilado bajo demanda de una ruta.
+
+    Con la cabecera X-Profile (o ?profile=) y PROFILING_ENABLED, la respuesta JSON o
+    MessagePack incluye el desglose por etapa; los modos cprofile y tracemalloc además guardan
+    un volcado en PROFILING_DIR. Con PROFILING_SAMPLE_RATE=N se guarda un volcado
+    cProfile de 1 de cada N solicitudes sin alterar la respuesta.
+    """
+    if inspect.iscoroutinefunction(view):
+        return _profiled_async(view)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        mode = _requested_mode()
+        sampled = mode is None and _is_sampled()
+        if mode is None and not sampled:
+            return view(*args, **kwargs)
+
+        profile = RequestProfile(mode or 'sampled')
+        token = _current_profile.set(profile)
+
+        profiler = None
+        tracing = False
+        if mode == 'cprofile' or sampled:
+            profiler = cProfile.Profile()
+        elif mode == 'tracemalloc':
+            tracing = _start_tracemalloc()
+
+        try:
+            if profiler is not None:
+                rv = profiler.runcall(view, *args, **kwargs)
+            else:
+                rv = view(*args, **kwargs)
+        finally:
+            _current_profile.reset(token)
+            if profiler is not None:
+                profile.artifact = _artifact_path('prof')
+                profiler.dump_stats(profile.artifact)
+            if tracing:
+                _stop_tracemalloc(profile)
+
+        return _profiled_response(rv, profile, mode)
+
+    return wrapper
+
+
+def _profiled_async(view):
+    # cProfile solo sigue al hilo que lo activa y una corrutina pasa por varios: en las
+    # rutas async se usa el desglose por etapas y no hay muestreo
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        mode = _requested_mode()
+        if mode is None:
+            return await view(*args, **kwargs)
+        if mode == 'cprofile':
+            mode = 'stages'
+
+        profile = RequestProfile(mode)
+        token = _current_profile.set(profile)
+        tracing = mode == 'tracemalloc' and _start_tracemalloc()
+        try:
+            rv = await view(*args, **kwargs)
+        finally:
+            _current_profile.reset(token)
+            if tracing:
+                _stop_tracemalloc(profile)
+
+        return _profiled_response(rv, profile, mode)
+
+    return wrapper
+
+
+def _start_tracemalloc():
+    if tracemalloc.is_tracing() or not _tracemalloc_lock.acquire(blocking=False):
+        return False
+    tracemalloc.start(25)
+    return True
+
+
+def _stop_tracemalloc(profile):
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    _tracemalloc_lock.release()
+    profile.artifact = _artifact_path('tracemalloc')
+    snapshot.dump(profile.artifact)
+    profile.memory = dict(
+        profile.memory or {},
+        current_mb=round(current / (1024 * 1024), 3),
+        peak_mb=round(peak / (1024 * 1024), 3)
+    )
+
+
+def _profiled_response(rv, profile, mode):
+    response = make_response(rv)
+    response.headers['Server-Timing'] = profile.server_timing()
+
+    if mode is None:
+        return response
+
+    from app.utils.encoding import MSGPACK_MIMETYPES, msgpack
+
+    # El desglose se agrega al cuerpo ya serializado, en el mismo formato que negoció encode_response
+    if response.is_json:
+        data = response.get_json()
+        if isinstance(data, dict):
+            data['profile'] = profile.summary()
+            response.set_data(current_app.json.dumps(data))
+    elif response.mimetype in MSGPACK_MIMETYPES and msgpack is not None:
+        data = msgpack.unpackb(response.get_data(), raw=False)
+        if isinstance(data, dict):
+            data['profile'] = profile.summary()
+            response.set_data(msgpack.packb(data, use_bin_type=True))
+
+    return response
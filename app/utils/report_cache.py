@@ -0,0 +1,144 @@
+import copy
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from app.utils.metrics import REPORT_CACHE_ENTRIES, REPORT_CACHE_REQUESTS
+
+
+def image_dhash(image, size=8):
+    """Hash perceptual (dHash) de 64 bits: compara la luminosidad de columnas vecinas"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class CacheKey:
+    __slots__ = ('client_id', 'segments', 'statuses', 'angles', 'image_hash')
+
+    def __init__(self, client_id, segments, statuses, angles, image_hash):
+        self.client_id = client_id
+        self.segments = segments
+        self.statuses = statuses
+        self.angles = angles
+        self.image_hash = image_hash
+
+    @property
+    def signature(self):
+        return (self.client_id, self.segments, self.statuses)
+
+
+class ReportCache:
+    """
+    Caché de reportes de IA por similitud de postura.
+
+    Dos análisis comparten reporte si evalúan los mismos segmentos con los mismos
+    estados, todos sus ángulos (cuantizados) difieren como máximo angle_tolerance
+    grados y el hash perceptual de la imagen difiere en hash_tolerance bits o menos.
+    Un reporte describe la foto de una persona: solo se reutiliza para el mismo cliente,
+    salvo con shared=True.
+    """
+
+    def __init__(self, max_size=512, angle_tolerance=5.0, hash_tolerance=10, quantization=1.0, shared=False):
+        self.max_size = max(1, max_size)
+        self.shared = shared
+        self.angle_tolerance = angle_tolerance
+        self.hash_tolerance = hash_tolerance
+        self.quantization = quantization
+
+        self._entries = OrderedDict()  # id -> (key, report), en orden LRU
+        self._buckets = {}  # firma de estados -> {id: key}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, angle_details, image=None, client_id=None):
+        segments = tuple(d['segment'] for d in angle_details)
+        statuses = tuple(d['status'] == 'correcto' for d in angle_details)
+        angles = np.array([d['current_angle'] for d in angle_details], dtype=np.float32)
+        if self.quantization:
+            angles = np.round(angles / self.quantization) * self.quantization
+        image_hash = image_dhash(image) if image is not None else None
+        return CacheKey(None if self.shared else client_id, segments, statuses, angles, image_hash)
+
+    def lookup(self, key):
+        with self._lock:
+            best = None
+            for entry_id, candidate in self._buckets.get(key.signature, {}).items():
+                angle_distance = float(np.max(np.abs(candidate.angles - key.angles))) if len(key.angles) else 0.0
+                if angle_distance > self.angle_tolerance:
+                    continue
+
+                hash_distance = 0
+                if key.image_hash is not None and candidate.image_hash is not None:
+                    hash_distance = bin(key.image_hash ^ candidate.image_hash).count('1')
+                    if hash_distance > self.hash_tolerance:
+                        continue
+
+                score = (angle_distance / max(self.angle_tolerance, 1e-6)
+                         + hash_distance / max(self.hash_tolerance, 1))
+                if best is None or score < best[0]:
+                    best = (score, entry_id, angle_distance, hash_distance)
+
+            if best is None:
+                self.misses += 1
+                REPORT_CACHE_REQUESTS.labels('miss').inc()
+                return None
+
+            _, entry_id, angle_distance, hash_distance = best
+            self._entries.move_to_end(entry_id)
+            report = copy.deepcopy(self._entries[entry_id][1])
+            self.hits += 1
+            REPORT_CACHE_REQUESTS.labels('hit').inc()
+
+        report['origen'] = 'cache'
+        report['similitud'] = {
+            'max_diferencia_angulo': round(angle_distance, 2),
+            'distancia_hash_imagen': hash_distance
+        }
+        return report
+
+    def store(self, key, report):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (key, copy.deepcopy(report))
+            self._buckets.setdefault(key.signature, {})[entry_id] = key
+
+            while len(self._entries) > self.max_size:
+                old_id, (old_key, _) = self._entries.popitem(last=False)
+                bucket = self._buckets.get(old_key.signature)
+                if bucket is not None:
+                    bucket.pop(old_id, None)
+                    if not bucket:
+                        del self._buckets[old_key.signature]
+
+            REPORT_CACHE_ENTRIES.labels('ai_report').set(len(self._entries))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+def init_report_cache(app):
+    cache = None
+    if app.config['REPORT_CACHE_ENABLED']:
+        cache = ReportCache(
+            max_size=app.config['REPORT_CACHE_SIZE'],
+            angle_tolerance=app.config['REPORT_CACHE_ANGLE_TOLERANCE'],
+            hash_tolerance=app.config['REPORT_CACHE_HASH_TOLERANCE'],
+            shared=app.config['REPORT_CACHE_SHARED']
+        )
+    app.extensions['report_cache'] = cache
+    return cache
@@ -0,0 +1,17 @@
+import time
+
+from app.utils.state import get_state
+
+# Reportes de IA que llegan después de responder la solicitud. Se guardan en el estado
+# compartido (disco del nodo o Redis) para que cualquier worker o nodo atienda la consulta.
+REPORTS_FOLDER = 'ai_reports'
+REPORT_TTL = 24 * 3600
+
+
+def save_report(analysis_id, payload, folder=REPORTS_FOLDER):
+    payload = dict(payload, updated_at=time.time())
+    get_state().save(folder, analysis_id, payload, ttl=REPORT_TTL)
+
+
+def load_report(analysis_id, folder=REPORTS_FOLDER):
+    return get_state().load(folder, analysis_id)
@@ -0,0 +1,278 @@
+import json
+import os
+
+import numpy as np
+
+from app.utils.mediapipe_helper import ANGLE_NAMES, LANDMARK_NAMES
+
+# Posición de cada landmark en los arreglos (N, 21, 3): el orden de LANDMARK_NAMES
+LANDMARK_INDEX = {name: i for i, name in enumerate(LANDMARK_NAMES.values())}
+
+# Puntos (a, vértice, c) de cada ángulo, como en calculate_angles. Una tupla de
+# varios landmarks es su punto medio.
+ANGLE_POINTS = {
+    'left_hip': ('left_shoulder', 'left_hip', 'left_knee'),
+    'right_hip': ('right_shoulder', 'right_hip', 'right_knee'),
+    'left_knee': ('left_hip', 'left_knee', 'left_ankle'),
+    'right_knee': ('right_hip', 'right_knee', 'right_ankle'),
+    'left_ankle': ('left_knee', 'left_ankle', 'left_foot_index'),
+    'right_ankle': ('right_knee', 'right_ankle', 'right_foot_index'),
+    'left_elbow': ('left_shoulder', 'left_elbow', 'left_wrist'),
+    'right_elbow': ('right_shoulder', 'right_elbow', 'right_wrist'),
+    'neck': (('left_hip', 'right_hip'), ('left_shoulder', 'right_shoulder'), 'nose'),
+    'left_shoulder': ('left_hip', 'left_shoulder', 'left_elbow'),
+    'right_shoulder': ('right_hip', 'right_shoulder', 'right_elbow'),
+    'left_wrist': ('left_elbow', 'left_wrist', ('left_index', 'left_pinky')),
+    'right_wrist': ('right_elbow', 'right_wrist', ('right_index', 'right_pinky')),
+    'visual': (('left_shoulder', 'right_shoulder'), ('left_ear', 'right_ear'), 'nose')
+}
+
+# Comprobaciones de evaluate_posture -> ángulos que usa (con dos, se evalúa el promedio)
+CHECKS = {
+    'hip': ('left_hip', 'right_hip'),
+    'left_knee': ('left_knee',),
+    'right_knee': ('right_knee',),
+    'left_ankle': ('left_ankle',),
+    'right_ankle': ('right_ankle',),
+    'left_elbow': ('left_elbow',),
+    'right_elbow': ('right_elbow',),
+    'neck': ('neck',),
+    'left_shoulder': ('left_shoulder',),
+    'right_shoulder': ('right_shoulder',),
+    'left_wrist': ('left_wrist',),
+    'right_wrist': ('right_wrist',),
+    'visual': ('visual',)
+}
+
+# Rangos de evaluate_posture (los de un puesto de trabajo sentado)
+_SEATED = {
+    'hip': (80, 120),
+    'left_knee': (80, 110),
+    'right_knee': (80, 110),
+    'left_ankle': (80, 120),
+    'right_ankle': (80, 120),
+    'left_elbow': (90, 120),
+    'right_elbow': (90, 120),
+    'neck': (130, 180),
+    'left_shoulder': (0, 20),
+    'right_shoulder': (0, 20),
+    'left_wrist': (160, 190),
+    'right_wrist': (160, 190),
+    'visual': (80, 110)
+}
+
+DEFAULT_PROFILES = {
+    'actual': _SEATED,
+    'sentado': _SEATED,
+    # De pie: tronco-muslo y muslo-pierna casi extendidos
+    'de_pie': dict(
+        _SEATED,
+        hip=(160, 180),
+        left_knee=(160, 180),
+        right_knee=(160, 180),
+        left_ankle=(70, 110),
+        right_ankle=(70, 110)
+    )
+}
+
+
+class ProfileError(ValueError):
+    """Perfil de umbrales desconocido o mal definido"""
+
+
+def _parse_range(check, value):
+    if value is None:
+        return None
+    try:
+        low, high = (float(v) for v in value)
+    except (TypeError, ValueError):
+        raise ProfileError(f'El rango de {check} debe ser [mínimo, máximo] o null')
+    if low > high:
+        raise ProfileError(f'El rango de {check} tiene el mínimo mayor que el máximo')
+    return low, high
+
+
+def resolve_profile(definition, profiles):
+    """
+    Umbrales de un perfil personalizado: {"base": "sentado", "neck": [140, 180], "visual": null}.
+    Los rangos que no se indican se toman del perfil base (por defecto "actual");
+    null desactiva la comprobación.
+    """
+    if not isinstance(definition, dict):
+        raise ProfileError('Un perfil debe ser un objeto con rangos por comprobación')
+
+    definition = dict(definition)
+    base = definition.pop('base', 'actual')
+    if base not in profiles:
+        raise ProfileError(f'Perfil base desconocido: {base}')
+
+    thresholds = dict(profiles[base])
+    for check, value in definition.items():
+        if check not in CHECKS:
+            raise ProfileError(f'Comprobación desconocida: {check} (válidas: {", ".join(CHECKS)})')
+        thresholds[check] = _parse_range(check, value)
+    return thresholds
+
+
+def load_profiles(path=None):
+    """Perfiles incorporados más los del archivo JSON {nombre: definición}, si existe"""
+    profiles = dict(DEFAULT_PROFILES)
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for name, definition in json.load(f).items():
+                profiles[name] = resolve_profile(definition, profiles)
+    return profiles
+
+
+def _point(landmarks, point):
+    """(N, 2) en float64; una tupla de landmarks es su punto medio"""
+    if isinstance(point, tuple):
+        first, second = (landmarks[:, LANDMARK_INDEX[name], :2] for name in point)
+        return (first.astype(np.float64) + second) / 2
+    return landmarks[:, LANDMARK_INDEX[point], :2].astype(np.float64)
+
+
+def compute_angles(landmarks):
+    """Los mismos ángulos que calculate_angles para un arreglo (N, 21, 2|3) de landmarks"""
+    angles = {}
+    for name in ANGLE_NAMES:
+        a, b, c = (_point(landmarks, point) for point in ANGLE_POINTS[name])
+        radians = np.arctan2(c[:, 1] - b[:, 1], c[:, 0] - b[:, 0]) - np.arctan2(a[:, 1] - b[:, 1], a[:, 0] - b[:, 0])
+        angle = np.abs(radians * 180.0 / np.pi)
+        angles[name] = np.where(angle > 180.0, 360 - angle, angle)
+    return angles
+
+
+def evaluate(angles, thresholds):
+    """(postura correcta, {comprobación: fuera de rango}) por fila, como evaluate_posture"""
+    size = len(next(iter(angles.values())))
+    good = np.ones(size, dtype=bool)
+    failures = {}
+    for check, limits in thresholds.items():
+        if limits is None:
+            continue
+        names = CHECKS[check]
+        value = angles[names[0]] if len(names) == 1 else (angles[names[0]] + angles[names[1]]) / 2
+        bad = (value < limits[0]) | (value > limits[1])
+        failures[check] = bad
+        good &= ~bad
+    return good, failures
+
+
+def deviations(angles, thresholds):
+    """Grados fuera de rango de cada comprobación (0 dentro del rango), por fila"""
+    result = {}
+    for check, limits in thresholds.items():
+        if limits is None:
+            continue
+        names = CHECKS[check]
+        value = angles[names[0]] if len(names) == 1 else (angles[names[0]] + angles[names[1]]) / 2
+        result[check] = np.maximum(np.maximum(limits[0] - value, value - limits[1]), 0.0)
+    return result
+
+
+def rescore(landmarks, profiles, verdicts=None, chunk_rows=262144, out=None):
+    """
+    Reevalúa todas las filas con cada perfil {nombre: umbrales}, por bloques de
+    chunk_rows filas para no cargar entero un arreglo mapeado en memoria. Los
+    ángulos de cada bloque se calculan una sola vez para todos los perfiles.
+
+    verdicts: veredictos guardados (bool por fila) para contar los que cambian.
+    out: arreglo (N, perfiles) donde escribir el veredicto de cada fila, opcional.
+    """
+    names = list(profiles)
+    totals = {
+        name: {
+            'good': 0,
+            'changed': 0,
+            'became_good': 0,
+            'became_bad': 0,
+            'checks': {check: 0 for check, limits in profiles[name].items() if limits is not None}
+        }
+        for name in names
+    }
+
+    rows = len(landmarks)
+    for start in range(0, rows, chunk_rows):
+        end = min(rows, start + chunk_rows)
+        angles = compute_angles(landmarks[start:end])
+        stored = None if verdicts is None else np.asarray(verdicts[start:end], dtype=bool)
+
+        for column, name in enumerate(names):
+            good, failures = evaluate(angles, profiles[name])
+            summary = totals[name]
+            summary['good'] += int(np.count_nonzero(good))
+            for check, bad in failures.items():
+                summary['checks'][check] += int(np.count_nonzero(bad))
+            if stored is not None:
+                summary['became_good'] += int(np.count_nonzero(good & ~stored))
+                summary['became_bad'] += int(np.count_nonzero(~good & stored))
+            if out is not None:
+                out[start:end, column] = good
+
+    result = {}
+    for name in names:
+        summary = totals[name]
+        result[name] = {
+            'total': rows,
+            'good': summary['good'],
+            'bad': rows - summary['good'],
+            'good_ratio': round(summary['good'] / rows, 4) if rows else None,
+            'thresholds': {check: list(limits) if limits else None for check, limits in profiles[name].items()},
+            'checks': {
+                check: {'bad': bad, 'ratio': round(bad / rows, 4) if rows else None}
+                for check, bad in summary['checks'].items()
+            }
+        }
+        if verdicts is not None:
+            result[name]['changed'] = summary['became_good'] + summary['became_bad']
+            result[name]['became_good'] = summary['became_good']
+            result[name]['became_bad'] = summary['became_bad']
+    return result
+
+
+class Dataset:
+    """
+    Landmarks guardados en un directorio: landmarks.npy (N, 21, 3) float32 en el
+    orden de LANDMARK_NAMES y, opcionales, verdicts.npy (veredicto original) e
+    ids.txt (un identificador por fila). Los .npy se abren mapeados en memoria.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.landmarks = np.load(os.path.join(path, 'landmarks.npy'), mmap_mode='r')
+        if self.landmarks.ndim != 3 or self.landmarks.shape[1] != len(LANDMARK_NAMES):
+            raise ValueError(f'landmarks.npy debe tener forma (N, {len(LANDMARK_NAMES)}, 3)')
+
+        verdicts_path = os.path.join(path, 'verdicts.npy')
+        self.verdicts = np.load(verdicts_path, mmap_mode='r') if os.path.exists(verdicts_path) else None
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def ids(self):
+        path = os.path.join(self.path, 'ids.txt')
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f]
+
+
+def save_dataset(path, landmarks, verdicts=None, ids=None):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'landmarks.npy'), np.asarray(landmarks, dtype=np.float32))
+    if verdicts is not None:
+        np.save(os.path.join(path, 'verdicts.npy'), np.asarray(verdicts, dtype=bool))
+    if ids is not None:
+        with open(os.path.join(path, 'ids.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(f'{row_id}\n' for row_id in ids)
+
+
+def landmarks_to_array(records):
+    """(N, 21, 3) float32 a partir de diccionarios {nombre: {'x', 'y', 'z'}}"""
+    array = np.empty((len(records), len(LANDMARK_NAMES), 3), dtype=np.float32)
+    for row, landmarks in enumerate(records):
+        for name, column in LANDMARK_INDEX.items():
+            point = landmarks[name]
+            array[row, column] = (point['x'], point['y'], point['z'])
+    return array
@@ -0,0 +1,323 @@
+import asyncio
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from itertools import count
+
+from flask import current_app, jsonify
+
+from app.utils.metrics import QUEUE_DEPTH, QUEUE_REJECTED, QUEUE_RUNNING, QUEUE_WAIT
+from app.utils.profiling import record_stage
+
+# Menor número = mayor prioridad
+PRIORIDADES = {
+    'interactive': 0,
+    'batch': 1,
+    'video': 2
+}
+
+
+class AdmissionRejected(Exception):
+    """Solicitud rechazada por el planificador (cola llena o espera agotada)"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ('job_class', 'client_id', 'seq', 'enqueued_at', 'granted')
+
+    def __init__(self, job_class, client_id, seq):
+        self.job_class = job_class
+        self.client_id = client_id
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class AdmissionScheduler:
+    """
+    Control de admisión para las etapas intensivas en CPU.
+
+    Reparte un número fijo de slots entre clases de trabajo con prioridad
+    estricta (interactive > batch > video), limita la concurrencia y la cola
+    de cada clase y aplica un reparto justo entre clientes.
+    """
+
+    def __init__(self, cpu_slots, class_limits, queue_limits, max_wait,
+                 max_per_client, enabled=True):
+        self.enabled = enabled
+        self.cpu_slots = max(1, cpu_slots)
+        self.class_limits = {c: max(1, class_limits.get(c, self.cpu_slots)) for c in PRIORIDADES}
+        self.queue_limits = {c: max(0, queue_limits.get(c, 0)) for c in PRIORIDADES}
+        self.max_wait = max_wait
+        self.max_per_client = max_per_client
+
+        self._cond = threading.Condition()
+        self._seq = count()
+        self._queues = {c: deque() for c in PRIORIDADES}
+        self._running = defaultdict(int)
+        self._total_running = 0
+        self._client_load = defaultdict(int)
+        self._client_running = defaultdict(int)
+        self._client_served = defaultdict(int)
+
+        self._stats = {
+            c: {
+                'admitted': 0,
+                'rejected': 0,
+                'completed': 0,
+                'wait_total': 0.0,
+                'wait_max': 0.0,
+                'service_avg': 0.0
+            }
+            for c in PRIORIDADES
+        }
+
+    @contextmanager
+    def slot(self, job_class, client_id):
+        if not self.enabled:
+            yield None
+            return
+
+        ticket = self._acquire(job_class, client_id)
+        start = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            self._release(ticket, time.monotonic() - start)
+
+    @asynccontextmanager
+    async def async_slot(self, job_class, client_id):
+        """slot() para el modo ASGI: la espera en cola ocurre en un hilo y no bloquea el event loop"""
+        from app.utils.asgi import run_blocking
+
+        if not self.enabled:
+            yield None
+            return
+
+        acquiring = run_blocking(self._acquire, job_class, client_id)
+        try:
+            ticket = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # La solicitud se canceló en la cola: el slot se libera en cuanto se conceda
+            acquiring.add_done_callback(
+                lambda f: f.cancelled() or f.exception() or self._release(f.result(), 0.0)
+            )
+            raise
+
+        start = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            self._release(ticket, time.monotonic() - start)
+
+    def resize(self, cpu_slots):
+        """Cambia los slots de CPU, p. ej. al conocer los núcleos asignados al worker"""
+        with self._cond:
+            self.cpu_slots = max(1, cpu_slots)
+            self.class_limits['interactive'] = self.cpu_slots
+            self._dispatch()
+
+    def _acquire(self, job_class, client_id):
+        if job_class not in PRIORIDADES:
+            raise ValueError(f'Clase de trabajo desconocida: {job_class}')
+
+        with self._cond:
+            stats = self._stats[job_class]
+            queue = self._queues[job_class]
+
+            if self.max_per_client and self._client_load[client_id] >= self.max_per_client:
+                stats['rejected'] += 1
+                QUEUE_REJECTED.labels(job_class).inc()
+                raise AdmissionRejected(
+                    'Demasiadas solicitudes simultáneas para este cliente',
+                    self._retry_after(job_class)
+                )
+
+            if len(queue) >= self.queue_limits[job_class] and not self._has_free_slot(job_class):
+                stats['rejected'] += 1
+                QUEUE_REJECTED.labels(job_class).inc()
+                raise AdmissionRejected(
+                    'Servidor saturado, intenta nuevamente más tarde',
+                    self._retry_after(job_class)
+                )
+
+            ticket = _Ticket(job_class, client_id, next(self._seq))
+            queue.append(ticket)
+            self._client_load[client_id] += 1
+            self._dispatch()
+
+            deadline = ticket.enqueued_at + self.max_wait
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(ticket)
+                    self._client_load[client_id] -= 1
+                    if self._client_load[client_id] <= 0:
+                        self._client_load.pop(client_id, None)
+                        self._client_served.pop(client_id, None)
+                    stats['rejected'] += 1
+                    QUEUE_REJECTED.labels(job_class).inc()
+                    self._publish_gauges()
+                    raise AdmissionRejected(
+                        'Tiempo de espera en cola agotado',
+                        self._retry_after(job_class)
+                    )
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - ticket.enqueued_at
+            stats['admitted'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+            QUEUE_WAIT.labels(job_class).observe(waited)
+            record_stage('scheduler_wait', waited)
+            return ticket
+
+    def _release(self, ticket, service_time):
+        with self._cond:
+            stats = self._stats[ticket.job_class]
+            stats['completed'] += 1
+            # Media móvil exponencial del tiempo de servicio, usada para Retry-After
+            if stats['service_avg'] == 0:
+                stats['service_avg'] = service_time
+            else:
+                stats['service_avg'] = 0.8 * stats['service_avg'] + 0.2 * service_time
+
+            self._running[ticket.job_class] -= 1
+            self._total_running -= 1
+            self._client_running[ticket.client_id] -= 1
+            self._client_load[ticket.client_id] -= 1
+            if self._client_load[ticket.client_id] <= 0:
+                self._client_load.pop(ticket.client_id, None)
+                self._client_running.pop(ticket.client_id, None)
+                self._client_served.pop(ticket.client_id, None)
+
+            self._dispatch()
+
+    def _has_free_slot(self, job_class):
+        return (self._total_running < self.cpu_slots
+                and self._running[job_class] < self.class_limits[job_class]
+                and not any(self._queues[c] for c in PRIORIDADES
+                            if PRIORIDADES[c] <= PRIORIDADES[job_class]))
+
+    def _dispatch(self):
+        granted = False
+        while self._total_running < self.cpu_slots:
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            self._queues[ticket.job_class].remove(ticket)
+            ticket.granted = True
+            self._running[ticket.job_class] += 1
+            self._total_running += 1
+            self._client_running[ticket.client_id] += 1
+            self._client_served[ticket.client_id] += 1
+            granted = True
+
+        if granted:
+            self._cond.notify_all()
+        self._publish_gauges()
+
+    def _publish_gauges(self):
+        for job_class in PRIORIDADES:
+            QUEUE_DEPTH.labels(job_class).set(len(self._queues[job_class]))
+            QUEUE_RUNNING.labels(job_class).set(self._running[job_class])
+
+    def _next_ticket(self):
+        for job_class in sorted(PRIORIDADES, key=PRIORIDADES.get):
+            queue = self._queues[job_class]
+            if not queue or self._running[job_class] >= self.class_limits[job_class]:
+                continue
+            # Reparto justo: primero el cliente con menos trabajos en ejecución y atendidos, FIFO en empate
+            return min(queue, key=lambda t: (
+                self._client_running[t.client_id],
+                self._client_served[t.client_id],
+                t.seq
+            ))
+        return None
+
+    def _retry_after(self, job_class):
+        service_avg = self._stats[job_class]['service_avg'] or 1.0
+        pending = len(self._queues[job_class]) + 1
+        estimate = service_avg * pending / self.class_limits[job_class]
+        return int(min(300, max(1, math.ceil(estimate))))
+
+    def stats(self):
+        with self._cond:
+            result = {
+                'enabled': self.enabled,
+                'cpu_slots': self.cpu_slots,
+                'running': self._total_running,
+                'classes': {}
+            }
+            for job_class in PRIORIDADES:
+                stats = self._stats[job_class]
+                queue = self._queues[job_class]
+                now = time.monotonic()
+                result['classes'][job_class] = {
+                    'priority': PRIORIDADES[job_class],
+                    'running': self._running[job_class],
+                    'limit': self.class_limits[job_class],
+                    'queued': len(queue),
+                    'queue_limit': self.queue_limits[job_class],
+                    'oldest_wait_seconds': round(now - queue[0].enqueued_at, 3) if queue else 0.0,
+                    'admitted': stats['admitted'],
+                    'rejected': stats['rejected'],
+                    'completed': stats['completed'],
+                    'avg_wait_seconds': round(stats['wait_total'] / stats['admitted'], 3) if stats['admitted'] else 0.0,
+                    'max_wait_seconds': round(stats['wait_max'], 3),
+                    'avg_service_seconds': round(stats['service_avg'], 3)
+                }
+            return result
+
+
+def init_scheduler(app):
+    cpu_slots = app.config['SCHEDULER_CPU_SLOTS']
+    scheduler = AdmissionScheduler(
+        cpu_slots=cpu_slots,
+        class_limits={
+            'interactive': cpu_slots,
+            'batch': app.config['SCHEDULER_BATCH_CONCURRENCY'],
+            'video': app.config['SCHEDULER_VIDEO_CONCURRENCY']
+        },
+        queue_limits=app.config['SCHEDULER_QUEUE_LIMITS'],
+        max_wait=app.config['SCHEDULER_MAX_WAIT'],
+        max_per_client=app.config['SCHEDULER_MAX_PER_CLIENT'],
+        enabled=app.config['SCHEDULER_ENABLED']
+    )
+    app.extensions['scheduler'] = scheduler
+    return scheduler
+
+
+def get_scheduler():
+    return current_app.extensions['scheduler']
+
+
+def get_client_id(req):
+    """
+    Identifica al cliente para el reparto justo: el usuario del X-User-Token firmado o,
+    sin él, la IP. Las cabeceras que el cliente puede inventar (X-Client-Id, los saltos de
+    X-Forwarded-For que no agregó un proxy de confianza) no cuentan: rotándolas se
+    esquivaría el límite por cliente. Detrás de TRUSTED_PROXIES proxies, remote_addr ya
+    es la IP que vio el primero de ellos (ProxyFix en create_app).
+    """
+    from app.utils.history import history_client_id
+
+    user_id = history_client_id(req)
+    if user_id:
+        return f'usuario:{user_id}'
+    return req.remote_addr or 'anonimo'
+
+
+def rejection_response(error):
+    response = jsonify({
+        'error': str(error),
+        'retry_after': error.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
@@ -0,0 +1,197 @@
+import math
+
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+SMOOTHING_METHODS = ('none', 'one_euro', 'kalman')
+
+
+class OneEuroFilter:
+    """
+    Filtro One-Euro (Casiez et al., 2012) sobre un arreglo de señales. Con la señal quieta
+    corta en min_cutoff Hz y elimina el temblor; al moverse, el corte sube con beta por la
+    velocidad y el filtro sigue el movimiento sin retraso apreciable.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.3, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self._x = self._dx = self._t = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        return 1.0 / (1.0 + 1.0 / (2 * math.pi * cutoff * dt))
+
+    def __call__(self, x, t):
+        x = np.asarray(x, dtype=np.float64)
+        if self._x is None:
+            self._x, self._dx, self._t = x, np.zeros_like(x), t
+            return x
+
+        dt = t - self._t
+        if dt <= 0:
+            return self._x
+
+        a_d = self._alpha(self.d_cutoff, dt)
+        self._dx = a_d * (x - self._x) / dt + (1 - a_d) * self._dx
+        a = self._alpha(self.min_cutoff + self.beta * np.abs(self._dx), dt)
+        self._x = a * x + (1 - a) * self._x
+        self._t = t
+        return self._x
+
+
+class KalmanFilter:
+    """
+    Kalman de velocidad constante, independiente por señal. process_noise es la varianza
+    de la aceleración (unidades/s²)² y measurement_noise la del temblor de cada medición.
+    """
+
+    def __init__(self, process_noise=1.0, measurement_noise=1e-4):
+        self.q = process_noise
+        self.r = measurement_noise
+        self.reset()
+
+    def reset(self):
+        self._x = self._v = self._t = None
+        self._p00 = self._p01 = self._p11 = None
+
+    def __call__(self, z, t):
+        z = np.asarray(z, dtype=np.float64)
+        if self._x is None:
+            self._x, self._v, self._t = z, np.zeros_like(z), t
+            self._p00 = np.full_like(z, self.r)
+            self._p01 = np.zeros_like(z)
+            self._p11 = np.full_like(z, self.q)
+            return z
+
+        dt = t - self._t
+        if dt <= 0:
+            return self._x
+
+        # Predicción
+        x = self._x + self._v * dt
+        p00 = self._p00 + dt * (2 * self._p01 + dt * self._p11) + self.q * dt ** 4 / 4
+        p01 = self._p01 + dt * self._p11 + self.q * dt ** 3 / 2
+        p11 = self._p11 + self.q * dt ** 2
+
+        # Corrección con la medición
+        s = p00 + self.r
+        k0, k1 = p00 / s, p01 / s
+        residual = z - x
+        self._x = x + k0 * residual
+        self._v = self._v + k1 * residual
+        self._p00, self._p01, self._p11 = (1 - k0) * p00, (1 - k0) * p01, p11 - k1 * p01
+        self._t = t
+        return self._x
+
+
+class VerdictHysteresis:
+    """El veredicto solo cambia después de hold_frames cuadros seguidos con el contrario"""
+
+    def __init__(self, hold_frames=3):
+        self.hold_frames = hold_frames
+        self.reset()
+
+    def reset(self):
+        self.state = None
+        self._streak = 0
+
+    def __call__(self, raw):
+        if self.state is None or raw == self.state:
+            self.state, self._streak = raw, 0
+        else:
+            self._streak += 1
+            if self._streak >= self.hold_frames:
+                self.state, self._streak = raw, 0
+        return self.state
+
+
+class PostureSmoother:
+    """
+    Estado temporal del análisis de un video: filtra los landmarks y los ángulos entre
+    cuadros y aplica histéresis al veredicto, para que el temblor de los landmarks no
+    haga parpadear la postura entre correcta y mala. Con method='none' solo se aplica la
+    histéresis. Uno por video; no es seguro entre hilos.
+
+    Si la persona desaparece más de reset_after segundos, el filtro empieza de nuevo.
+    """
+
+    def __init__(self, method='one_euro', min_cutoff=1.0, beta=0.3, process_noise=1.0,
+                 measurement_noise=1e-4, hold_frames=3, reset_after=0.5):
+        if method not in SMOOTHING_METHODS:
+            raise ValueError(f'Método de suavizado desconocido: {method} (opciones: {", ".join(SMOOTHING_METHODS)})')
+        self.method = method
+        self.filter_options = (min_cutoff, beta, process_noise, measurement_noise)
+        self.reset_after = reset_after
+        self.hysteresis = VerdictHysteresis(hold_frames)
+        self.angles = {}  # último valor filtrado de cada ángulo
+        self._landmark_filter = self._new_filter()
+        self._angle_filters = {}
+        self._timestamp = None
+
+    def _new_filter(self):
+        min_cutoff, beta, process_noise, measurement_noise = self.filter_options
+        if self.method == 'one_euro':
+            return OneEuroFilter(min_cutoff, beta)
+        if self.method == 'kalman':
+            return KalmanFilter(process_noise, measurement_noise)
+        return None
+
+    def reset(self):
+        if self._landmark_filter is not None:
+            self._landmark_filter.reset()
+        self._angle_filters.clear()
+        self.hysteresis.reset()
+        self.angles.clear()
+
+    def landmarks(self, pose_landmarks, timestamp):
+        """Copia de pose_landmarks con x, y, z filtrados"""
+        if self._timestamp is not None and timestamp - self._timestamp > self.reset_after:
+            self.reset()
+        self._timestamp = timestamp
+        if self._landmark_filter is None:
+            return pose_landmarks
+
+        points = np.array([(lm.x, lm.y, lm.z) for lm in pose_landmarks.landmark], dtype=np.float64)
+        points = self._landmark_filter(points, timestamp)
+
+        smoothed = landmark_pb2.NormalizedLandmarkList()
+        smoothed.CopyFrom(pose_landmarks)
+        for landmark, (x, y, z) in zip(smoothed.landmark, points.tolist()):
+            landmark.x, landmark.y, landmark.z = x, y, z
+        return smoothed
+
+    def angle(self, name, degrees):
+        """Ángulo filtrado; se filtra en radianes para que beta valga lo mismo que en los landmarks"""
+        if self._landmark_filter is not None and self._timestamp is not None:
+            angle_filter = self._angle_filters.get(name)
+            if angle_filter is None:
+                angle_filter = self._angle_filters[name] = self._new_filter()
+            degrees = math.degrees(float(angle_filter(math.radians(degrees), self._timestamp)))
+        self.angles[name] = degrees
+        return degrees
+
+    def verdict(self, es_mala_postura):
+        return self.hysteresis(es_mala_postura)
+
+
+def video_smoothing_options(config):
+    """
+    Opciones de PostureSmoother según la configuración. El filtro y la histéresis se activan
+    por separado; None si ninguno está activo (con hold_frames=1 el veredicto ya cambia en
+    el primer cuadro contrario).
+    """
+    if config['VIDEO_SMOOTHING'] == 'none' and config['VIDEO_VERDICT_HOLD_FRAMES'] <= 1:
+        return None
+    return {
+        'method': config['VIDEO_SMOOTHING'],
+        'min_cutoff': config['VIDEO_SMOOTHING_MIN_CUTOFF'],
+        'beta': config['VIDEO_SMOOTHING_BETA'],
+        'process_noise': config['VIDEO_SMOOTHING_PROCESS_NOISE'],
+        'measurement_noise': config['VIDEO_SMOOTHING_MEASUREMENT_NOISE'],
+        'hold_frames': config['VIDEO_VERDICT_HOLD_FRAMES']
+    }
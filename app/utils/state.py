@@ -0,0 +1,310 @@
+import json
+import os
+import socket
+import ssl
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import unquote, urlparse
+
+# Vigencia por defecto de cada estado (reportes, subidas, ubicación de archivos)
+DEFAULT_TTL = 24 * 3600
+
+# Ubicación de los archivos que solo existen en el disco de un nodo
+ARTIFACTS_NAMESPACE = 'artifacts'
+
+# Marca las solicitudes reenviadas entre nodos para no reenviarlas otra vez
+FORWARDED_HEADER = 'X-Forwarded-Node'
+
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+    'transfer-encoding', 'upgrade', 'host', 'content-length'
+}
+
+
+class StateBackendError(Exception):
+    """Error del servidor de estado compartido"""
+
+
+class FileStateBackend:
+    """
+    Un archivo JSON por clave en la carpeta del espacio de nombres. Sirve para un solo
+    nodo (o varios con la carpeta en un volumen compartido).
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._last_sweep = {}  # carpeta -> momento del último barrido
+
+    def _path(self, namespace, key):
+        return os.path.join(namespace, f'{key}.json')
+
+    def save(self, namespace, key, payload, ttl=DEFAULT_TTL):
+        os.makedirs(namespace, exist_ok=True)
+
+        # Escritura atómica: otro worker puede estar leyendo el archivo
+        fd, tmp_path = tempfile.mkstemp(dir=namespace, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(namespace, key))
+
+        self._sweep(namespace, ttl)
+
+    def load(self, namespace, key):
+        try:
+            with open(self._path(namespace, key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def delete(self, namespace, key):
+        try:
+            os.remove(self._path(namespace, key))
+        except OSError:
+            pass
+
+    def keys(self, namespace):
+        if not os.path.isdir(namespace):
+            return []
+        return [name[:-len('.json')] for name in os.listdir(namespace) if name.endswith('.json')]
+
+    def _sweep(self, folder, ttl):
+        """Elimina estados vencidos, como máximo una vez por minuto"""
+        now = time.time()
+        if now - self._last_sweep.get(folder, 0.0) < 60:
+            return
+        self._last_sweep[folder] = now
+
+        for name in os.listdir(folder):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                if now - os.path.getmtime(path) > ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class RedisStateBackend:
+    """
+    Estado compartido entre nodos en un servidor que hable el protocolo de Redis
+    (Redis, Valkey, KeyDB...). Cliente RESP mínimo sin dependencias: una conexión
+    por hilo y por proceso, claves <prefijo>:<espacio>:<clave> con vencimiento.
+    """
+
+    shared = True
+
+    def __init__(self, url, prefix='analisis_postural', timeout=5.0):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('redis', 'rediss'):
+            raise ValueError(f'URL de estado no soportada: {url}')
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.tls = parsed.scheme == 'rediss'
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _key(self, namespace, key):
+        return f'{self.prefix}:{os.path.basename(namespace.rstrip("/"))}:{key}'
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        conn = (sock, sock.makefile('rb'))
+        if self.password:
+            auth = ('AUTH', self.username, self.password) if self.username else ('AUTH', self.password)
+            self._roundtrip(conn, auth)
+        if self.db:
+            self._roundtrip(conn, ('SELECT', self.db))
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = self._connect()
+            self._local.pid = os.getpid()
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[0].close()
+            except OSError:
+                pass
+
+    def _roundtrip(self, conn, args):
+        sock, reader = conn
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        sock.sendall(b''.join(parts))
+        return _read_reply(reader)
+
+    def command(self, *args):
+        # Una conexión rota (reinicio del servidor, timeout del balanceador) se reintenta una vez
+        for attempt in range(2):
+            try:
+                return self._roundtrip(self._connection(), args)
+            except (OSError, EOFError):
+                self._close()
+                if attempt:
+                    raise
+
+    def save(self, namespace, key, payload, ttl=DEFAULT_TTL):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        if ttl:
+            self.command('SET', self._key(namespace, key), data, 'EX', int(ttl))
+        else:
+            self.command('SET', self._key(namespace, key), data)
+
+    def load(self, namespace, key):
+        data = self.command('GET', self._key(namespace, key))
+        return json.loads(data) if data is not None else None
+
+    def delete(self, namespace, key):
+        self.command('DEL', self._key(namespace, key))
+
+    def keys(self, namespace):
+        pattern = self._key(namespace, '*')
+        start = len(pattern) - 1
+        cursor, keys = b'0', []
+        while True:
+            cursor, batch = self.command('SCAN', cursor, 'MATCH', pattern, 'COUNT', 500)
+            keys.extend(k.decode()[start:] for k in batch)
+            if cursor == b'0':
+                return keys
+
+
+def _read_reply(reader):
+    line = reader.readline()
+    if not line:
+        raise EOFError('El servidor de estado cerró la conexión')
+    kind, value = line[:1], line[1:-2]
+    if kind == b'+':
+        return value.decode()
+    if kind == b'-':
+        raise StateBackendError(value.decode())
+    if kind == b':':
+        return int(value)
+    if kind == b'$':
+        length = int(value)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        length = int(value)
+        return None if length < 0 else [_read_reply(reader) for _ in range(length)]
+    raise StateBackendError(f'Respuesta RESP inválida: {line!r}')
+
+
+_backend = FileStateBackend()
+_node = {'id': socket.gethostname(), 'url': None, 'forward_timeout': 60.0}
+
+
+def get_state():
+    return _backend
+
+
+def node_id():
+    return _node['id']
+
+
+def register_artifact(key, path):
+    """Anota qué nodo tiene un archivo local; solo hace falta si el estado es compartido"""
+    if not _backend.shared:
+        return
+    _backend.save(ARTIFACTS_NAMESPACE, key, {
+        'node': _node['id'],
+        'url': _node['url'],
+        'path': os.path.abspath(path),
+        'created_at': time.time()
+    })
+
+
+def forget_artifact(key):
+    if _backend.shared:
+        _backend.delete(ARTIFACTS_NAMESPACE, key)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Las redirecciones (p. ej. a Cloudinary) se devuelven tal cual al cliente
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def forward_to_owner(key):
+    """
+    Si el archivo `key` está en otro nodo, reenvía la solicitud actual a ese nodo y
+    devuelve su respuesta (por bloques, sin cargarla en memoria). None si no aplica.
+    """
+    from flask import Response, jsonify, request
+
+    if not _backend.shared or request.headers.get(FORWARDED_HEADER):
+        return None
+    location = _backend.load(ARTIFACTS_NAMESPACE, key)
+    if location is None or location['node'] == _node['id'] or not location.get('url'):
+        return None
+
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+    headers[FORWARDED_HEADER] = _node['id']
+    data = None
+    if request.content_length:
+        headers['Content-Length'] = str(request.content_length)
+        data = request.stream
+
+    upstream_request = urllib.request.Request(
+        location['url'].rstrip('/') + request.full_path.rstrip('?'),
+        data=data, method=request.method, headers=headers
+    )
+    try:
+        upstream = _opener.open(upstream_request, timeout=_node['forward_timeout'])
+    except urllib.error.HTTPError as e:
+        upstream = e
+    except (urllib.error.URLError, OSError) as e:
+        return jsonify({'error': f'El nodo {location["node"]} que tiene el archivo no responde: {e}'}), 502
+
+    def body():
+        try:
+            for chunk in iter(lambda: upstream.read(64 * 1024), b''):
+                yield chunk
+        finally:
+            upstream.close()
+
+    response_headers = [(k, v) for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+    length = upstream.headers.get('Content-Length')
+    if length is not None:
+        response_headers.append(('Content-Length', length))
+    return Response(body(), status=upstream.status, headers=response_headers, direct_passthrough=True)
+
+
+def init_state(app):
+    global _backend
+
+    config = app.config
+    if config['STATE_BACKEND'] == 'redis':
+        _backend = RedisStateBackend(config['STATE_REDIS_URL'], prefix=config['STATE_PREFIX'])
+    else:
+        _backend = FileStateBackend()
+    _node.update(
+        id=config['NODE_ID'],
+        url=config['NODE_URL'],
+        forward_timeout=config['STATE_FORWARD_TIMEOUT']
+    )
+    app.extensions['state'] = _backend
+    return _backend
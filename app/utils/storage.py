@@ -0,0 +1,294 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from app.utils.metrics import STORAGE_BYTES, STORAGE_EVICTIONS
+
+INPUT_FOLDER = 'uploaded_videos'
+OUTPUT_FOLDER = 'output_videos'
+CHUNKED_FOLDER = os.path.join(INPUT_FOLDER, 'parciales')
+
+# Registro de archivos eliminados por la política de retención
+EVICTED_FOLDER = '.eliminados'
+OWNER_FILE = '.owner'
+
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _boot_id():
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def _start_time(pid):
+    """Momento de inicio del proceso (ticks desde el arranque); '' si no se puede leer"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ''
+
+
+_BOOT_ID = _boot_id()
+
+
+def process_token(pid=None):
+    """
+    Identifica a un proceso de forma única en el tiempo: arranque del sistema, pid y
+    momento de inicio. Un pid reutilizado tras un reinicio (también del contenedor)
+    no se confunde con el dueño original.
+    """
+    pid = pid or os.getpid()
+    return f'{_BOOT_ID}:{pid}:{_start_time(pid)}'
+
+
+def owner_alive(token):
+    """Si el proceso de un process_token sigue en ejecución"""
+    try:
+        boot_id, pid, start_time = str(token).split(':')
+        pid = int(pid)
+    except ValueError:
+        return False
+    return boot_id == _BOOT_ID and pid_alive(pid) and start_time == _start_time(pid)
+
+
+def _folder_size(folder):
+    total = 0
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class JobWorkspace:
+
+    def __init__(self, job_id, path):
+        self.job_id = job_id
+        self.path = path
+
+    def file(self, filename):
+        return os.path.join(self.path, os.path.basename(filename))
+
+
+class VideoStorage:
+    """
+    Archivos de trabajo del análisis de video.
+
+    Cada análisis usa su propio directorio de trabajo, que se elimina al terminar
+    (también si falla). Las entradas pequeñas se escriben en tmpfs. Los videos
+    resultantes se eliminan por antigüedad (TTL) y, si superan la cuota, empezando
+    por el menos usado; de cada eliminado queda un registro para distinguirlo de un
+    archivo que nunca existió.
+    """
+
+    def __init__(self, input_folder=INPUT_FOLDER, output_folder=OUTPUT_FOLDER, chunked_folder=CHUNKED_FOLDER,
+                 spool_folder=None, spool_max_bytes=0, output_quota_bytes=0, output_ttl=0,
+                 chunked_ttl=24 * 3600, evicted_ttl=7 * 24 * 3600, sweep_interval=60):
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.chunked_folder = chunked_folder
+        self.spool_folder = spool_folder if spool_folder and os.path.isdir(os.path.dirname(spool_folder)) else None
+        self.spool_max_bytes = spool_max_bytes
+        self.output_quota_bytes = output_quota_bytes
+        self.output_ttl = output_ttl
+        self.chunked_ttl = chunked_ttl
+        self.evicted_ttl = evicted_ttl
+        self.sweep_interval = sweep_interval
+        # Devuelve True si un resultado no se puede eliminar todavía (p. ej. subida en curso)
+        self.is_busy = lambda path: False
+
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        for folder in (input_folder, output_folder, chunked_folder, self.spool_folder,
+                       os.path.join(output_folder, EVICTED_FOLDER)):
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+
+    def _workspace_root(self, size):
+        if self.spool_folder and size is not None and 0 < size <= self.spool_max_bytes:
+            return self.spool_folder
+        return self.input_folder
+
+    @contextmanager
+    def job(self, job_id=None, input_size=None):
+        """Directorio de trabajo del análisis; se borra al salir, haya fallado o no"""
+        job_id = job_id or str(uuid.uuid4())
+        path = os.path.join(self._workspace_root(input_size), job_id)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, OWNER_FILE), 'w') as f:
+            f.write(process_token())
+        try:
+            yield JobWorkspace(job_id, path)
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def discard_outputs(self, output_path):
+        """Elimina un resultado incompleto y sus partes"""
+        base = os.path.splitext(os.path.basename(output_path))[0]
+        for name in os.listdir(self.output_folder):
+            if name.startswith(base):
+                try:
+                    os.remove(os.path.join(self.output_folder, name))
+                except OSError:
+                    pass
+
+    def output_file(self, filename):
+        """
+        Ruta de un resultado y su estado: 'ok', 'evicted' (eliminado por la política
+        de retención) o 'missing' (nunca existió).
+        """
+        filename = os.path.basename(filename)
+        path = os.path.join(self.output_folder, filename)
+        if os.path.isfile(path):
+            # Se registra el acceso para la eliminación por menos usado
+            now = time.time()
+            try:
+                os.utime(path, (now, os.path.getmtime(path)))
+            except OSError:
+                pass
+            return path, 'ok'
+        if os.path.exists(os.path.join(self.output_folder, EVICTED_FOLDER, filename)):
+            return path, 'evicted'
+        return path, 'missing'
+
+    def _evict(self, path, reason):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        open(os.path.join(self.output_folder, EVICTED_FOLDER, os.path.basename(path)), 'w').close()
+        STORAGE_EVICTIONS.labels(reason).inc()
+
+    def cleanup_orphans(self):
+        """Elimina directorios de trabajo cuyo proceso ya no existe (p. ej. tras un reinicio)"""
+        removed = 0
+        for root in filter(None, (self.input_folder, self.spool_folder)):
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if not os.path.isdir(path) or path == self.chunked_folder:
+                    continue
+                try:
+                    with open(os.path.join(path, OWNER_FILE)) as f:
+                        owner = f.read().strip()
+                except OSError:
+                    owner = None
+                if not owner_alive(owner):
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+        return removed
+
+    def sweep(self, force=False):
+        """Aplica TTL y cuota a los resultados y limpia subidas por partes abandonadas"""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+
+        outputs = []
+        busy_bytes = 0
+        for entry in os.scandir(self.output_folder):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if self.is_busy(entry.path):
+                # Cuenta para la cuota, pero no se puede eliminar
+                busy_bytes += stat.st_size
+                continue
+            if self.output_ttl and now - stat.st_mtime > self.output_ttl:
+                self._evict(entry.path, 'ttl')
+                continue
+            outputs.append((stat.st_atime, stat.st_size, entry.path))
+
+        if self.output_quota_bytes:
+            total = busy_bytes + sum(size for _, size, _ in outputs)
+            for _, size, path in sorted(outputs):
+                if total <= self.output_quota_bytes:
+                    break
+                self._evict(path, 'quota')
+                total -= size
+
+        evicted_folder = os.path.join(self.output_folder, EVICTED_FOLDER)
+        for entry in os.scandir(evicted_folder):
+            if now - entry.stat().st_mtime > self.evicted_ttl:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+        if os.path.isdir(self.chunked_folder):
+            for entry in os.scandir(self.chunked_folder):
+                if entry.is_file() and now - entry.stat().st_mtime > self.chunked_ttl:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                    STORAGE_EVICTIONS.labels('upload_abandonado').inc()
+
+        self.update_metrics()
+
+    def update_metrics(self):
+        STORAGE_BYTES.labels('entradas').set(_folder_size(self.input_folder))
+        STORAGE_BYTES.labels('resultados').set(_folder_size(self.output_folder))
+        if self.spool_folder:
+            STORAGE_BYTES.labels('tmpfs').set(_folder_size(self.spool_folder))
+
+    def stats(self):
+        usage = shutil.disk_usage(self.output_folder)
+        return {
+            'resultados_bytes': _folder_size(self.output_folder),
+            'entradas_bytes': _folder_size(self.input_folder),
+            'cuota_resultados_bytes': self.output_quota_bytes,
+            'disco_libre_bytes': usage.free,
+            'tmpfs': self.spool_folder
+        }
+
+
+def _upload_in_progress(path):
+    # Se lee el estado en disco directamente: no hace falta crear el manager (ni sus hilos)
+    from app.utils.report_store import load_report
+    from app.utils.upload_manager import UPLOAD_JOBS_FOLDER
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    for job_id in (name, name.split('_')[0]):
+        state = load_report(job_id, folder=UPLOAD_JOBS_FOLDER)
+        if state is not None and state['status'] in ('pending', 'uploading'):
+            return True
+    return False
+
+
+def init_storage(app):
+    storage = VideoStorage(
+        spool_folder=app.config['STORAGE_SPOOL_FOLDER'],
+        spool_max_bytes=app.config['STORAGE_SPOOL_MAX_BYTES'],
+        output_quota_bytes=app.config['STORAGE_OUTPUT_QUOTA'],
+        output_ttl=app.config['STORAGE_OUTPUT_TTL'],
+        chunked_ttl=app.config['STORAGE_CHUNKED_TTL']
+    )
+    storage.is_busy = _upload_in_progress
+    storage.cleanup_orphans()
+    storage.sweep(force=True)
+    app.extensions['video_storage'] = storage
+    return storage
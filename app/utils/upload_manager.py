@@ -0,0 +1,313 @@
+import asyncio
+import fcntl
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cloudinary
+import cloudinary.exceptions
+import cloudinary.uploader
+from cloudinary import utils as cloudinary_utils
+
+from app.utils.metrics import UPLOAD_ATTEMPTS, UPLOAD_BYTES, observe_stage
+from app.utils.report_store import load_report, save_report
+from app.utils.state import get_state
+from app.utils.storage import owner_alive, process_token
+
+UPLOAD_JOBS_FOLDER = 'upload_jobs'
+
+# Errores de Cloudinary que no se resuelven reintentando
+NO_RETRY_ERRORS = (
+    cloudinary.exceptions.BadRequest,
+    cloudinary.exceptions.AuthorizationRequired,
+    cloudinary.exceptions.NotAllowed,
+    cloudinary.exceptions.NotFound,
+    cloudinary.exceptions.AlreadyExists
+)
+
+_settings = {}
+_manager = None
+_manager_pid = None
+_manager_lock = threading.Lock()
+
+
+class UploadManager:
+    """
+    Subidas a Cloudinary con concurrencia limitada y reintentos con backoff exponencial.
+
+    Las subidas de imágenes de una solicitud (upload) y las de archivos en segundo plano
+    (submit) tienen límites separados: un video largo no ocupa los slots que espera /analyze.
+    Las subidas de archivos en segundo plano guardan su estado (id de subida y bytes
+    confirmados) en el estado compartido, así que un reintento o un worker nuevo
+    continúa desde el último chunk aceptado en lugar de empezar de cero, y cualquier
+    nodo puede informar del progreso.
+    """
+
+    def __init__(self, max_concurrency=2, max_jobs=2, chunk_size=10 * 1024 * 1024, max_retries=4,
+                 backoff_base=1.0, backoff_max=30.0, state_dir=UPLOAD_JOBS_FOLDER):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_jobs = max(1, max_jobs)
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.state_dir = state_dir
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        # Los hilos del ejecutor son el límite de las subidas en segundo plano
+        self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='upload')
+        self._lock = threading.Lock()
+        self._active = 0
+        self._futures = {}
+        # Modo ASGI: se crea en el event loop del worker al primer uso
+        self._async_slots = None
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _with_retries(self, func, resource_type, slots=None):
+        attempt = 0
+        while True:
+            try:
+                if slots is not None:
+                    with slots:
+                        result = func()
+                else:
+                    result = func()
+                UPLOAD_ATTEMPTS.labels(resource_type, 'ok').inc()
+                return result
+            except NO_RETRY_ERRORS:
+                UPLOAD_ATTEMPTS.labels(resource_type, 'failed').inc()
+                raise
+            except Exception:
+                if attempt >= self.max_retries:
+                    UPLOAD_ATTEMPTS.labels(resource_type, 'failed').inc()
+                    raise
+                UPLOAD_ATTEMPTS.labels(resource_type, 'retry').inc()
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+
+    def upload(self, data, resource_type='image', **options):
+        """
+        Subida síncrona (imágenes en memoria), limitada a max_concurrency y con reintentos.
+        data puede ser bytes o cualquier buffer (p. ej. memoryview); se envía sin copiarlo.
+        """
+        UPLOAD_BYTES.labels(resource_type).inc(len(data))
+
+        def _upload():
+            start = time.perf_counter()
+            result = cloudinary.uploader.upload(('stream', data), resource_type=resource_type, **options)
+            observe_stage('cloudinary_upload', time.perf_counter() - start)
+            return result
+
+        return self._with_retries(_upload, resource_type, self._slots)
+
+    async def upload_async(self, data, resource_type='image', **options):
+        """
+        upload() para el modo ASGI: la subida del SDK va al ejecutor de tareas bloqueantes,
+        así que esperar a Cloudinary no detiene el event loop, y la espera por un slot y
+        el backoff entre reintentos no ocupan un hilo. Mismo límite por worker.
+        """
+        from app.utils.asgi import run_blocking
+
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        UPLOAD_BYTES.labels(resource_type).inc(len(data))
+
+        attempt = 0
+        while True:
+            try:
+                async with self._async_slots:
+                    start = time.perf_counter()
+                    result = await run_blocking(
+                        cloudinary.uploader.upload, ('stream', data), resource_type=resource_type, **options
+                    )
+                    observe_stage('cloudinary_upload', time.perf_counter() - start)
+                UPLOAD_ATTEMPTS.labels(resource_type, 'ok').inc()
+                return result
+            except NO_RETRY_ERRORS:
+                UPLOAD_ATTEMPTS.labels(resource_type, 'failed').inc()
+                raise
+            except Exception:
+                if attempt >= self.max_retries:
+                    UPLOAD_ATTEMPTS.labels(resource_type, 'failed').inc()
+                    raise
+                UPLOAD_ATTEMPTS.labels(resource_type, 'retry').inc()
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+
+    def submit(self, job_id, path, resource_type='video', **options):
+        """Encola la subida de un archivo y devuelve su estado inicial"""
+        state = {
+            'status': 'pending',
+            'path': path,
+            'resource_type': resource_type,
+            'options': options,
+            'upload_id': cloudinary_utils.random_public_id(),
+            'offset': 0,
+            'public_id': None,
+            'attempts': 0,
+            'url': None,
+            'owner': process_token()
+        }
+        save_report(job_id, state, folder=self.state_dir)
+        self._enqueue(job_id, state)
+        return state
+
+    def _enqueue(self, job_id, state):
+        future = self._executor.submit(self._run_job, job_id, state)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._futures.pop(job_id, None))
+
+    def wait(self, job_id, timeout=None):
+        """Espera a que termine una subida encolada por este proceso y devuelve su estado"""
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+        return self.status(job_id)
+
+    def status(self, job_id):
+        return load_report(job_id, folder=self.state_dir)
+
+    def save_manifest(self, job_id, segments):
+        """Registra un video subido por partes: job_id agrupa las subidas de cada parte"""
+        manifest = {'status': 'segmented', 'segments': list(segments)}
+        self._save(job_id, manifest)
+        return manifest
+
+    def segments_status(self, manifest):
+        """Estado combinado de las partes de un manifiesto"""
+        parts = [self.status(job_id) or {'status': 'failed', 'error': 'Parte sin registro'}
+                 for job_id in manifest['segments']]
+        if parts and all(p['status'] == 'completed' for p in parts):
+            status = 'completed'
+        elif any(p['status'] == 'failed' for p in parts):
+            status = 'failed'
+        else:
+            status = 'uploading'
+        return status, parts
+
+    def _save(self, job_id, state):
+        save_report(job_id, state, folder=self.state_dir)
+
+    def _run_job(self, job_id, state):
+        with self._lock:
+            self._active += 1
+        start = time.perf_counter()
+        try:
+            state['status'] = 'uploading'
+            self._save(job_id, state)
+
+            def _attempt():
+                state['attempts'] += 1
+                return self._upload_chunks(job_id, state)
+
+            result = self._with_retries(_attempt, state['resource_type'])
+            state.update(status='completed', url=_result_url(result), error=None)
+        except Exception as e:
+            state.update(status='failed', error=str(e))
+        finally:
+            with self._lock:
+                self._active -= 1
+            observe_stage(f"{state['resource_type']}_upload", time.perf_counter() - start)
+            self._save(job_id, state)
+
+    def _upload_chunks(self, job_id, state):
+        """Como cloudinary.uploader.upload_large, pero continúa desde state['offset']"""
+        path = state['path']
+        file_size = os.path.getsize(path)
+        options = dict(state['options'], resource_type=state['resource_type'])
+        if state['public_id']:
+            options['public_id'] = state['public_id']
+
+        result = None
+        with open(path, 'rb') as f:
+            f.seek(state['offset'])
+            while state['offset'] < file_size:
+                chunk = f.read(self.chunk_size)
+                start = state['offset']
+                headers = {
+                    'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{file_size}',
+                    'X-Unique-Upload-Id': state['upload_id']
+                }
+                result = cloudinary.uploader.upload_large_part(
+                    (os.path.basename(path), chunk), http_headers=headers, **options
+                )
+                UPLOAD_BYTES.labels(state['resource_type']).inc(len(chunk))
+
+                state['offset'] = start + len(chunk)
+                state['public_id'] = options['public_id'] = result.get('public_id')
+                self._save(job_id, state)
+
+        return result
+
+    def resume_pending(self):
+        """
+        Reencola las subidas que quedaron a medias porque su worker terminó. El dueño se
+        reconoce por process_token y no por el pid o el hostname, que cambian o se
+        reutilizan al reiniciar el contenedor. Un lock de archivo evita que dos workers
+        reclamen el mismo trabajo.
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+
+        resumed = 0
+        with open(os.path.join(self.state_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            for job_id in get_state().keys(self.state_dir):
+                state = self.status(job_id)
+                # Los archivos de otro nodo no están en este disco
+                if (state is None or state['status'] not in ('pending', 'uploading')
+                        or owner_alive(state.get('owner')) or not os.path.exists(state['path'])):
+                    continue
+                state['owner'] = process_token()
+                self._save(job_id, state)
+                self._enqueue(job_id, state)
+                resumed += 1
+        return resumed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'max_jobs': self.max_jobs,
+                'active_jobs': self._active,
+                'chunk_size': self.chunk_size
+            }
+
+
+def _result_url(result):
+    # Para videos se prefiere la versión eager (1280x720) si se pidió
+    if result.get('eager'):
+        return result['eager'][0]['secure_url']
+    return result['secure_url']
+
+
+def configure_uploads(**settings):
+    _settings.update(settings)
+
+
+def get_upload_manager():
+    """Manager del worker actual; sus hilos no sobreviven a un fork, así que se crea por pid"""
+    global _manager, _manager_pid
+
+    if _manager is None or _manager_pid != os.getpid():
+        with _manager_lock:
+            if _manager is None or _manager_pid != os.getpid():
+                _manager = UploadManager(**_settings)
+                _manager_pid = os.getpid()
+                _manager.resume_pending()
+    return _manager
+
+
+def init_upload_manager(app):
+    configure_uploads(
+        max_concurrency=app.config['UPLOAD_MAX_CONCURRENCY'],
+        max_jobs=app.config['UPLOAD_MAX_JOBS'],
+        chunk_size=app.config['UPLOAD_CHUNK_SIZE'],
+        max_retries=app.config['UPLOAD_MAX_RETRIES'],
+        backoff_base=app.config['UPLOAD_BACKOFF_BASE'],
+        backoff_max=app.config['UPLOAD_BACKOFF_MAX']
+    )
@@ -3,7 +3,13 @@ import math
 import os
 import mediapipe as mp
 from mediapipe.python.solutions.drawing_utils import DrawingSpec
-import cloudinary.uploader
+import time
+from app.utils.keyframes import KeyframeSelector, frame_deviations
+from app.utils.metrics import VIDEO_FPS, VIDEO_FRAMES, observe_stage
+from app.utils.rescoring import DEFAULT_PROFILES
+from app.utils.scheduler import AdmissionRejected
+from app.utils.smoothing import PostureSmoother
+from app.utils.upload_manager import get_upload_manager
 
 mp_pose = mp.solutions.pose
 mp_drawing = mp.solutions.drawing_utils
@@ -13,19 +19,115 @@ connection_style_rojo = DrawingSpec(color=(0, 0, 255), thickness=2)
 landmark_style_verde = DrawingSpec(color=(0, 255, 0), thickness=2, circle_radius=3)
 connection_style_verde = DrawingSpec(color=(0, 255, 0), thickness=2)
 
-
-def process_video_posture(video_path, output_path):
+OUTPUT_FPS = 20.0
+VIDEO_EAGER = [{"width": 1280, "height": 720, "crop": "pad"}]
+
+
+class SegmentedVideoWriter:
+    """
+    Escribe el video anotado en partes MP4 independientes de segment_frames cuadros.
+    Cada parte terminada se entrega a on_segment mientras se siguen procesando los
+    cuadros siguientes, así su subida se solapa con el análisis.
+    """
+
+    def __init__(self, output_path, fourcc, fps, size, segment_frames, on_segment=None):
+        base, ext = os.path.splitext(output_path)
+        self.pattern = base + '_parte{:03d}' + ext
+        self.fourcc = fourcc
+        self.fps = fps
+        self.size = size
+        self.segment_frames = max(1, segment_frames)
+        self.on_segment = on_segment
+        self.paths = []
+        self._writer = None
+        self._frames = 0
+
+    def write(self, frame):
+        if self._writer is None:
+            self.paths.append(self.pattern.format(len(self.paths)))
+            self._writer = cv2.VideoWriter(self.paths[-1], self.fourcc, self.fps, self.size)
+
+        self._writer.write(frame)
+        self._frames += 1
+        if self._frames >= self.segment_frames:
+            self._close_segment()
+
+    def _close_segment(self):
+        self._writer.release()
+        self._writer = None
+        self._frames = 0
+        if self.on_segment is not None:
+            self.on_segment(len(self.paths) - 1, self.paths[-1])
+
+    def release(self):
+        if self._writer is not None:
+            self._close_segment()
+
+    def abort(self):
+        """Descarta la parte a medio escribir sin entregarla; las ya entregadas se conservan"""
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+            _remove(self.paths.pop())
+
+
+def read_frames(cap):
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield frame
+
+
+def process_video_posture(video_path, output_path, upload=True, upload_id=None, segment_seconds=0,
+                          frames=None, keep_input=False, keyframes=0, keyframe_gap=2.0, keyframe_width=320,
+                          keyframe_thresholds=None, smoothing=None):
+    """
+    frames permite pasar otra fuente de cuadros (por ejemplo, un video que todavía
+    se está subiendo); por defecto se leen de video_path. Con output_path=None no se
+    escribe el video anotado, y con keep_input=True no se borra el video de entrada.
+    Con keyframes=K se guardan junto a output_path miniaturas JPEG de los K peores
+    momentos (más grados fuera de los rangos de keyframe_thresholds), separados al
+    menos keyframe_gap segundos. smoothing son las opciones de PostureSmoother
+    (filtro temporal e histéresis), para que el temblor de los landmarks no cuente
+    cuadros de mala postura que no lo son.
+    Si el análisis falla se borra el video (o la parte) a medio escribir.
+    """
+    cap = None
+    out = None
+    pose = None
+    finished = False
     try:
-        cap = cv2.VideoCapture(video_path)
-
-        if not cap.isOpened():
-            return {
-                'success': False,
-                'error': 'No se pudo abrir el video'
-            }
+        if frames is None:
+            cap = cv2.VideoCapture(video_path)
+
+            if not cap.isOpened():
+                return {
+                    'success': False,
+                    'error': 'No se pudo abrir el video'
+                }
+            source_fps = cap.get(cv2.CAP_PROP_FPS)
+            frames = read_frames(cap)
+        else:
+            source_fps = _probe_fps(video_path)
+        frames = iter(frames)
+        # Los segundos (de los momentos y del filtro temporal) se cuentan en el video original
+        source_fps = source_fps if source_fps and source_fps > 0 else OUTPUT_FPS
+
+        selector = None
+        if keyframes > 0 and output_path is not None:
+            selector = KeyframeSelector(keyframes, min_gap=keyframe_gap, width=keyframe_width)
+            keyframe_thresholds = keyframe_thresholds or DEFAULT_PROFILES['actual']
+        smoother = PostureSmoother(**smoothing) if smoothing else None
 
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = None
+        upload_id = upload_id or os.path.splitext(os.path.basename(output_path or video_path))[0]
+        segment_jobs = []
+
+        def _upload_segment(index, path):
+            job_id = os.path.splitext(os.path.basename(path))[0]
+            get_upload_manager().submit(job_id, path, resource_type="video")
+            segment_jobs.append(job_id)
 
         pose = mp_pose.Pose(
             static_image_mode=False,
@@ -37,67 +139,142 @@ def process_video_posture(video_path, output_path):
 
         total_frames = 0
         malas_posturas = 0
+        inicio = time.perf_counter()
 
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
+        while True:
+            t0 = time.perf_counter()
+            frame = next(frames, None)
+            t1 = time.perf_counter()
+            if frame is None:
                 break
+            observe_stage('video_decode', t1 - t0)
 
             total_frames += 1
 
             rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             results = pose.process(rgb)
+            t2 = time.perf_counter()
+            observe_stage('video_pose_process', t2 - t1)
 
-            if out is None:
+            if out is None and output_path is not None:
                 h, w = frame.shape[:2]
-                out = cv2.VideoWriter(output_path, fourcc, 20.0, (w, h))
+                if segment_seconds > 0:
+                    out = SegmentedVideoWriter(
+                        output_path, fourcc, OUTPUT_FPS, (w, h),
+                        segment_frames=int(segment_seconds * OUTPUT_FPS),
+                        on_segment=_upload_segment if upload else None
+                    )
+                else:
+                    out = cv2.VideoWriter(output_path, fourcc, OUTPUT_FPS, (w, h))
 
             if results.pose_landmarks:
-                es_mala_postura = analyze_and_annotate_frame(
-                    frame,
-                    results.pose_landmarks
-                )
+                timestamp = (total_frames - 1) / source_fps
+                landmarks = results.pose_landmarks
+                if smoother is not None:
+                    landmarks = smoother.landmarks(landmarks, timestamp)
+                es_mala_postura = analyze_and_annotate_frame(frame, landmarks, smoother)
 
                 if es_mala_postura:
                     malas_posturas += 1
-
-            out.write(frame)
-
-        cap.release()
-        out.release()
-        pose.close()
-
-        try:
-            upload_result = cloudinary.uploader.upload_large(
+                VIDEO_FRAMES.labels('mala_postura' if es_mala_postura else 'correcta').inc()
+
+                if selector is not None:
+                    selector.offer(
+                        total_frames - 1, timestamp, frame,
+                        frame_deviations(landmarks, keyframe_thresholds), es_mala_postura
+                    )
+            else:
+                VIDEO_FRAMES.labels('sin_persona').inc()
+            t3 = time.perf_counter()
+            observe_stage('video_annotate', t3 - t2)
+
+            if out is not None:
+                out.write(frame)
+                observe_stage('video_write', time.perf_counter() - t3)
+
+        # La última parte se cierra (y se encola su subida) antes de registrar el manifiesto
+        if out is not None:
+            out.release()
+        finished = True
+        momentos = selector.save(output_path) if selector is not None else None
+
+        duracion = time.perf_counter() - inicio
+        fps_procesamiento = total_frames / duracion if duracion > 0 else 0.0
+        observe_stage('video_processing', duracion)
+        if total_frames:
+            VIDEO_FPS.observe(fps_procesamiento)
+
+        # La subida queda en segundo plano: un fallo de Cloudinary ya no descarta el análisis
+        upload_state = None
+        segmentos = out.paths if isinstance(out, SegmentedVideoWriter) else None
+        if upload and segmentos is not None:
+            # Las partes ya se están subiendo; solo falta registrar cuáles forman el video
+            get_upload_manager().save_manifest(upload_id, segment_jobs)
+            upload_state = {'status': 'uploading'}
+        elif upload and out is not None:
+            upload_state = get_upload_manager().submit(
+                upload_id,
                 output_path,
                 resource_type="video",
-                eager=[{"width": 1280, "height": 720, "crop": "pad"}]
+                eager=VIDEO_EAGER
             )
-            video_url = upload_result['eager'][0]['secure_url']
-        except Exception as e:
-            return {
-                'success': False,
-                'error': f'Error al subir a Cloudinary: {str(e)}'
-            }
-
-        if os.path.exists(video_path):
+
+        if not keep_input and os.path.exists(video_path):
             os.remove(video_path)
 
         return {
             'success': True,
             'total_frames': total_frames,
             'malas_posturas': malas_posturas,
-            'cloudinary_url': video_url
+            'fps_procesamiento': round(fps_procesamiento, 2),
+            'upload_status': upload_state['status'] if upload_state else None,
+            'segmentos': [os.path.basename(p) for p in segmentos] if segmentos is not None else None,
+            'momentos': momentos
         }
 
+    except AdmissionRejected:
+        # La fuente de cuadros espera turno en el planificador; el rechazo lo responde la ruta
+        raise
+
     except Exception as e:
         return {
             'success': False,
             'error': f'Error al procesar video: {str(e)}'
         }
 
+    finally:
+        # También si el planificador rechazó la fuente de cuadros o esta se detuvo
+        if cap is not None:
+            cap.release()
+        if pose is not None:
+            pose.close()
+        if out is not None and not finished:
+            if isinstance(out, SegmentedVideoWriter):
+                out.abort()
+            else:
+                out.release()
+                _remove(output_path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _probe_fps(video_path):
+    # Con otra fuente de cuadros (subida en curso) el encabezado puede no estar todavía
+    if not video_path or not os.path.exists(video_path):
+        return None
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else None
+    finally:
+        cap.release()
+
 
-def analyze_and_annotate_frame(frame, pose_landmarks):
+def analyze_and_annotate_frame(frame, pose_landmarks, smoother=None):
     left_ear = pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_EAR]
     right_ear = pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_EAR]
     left_shoulder = pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_SHOULDER]
@@ -112,6 +289,8 @@ def analyze_and_annotate_frame(frame, pose_landmarks):
         left_ear, right_ear,
         left_shoulder, right_shoulder
     )
+    if smoother is not None:
+        angulo_cuello = smoother.angle('cuello', angulo_cuello)
 
     if angulo_cuello > 115 or angulo_cuello < 75:
         cuello_msg = "Cuello correcto"
@@ -133,10 +312,11 @@ def analyze_and_annotate_frame(frame, pose_landmarks):
         2
     )
 
-    es_mala_postura = False
+    es_mala_postura = abs(nose.y - mid_hip_y) < 0.15
+    if smoother is not None:
+        es_mala_postura = smoother.verdict(es_mala_postura)
 
-    if abs(nose.y - mid_hip_y) < 0.15:
-        es_mala_postura = True
+    if es_mala_postura:
         cv2.putText(
             frame,
             "Columna muy erguida",
@@ -0,0 +1,12 @@
+import os
+from app import create_app
+from app.utils.asgi import AsgiApp
+
+config_name = os.getenv('FLASK_ENV', 'production')
+app = AsgiApp(create_app(config_name))
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5000))
+    uvicorn.run(app, host='0.0.0.0', port=port)
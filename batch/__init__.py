@@ -0,0 +1,3 @@
+"""
+Análisis por lotes sin pasar por la API
+"""
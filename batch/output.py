@@ -0,0 +1,171 @@
+"""
+Salidas del análisis por lotes: JSONL (un resultado por línea) o Parquet (columnar).
+
+Ambas se escriben de forma incremental y sirven de checkpoint: processed() devuelve
+las rutas ya registradas para que una ejecución interrumpida continúe donde quedó.
+"""
+import glob
+import json
+import os
+
+from app.utils.mediapipe_helper import ANGLE_NAMES, LANDMARK_NAMES
+
+# Dependencia opcional: solo se necesita para --format parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+class JsonlOutput:
+
+    def __init__(self, path, sync_every=100):
+        self.path = path
+        self.sync_every = sync_every
+        self._file = None
+        self._pending = 0
+
+    def processed(self, include_errors=True):
+        """Rutas ya registradas; descarta una última línea incompleta (corte a mitad de escritura)"""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid_size += len(line)
+                if include_errors or record.get('success'):
+                    done.add(record['path'])
+
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+        return done
+
+    def write(self, record):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.sync_every:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+
+class ParquetOutput:
+    """
+    Directorio de partes part-NNNNN.parquet de rows_per_part filas. Un corte pierde
+    como máximo las filas de la parte en curso, que se vuelven a procesar.
+    """
+
+    def __init__(self, path, rows_per_part=1000, landmarks=False):
+        if pa is None:
+            raise RuntimeError('--format parquet requiere pyarrow (pip install pyarrow)')
+        self.path = path
+        self.rows_per_part = max(1, rows_per_part)
+        self.landmarks = landmarks
+        self.schema = _parquet_schema(landmarks)
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def processed(self, include_errors=True):
+        done = set()
+        for part in self._parts():
+            table = pq.read_table(part, columns=['path', 'success'])
+            for path, success in zip(table.column('path').to_pylist(), table.column('success').to_pylist()):
+                if include_errors or success:
+                    done.add(path)
+        return done
+
+    def write(self, record):
+        self._rows.append(_flatten(record, self.landmarks))
+        if len(self._rows) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        table = pa.Table.from_pylist(self._rows, schema=self.schema)
+        # Se escribe con otro nombre y se renombra: una parte a medio escribir nunca cuenta como procesada
+        final_path = os.path.join(self.path, f'part-{len(self._parts()):05d}.parquet')
+        tmp_path = final_path + '.tmp'
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, final_path)
+        self._rows = []
+
+    def close(self):
+        self._flush()
+
+
+def _parquet_schema(landmarks):
+    fields = [
+        ('path', pa.string()),
+        ('tipo', pa.string()),
+        ('success', pa.bool_()),
+        ('error', pa.string()),
+        ('duration_ms', pa.float64()),
+        ('is_good_posture', pa.bool_()),
+    ]
+    fields += [(f'angle_{name}', pa.float64()) for name in ANGLE_NAMES]
+    fields += [
+        ('total_frames', pa.int64()),
+        ('malas_posturas', pa.int64()),
+        ('fps_procesamiento', pa.float64()),
+        ('annotated_path', pa.string()),
+        ('image_url', pa.string()),
+        ('recommendations', pa.string()),
+        ('ai_report', pa.string()),
+    ]
+    if landmarks:
+        fields += [
+            (f'lm_{name}_{axis}', pa.float64())
+            for name in LANDMARK_NAMES.values() for axis in ('x', 'y', 'z')
+        ]
+    return pa.schema(fields)
+
+
+def _flatten(record, landmarks):
+    """Una fila por archivo: ángulos y landmarks en columnas, estructuras anidadas como JSON"""
+    row = {key: record.get(key) for key in (
+        'path', 'tipo', 'success', 'error', 'duration_ms', 'is_good_posture',
+        'total_frames', 'malas_posturas', 'fps_procesamiento', 'annotated_path', 'image_url'
+    )}
+    for name, value in (record.get('angles') or {}).items():
+        row[f'angle_{name}'] = float(value)
+    for key in ('recommendations', 'ai_report'):
+        if record.get(key) is not None:
+            row[key] = json.dumps(record[key], ensure_ascii=False)
+    if landmarks:
+        for name, point in (record.get('landmarks') or {}).items():
+            for axis in ('x', 'y', 'z'):
+                row[f'lm_{name}_{axis}'] = point[axis]
+    return row
+
+
+def open_output(path, output_format, rows_per_part=1000, landmarks=False):
+    if output_format == 'parquet':
+        return ParquetOutput(path, rows_per_part=rows_per_part, landmarks=landmarks)
+    return JsonlOutput(path)
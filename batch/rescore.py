@@ -0,0 +1,163 @@
+"""
+Reevaluación de landmarks guardados con otros umbrales, sin volver a ejecutar la inferencia.
+
+Calcula los ángulos y el veredicto de cada fila con NumPy para uno o varios perfiles de
+umbrales (sentado, de_pie o los de --profiles-file) y escribe un resumen por perfil.
+La entrada puede ser un dataset (directorio con landmarks.npy, que se mapea en memoria),
+un .npy suelto, la salida de batch.run generada con --landmarks (JSONL o Parquet) o la
+base del historial de la API (HISTORY_DB_PATH).
+
+Uso:
+    python -m batch.rescore dataset/ --profile sentado --profile de_pie
+    python -m batch.rescore resultados.jsonl --export dataset/   # convierte una vez a .npy
+    python -m batch.rescore dataset/ --profiles-file perfiles.json --verdicts veredictos.npy
+    python -m batch.rescore data/historial.sqlite3 --export dataset/
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from app.utils.rescoring import (
+    LANDMARK_INDEX, Dataset, ProfileError, landmarks_to_array, load_profiles, rescore, save_dataset
+)
+
+
+def _from_jsonl(path):
+    """Imágenes analizadas con éxito; con --retry-errors vale el último registro de cada ruta"""
+    records = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            records[record['path']] = record
+
+    successful = [r for r in records.values() if r.get('success')]
+    rows = [r for r in successful if r.get('landmarks')]
+    if successful and not rows:
+        raise ValueError(f'{path} no tiene landmarks: genera la salida con batch.run --landmarks')
+    landmarks = landmarks_to_array([r['landmarks'] for r in rows])
+    verdicts = np.array([bool(r.get('is_good_posture')) for r in rows], dtype=bool)
+    return landmarks, verdicts, [r['path'] for r in rows]
+
+
+def _from_parquet(path):
+    import pyarrow.dataset as ds
+
+    columns = [f'lm_{name}_{axis}' for name in LANDMARK_INDEX for axis in ('x', 'y', 'z')]
+    dataset = ds.dataset(path, format='parquet')
+    missing = [c for c in columns if c not in dataset.schema.names]
+    if missing:
+        raise ValueError(f'{path} no tiene landmarks: genera la salida con batch.run --landmarks')
+
+    table = dataset.to_table(columns=['path', 'success', 'is_good_posture'] + columns)
+    # Las partes siguen el orden de escritura: con --retry-errors vale la última fila de cada ruta
+    paths = table.column('path').to_pylist()
+    last = {p: i for i, p in enumerate(paths)}
+    keep = np.fromiter(sorted(last.values()), dtype=np.int64, count=len(last))
+    valid = table.column('success').fill_null(False).to_numpy(zero_copy_only=False)[keep]
+    keep = keep[valid & table.column(columns[0]).is_valid().to_numpy(zero_copy_only=False)[keep]]
+
+    landmarks = np.empty((len(keep), len(LANDMARK_INDEX), 3), dtype=np.float32)
+    for i, column in enumerate(columns):
+        values = table.column(column).to_numpy()
+        landmarks[:, i // 3, i % 3] = values[keep]
+    verdicts = table.column('is_good_posture').fill_null(False).to_numpy(zero_copy_only=False)[keep]
+    return landmarks, verdicts.astype(bool), [paths[i] for i in keep]
+
+
+def _from_history(path):
+    """Imágenes guardadas en el historial: los landmarks están empaquetados como float32"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute(
+            'SELECT id, is_good_posture, landmarks FROM analyses WHERE landmarks IS NOT NULL ORDER BY created_at'
+        ).fetchall()
+    finally:
+        conn.close()
+    landmarks = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.float32)
+    landmarks = landmarks.reshape(len(rows), len(LANDMARK_INDEX), 3)
+    verdicts = np.array([bool(row[1]) for row in rows], dtype=bool)
+    return landmarks, verdicts, [row[0] for row in rows]
+
+
+def load_input(path):
+    """(landmarks, veredictos guardados o None, ids o None)"""
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, 'landmarks.npy')):
+        dataset = Dataset(path)
+        return dataset.landmarks, dataset.verdicts, dataset.ids()
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r'), None, None
+    if path.endswith(('.sqlite3', '.db')):
+        return _from_history(path)
+    if os.path.isdir(path):
+        return _from_parquet(path)
+    return _from_jsonl(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reevalúa landmarks guardados con otros perfiles de umbrales')
+    parser.add_argument('input', help='Dataset (directorio con landmarks.npy), .npy o salida de batch.run')
+    parser.add_argument('--profile', action='append', help='Perfil a aplicar (repetible; por defecto todos)')
+    parser.add_argument('--profiles-file', default=os.getenv('RESCORING_PROFILES_FILE'),
+                        help='JSON con perfiles personalizados {nombre: {"base": ..., comprobación: [min, max]}}')
+    parser.add_argument('--export', help='Guarda la entrada como dataset .npy para reevaluaciones posteriores')
+    parser.add_argument('--verdicts', help='Guarda el veredicto de cada fila por perfil en un .npy (N, perfiles)')
+    parser.add_argument('--chunk-rows', type=int, default=262144)
+    parser.add_argument('--output', help='Archivo donde guardar el resumen (por defecto stdout)')
+    args = parser.parse_args()
+
+    try:
+        available = load_profiles(args.profiles_file)
+    except ProfileError as e:
+        parser.error(f'{args.profiles_file}: {e}')
+    names = args.profile or list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        parser.error(f'perfiles desconocidos: {", ".join(unknown)} (disponibles: {", ".join(available)})')
+    profiles = {name: available[name] for name in names}
+
+    started = time.perf_counter()
+    try:
+        landmarks, verdicts, ids = load_input(args.input)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f'No se pudo leer {args.input}: {e}', file=sys.stderr)
+        return 1
+    loaded = time.perf_counter()
+
+    if args.export:
+        save_dataset(args.export, landmarks, verdicts=verdicts, ids=ids)
+        print(f'Dataset guardado en {args.export} ({len(landmarks)} filas)', file=sys.stderr)
+
+    out = None
+    if args.verdicts:
+        out = np.lib.format.open_memmap(args.verdicts, mode='w+', dtype=bool, shape=(len(landmarks), len(profiles)))
+
+    summaries = rescore(landmarks, profiles, verdicts=verdicts, chunk_rows=max(1, args.chunk_rows), out=out)
+    elapsed = time.perf_counter() - loaded
+    if out is not None:
+        out.flush()
+
+    result = {
+        'input': args.input,
+        'rows': len(landmarks),
+        'profiles': summaries,
+        'verdict_columns': names if out is not None else None,
+        'load_seconds': round(loaded - started, 3),
+        'rescore_seconds': round(elapsed, 3),
+        'rows_per_second': round(len(landmarks) / elapsed) if elapsed > 0 else None
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""
+Análisis por lotes de imágenes y videos sin pasar por la API.
+
+Recorre un directorio (o una lista de archivos), procesa cada archivo en un pool de
+procesos con los modelos ya cargados y escribe cada resultado en cuanto termina,
+en JSONL o en Parquet. Si la ejecución se interrumpe, al relanzarla con la misma
+salida se omiten los archivos ya procesados. Por defecto no se sube nada a
+Cloudinary ni se generan reportes de IA.
+
+Uso:
+    python -m batch.run fotos/ --output resultados.jsonl
+    python -m batch.run --manifest lista.txt --output resultados/ --format parquet --processes 8
+    python -m batch.run fotos/ --output resultados.jsonl --annotated anotadas/ --upload --ai-report
+    python -m batch.run videos/ --output resultados.jsonl --video-smoothing one_euro --video-hold-frames 3
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from batch.output import open_output
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+_options = {}
+
+
+def file_kind(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return 'imagen'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    return None
+
+
+def iter_inputs(args):
+    """(ruta absoluta, raíz) de cada archivo a procesar, en orden estable"""
+    if args.manifest:
+        root = os.path.dirname(os.path.abspath(args.manifest))
+        with open(args.manifest, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                # Líneas con una ruta o JSON con el campo "path"
+                path = json.loads(line)['path'] if line.startswith('{') else line
+                path = os.path.abspath(os.path.join(root, path))
+                if file_kind(path):
+                    yield path, root
+        return
+
+    root = os.path.abspath(args.input)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if file_kind(path):
+                yield path, root
+
+
+def _annotated_path(path, root, extension):
+    """Misma estructura de carpetas que la entrada dentro de --annotated"""
+    relative = os.path.relpath(path, root)
+    if relative.startswith('..'):
+        relative = os.path.basename(path)
+    base = os.path.splitext(relative)[0]
+    destination = os.path.join(_options['annotated'], f'{base}_analizado{extension}')
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    return destination
+
+
+def _init_worker(options):
+    # Ctrl+C lo atiende el proceso principal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _options.update(options)
+
+    from app.utils.cpu_topology import CpuTopology
+    from app.utils.models import registry
+
+    # Un hilo de cómputo por proceso: el paralelismo lo da el pool
+    CpuTopology(threads_per_worker=1).apply()
+    registry.configure(1)
+    registry.image_pool().warm_up()
+
+    if options['upload']:
+        import cloudinary
+        from app.config.config import Config
+
+        cloudinary.config(
+            cloud_name=Config.CLOUDINARY_CLOUD_NAME,
+            api_key=Config.CLOUDINARY_API_KEY,
+            api_secret=Config.CLOUDINARY_API_SECRET,
+            upload_prefix=Config.CLOUDINARY_UPLOAD_PREFIX
+        )
+
+
+def _public_id(path):
+    return 'batch_' + hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+
+
+def _process_image(path, root, record):
+    import cv2
+    from app.utils.cloudinary_helper import upload_image
+    from app.utils.mediapipe_helper import analyze_posture
+
+    with open(path, 'rb') as f:
+        result = analyze_posture(f)
+
+    record['success'] = result['success']
+    if not result['success']:
+        record['error'] = result['error']
+        return
+
+    angle_details = result['recommendations']['angle_details']
+    recommendations = result['recommendations']['recommendations']
+    record.update(
+        is_good_posture=bool(result['is_good_posture']),
+        angles={name: round(float(value), 2) for name, value in result['angles'].items()},
+        recommendations=result['recommendations']
+    )
+    if _options['landmarks']:
+        record['landmarks'] = result['landmarks']
+
+    if _options['annotated']:
+        record['annotated_path'] = _annotated_path(path, root, '.jpg')
+        cv2.imwrite(record['annotated_path'], result['processed_image'])
+
+    if not _options['upload']:
+        return
+
+    upload_result = upload_image(result['processed_image'], folder='analisis-batch', public_id=_public_id(path))
+    if not upload_result['success']:
+        record['upload_error'] = upload_result['error']
+        return
+    record['image_url'] = upload_result['url']
+
+    if _options['ai_report']:
+        from app.config.config import Config
+        from app.utils.openai_helper import generate_ergonomic_report, get_openai_client
+
+        client = get_openai_client(
+            api_key=Config.OPENAI_API_KEY,
+            base_url=Config.OPENAI_BASE_URL,
+            timeout=Config.OPENAI_TIMEOUT,
+            max_connections=1
+        )
+        report = generate_ergonomic_report(
+            client, upload_result['url'], result['angles'], angle_details, recommendations,
+            result['is_good_posture'], image=result['processed_image'], landmarks=result['landmarks'],
+            max_tiles=Config.VISION_MAX_TILES, context_margin=Config.VISION_CONTEXT_MARGIN
+        )
+        if report['success']:
+            record['ai_report'] = report['report']
+        else:
+            record['ai_report_error'] = report.get('error')
+
+
+def _process_video(path, root, record):
+    from app.config.config import Config
+    from app.utils.smoothing import video_smoothing_options
+    from app.utils.upload_manager import get_upload_manager
+    from app.utils.video_posture_helper import VIDEO_EAGER, process_video_posture
+
+    temporary = _options['upload'] and not _options['annotated']
+    if _options['annotated']:
+        output_path = _annotated_path(path, root, '.mp4')
+    elif temporary:
+        # Sin --annotated el video anotado solo hace falta para subirlo
+        fd, output_path = tempfile.mkstemp(prefix='lote_', suffix='.mp4')
+        os.close(fd)
+    else:
+        output_path = None
+
+    try:
+        result = process_video_posture(
+            path, output_path, upload=False, keep_input=True,
+            smoothing=video_smoothing_options({
+                **vars(Config),
+                'VIDEO_SMOOTHING': _options['video_smoothing'],
+                'VIDEO_VERDICT_HOLD_FRAMES': _options['video_hold_frames']
+            })
+        )
+
+        record['success'] = result['success']
+        if not result['success']:
+            record['error'] = result['error']
+            return
+
+        record.update(
+            total_frames=result['total_frames'],
+            malas_posturas=result['malas_posturas'],
+            fps_procesamiento=result['fps_procesamiento']
+        )
+        if _options['annotated']:
+            record['annotated_path'] = output_path
+
+        if _options['upload']:
+            # Subida reanudable del manager; el lote espera a que termine antes de seguir
+            job_id = _public_id(path)
+            manager = get_upload_manager()
+            manager.submit(job_id, output_path, resource_type='video', eager=VIDEO_EAGER)
+            state = manager.wait(job_id)
+            if state['status'] == 'completed':
+                record['video_url'] = state['url']
+            else:
+                record['upload_error'] = state.get('error')
+    finally:
+        if temporary and os.path.exists(output_path):
+            os.remove(output_path)
+
+
+def process_file(task):
+    path, root = task
+    record = {'path': path, 'tipo': file_kind(path), 'success': False, 'error': None}
+    started = time.perf_counter()
+    try:
+        if record['tipo'] == 'imagen':
+            _process_image(path, root, record)
+        else:
+            _process_video(path, root, record)
+    except Exception as e:
+        record['success'] = False
+        record['error'] = f'{type(e).__name__}: {e}'
+    record['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _lock_output(path):
+    """Impide que dos ejecuciones escriban a la vez en la misma salida"""
+    lock_path = path.rstrip(os.sep) + '.lock'
+    directory = os.path.dirname(lock_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Análisis postural por lotes de imágenes y videos')
+    parser.add_argument('input', nargs='?', help='Directorio con imágenes y videos (se recorre recursivamente)')
+    parser.add_argument('--manifest', help='Archivo con una ruta por línea (o JSONL con "path") en lugar de un directorio')
+    parser.add_argument('--output', required=True, help='Archivo .jsonl o directorio para --format parquet')
+    parser.add_argument('--format', choices=('jsonl', 'parquet'), default='jsonl')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--rows-per-part', type=int, default=1000, help='Filas por archivo Parquet')
+    parser.add_argument('--landmarks', action='store_true', help='Incluye los landmarks en la salida')
+    parser.add_argument('--annotated', help='Directorio donde guardar las imágenes y videos anotados')
+    parser.add_argument('--upload', action='store_true', help='Sube las imágenes y los videos anotados a Cloudinary')
+    parser.add_argument('--ai-report', action='store_true', help='Genera el reporte de IA de cada imagen (requiere --upload)')
+    parser.add_argument('--retry-errors', action='store_true', help='Vuelve a procesar los archivos que fallaron')
+    parser.add_argument('--limit', type=int, help='Procesa como máximo N archivos nuevos')
+    parser.add_argument('--video-smoothing', choices=('none', 'one_euro', 'kalman'),
+                        default=os.getenv('VIDEO_SMOOTHING', 'none'), help='Suavizado temporal de los videos')
+    parser.add_argument('--video-hold-frames', type=int, default=int(os.getenv('VIDEO_VERDICT_HOLD_FRAMES', 0)),
+                        help='Cuadros seguidos para cambiar el veredicto de los videos (0 = sin histéresis)')
+    args = parser.parse_args()
+
+    if bool(args.input) == bool(args.manifest):
+        parser.error('indica un directorio o --manifest')
+    if args.ai_report and not args.upload:
+        parser.error('--ai-report requiere --upload (el reporte usa la URL de la imagen)')
+
+    lock_file = _lock_output(os.path.abspath(args.output))
+    if lock_file is None:
+        print(f'Ya hay otra ejecución escribiendo en {args.output}', file=sys.stderr)
+        return 1
+
+    output = open_output(args.output, args.format, rows_per_part=args.rows_per_part, landmarks=args.landmarks)
+    done = output.processed(include_errors=not args.retry_errors)
+    if done:
+        print(f'Continuando: {len(done)} archivos ya procesados en {args.output}', file=sys.stderr)
+
+    def pending():
+        count = 0
+        for path, root in iter_inputs(args):
+            if path in done:
+                continue
+            if args.limit is not None and count >= args.limit:
+                return
+            count += 1
+            yield path, root
+
+    options = {
+        'landmarks': args.landmarks,
+        'annotated': os.path.abspath(args.annotated) if args.annotated else None,
+        'upload': args.upload,
+        'ai_report': args.ai_report,
+        'video_smoothing': args.video_smoothing,
+        'video_hold_frames': args.video_hold_frames
+    }
+
+    # Un SIGTERM (p. ej. del planificador de trabajos) se trata igual que Ctrl+C
+    signal.signal(signal.SIGTERM, _stop)
+
+    processed = errors = 0
+    started = last_report = time.monotonic()
+    interrupted = False
+    context = multiprocessing.get_context('fork' if hasattr(os, 'fork') else 'spawn')
+    pool = context.Pool(max(1, args.processes), initializer=_init_worker, initargs=(options,))
+    try:
+        for record in pool.imap_unordered(process_file, pending(), chunksize=1):
+            output.write(record)
+            processed += 1
+            errors += not record['success']
+            now = time.monotonic()
+            if now - last_report >= 5:
+                last_report = now
+                print(f'{processed} procesados ({errors} con error), '
+                      f'{processed / (now - started):.1f} archivos/s', file=sys.stderr)
+        pool.close()
+    except KeyboardInterrupt:
+        interrupted = True
+        pool.terminate()
+    finally:
+        pool.join()
+        output.close()
+        lock_file.close()
+
+    elapsed = time.monotonic() - started
+    summary = {
+        'processed': processed,
+        'errors': errors,
+        'skipped': len(done),
+        'seconds': round(elapsed, 2),
+        'files_per_second': round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        'output': args.output,
+        'interrupted': interrupted
+    }
+    print(json.dumps(summary, ensure_ascii=False))
+    if interrupted:
+        print('Interrumpido: relanza el mismo comando para continuar', file=sys.stderr)
+        return 130
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
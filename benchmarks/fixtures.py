@@ -0,0 +1,186 @@
+"""
+Fixtures para los benchmarks: landmarks grabados, fotos reales y medios sintéticos.
+
+landmarks.json se graba con MediaPipe sobre las fotos de fixtures/images (y variaciones
+de ellas): astronaut.jpg (NASA, dominio público) y camera.jpg (CC0), ambas de los datos
+de ejemplo de scikit-image. Las fotos también sirven de entrada real para las etapas
+e2e y la prueba de carga, porque en las figuras sintéticas MediaPipe no ve a nadie.
+
+Uso:
+    python -m benchmarks.fixtures --record benchmarks/fixtures/images --variants 16
+    python -m benchmarks.fixtures --record carpeta_con_fotos/
+    python -m benchmarks.fixtures --synthetic 64
+"""
+import argparse
+import json
+import os
+import random
+
+import cv2
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+LANDMARKS_FILE = os.path.join(FIXTURES_DIR, 'landmarks.json')
+IMAGES_DIR = os.path.join(FIXTURES_DIR, 'images')
+
+# Persona sentada vista de perfil, coordenadas normalizadas (x, y) de los 33 landmarks de MediaPipe
+BASE_POSE = [
+    (0.52, 0.22), (0.515, 0.205), (0.52, 0.205), (0.525, 0.205),
+    (0.515, 0.205), (0.52, 0.205), (0.525, 0.205), (0.49, 0.21),
+    (0.50, 0.21), (0.515, 0.24), (0.525, 0.24), (0.48, 0.33),
+    (0.50, 0.33), (0.47, 0.47), (0.49, 0.47), (0.60, 0.49),
+    (0.62, 0.49), (0.63, 0.50), (0.65, 0.50), (0.64, 0.49),
+    (0.66, 0.49), (0.62, 0.48), (0.64, 0.48), (0.46, 0.60),
+    (0.48, 0.60), (0.64, 0.61), (0.66, 0.61), (0.64, 0.80),
+    (0.66, 0.80), (0.62, 0.82), (0.64, 0.82), (0.70, 0.82),
+    (0.72, 0.82)
+]
+
+
+def synthetic_poses(count, seed=0, jitter=0.03):
+    """Variaciones de BASE_POSE con ruido, deterministas para un mismo seed"""
+    rng = random.Random(seed)
+    poses = []
+    for _ in range(count):
+        pose = []
+        for x, y in BASE_POSE:
+            pose.append([
+                round(x + rng.uniform(-jitter, jitter), 5),
+                round(y + rng.uniform(-jitter, jitter), 5),
+                round(rng.uniform(-0.2, 0.2), 5),
+                round(rng.uniform(0.8, 1.0), 5)
+            ])
+        poses.append(pose)
+    return poses
+
+
+def load_images(directory=IMAGES_DIR):
+    """Fotos de una carpeta, en orden, como arreglos BGR"""
+    images = []
+    for name in sorted(os.listdir(directory)):
+        image = cv2.imread(os.path.join(directory, name))
+        if image is not None:
+            images.append(image)
+    return images
+
+
+def photo_variants(image, count):
+    """Variaciones deterministas de una foto (giro, escala, espejo, brillo); la primera es la original"""
+    h, w = image.shape[:2]
+    for i in range(count):
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), (i % 5 - 2) * 4.0, 1.0 - 0.05 * (i % 4))
+        variant = cv2.warpAffine(image, matrix, (w, h), borderMode=cv2.BORDER_REFLECT)
+        if i % 2:
+            variant = cv2.flip(variant, 1)
+        yield cv2.convertScaleAbs(variant, alpha=1.0, beta=(i % 3 - 1) * 15) if i else image
+
+
+def record_poses(directory, variants=1):
+    """Ejecuta MediaPipe sobre las fotos de una carpeta (y sus variaciones) y devuelve sus landmarks"""
+    import mediapipe as mp
+
+    poses = []
+    with mp.solutions.pose.Pose(static_image_mode=True, model_complexity=1) as pose:
+        for image in load_images(directory):
+            for variant in photo_variants(image, variants):
+                results = pose.process(cv2.cvtColor(variant, cv2.COLOR_BGR2RGB))
+                if not results.pose_landmarks:
+                    continue
+                poses.append([
+                    [round(lm.x, 5), round(lm.y, 5), round(lm.z, 5), round(lm.visibility, 5)]
+                    for lm in results.pose_landmarks.landmark
+                ])
+    return poses
+
+
+def load_poses(path=LANDMARKS_FILE):
+    with open(path) as f:
+        return json.load(f)['poses']
+
+
+def to_landmark_list(pose):
+    """Convierte una pose del fixture al proto que devuelve pose.process()"""
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, visibility in pose:
+        landmark_list.landmark.add(x=x, y=y, z=z, visibility=visibility)
+    return landmark_list
+
+
+def to_landmark_dict(landmark_list):
+    from app.utils.mediapipe_helper import extract_landmarks
+    return extract_landmarks(landmark_list)
+
+
+def synthetic_image(pose, width=1280, height=720, seed=0):
+    """Fondo con textura y una figura dibujada a partir de la pose"""
+    rng = np.random.default_rng(seed)
+    image = rng.integers(90, 160, size=(height, width, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (0, 0), 3)
+
+    points = [(int(x * width), int(y * height)) for x, y, _, _ in pose]
+    for a, b in ((11, 13), (13, 15), (12, 14), (14, 16), (11, 23), (12, 24),
+                 (23, 25), (25, 27), (24, 26), (26, 28), (27, 31), (28, 32), (11, 12), (23, 24)):
+        cv2.line(image, points[a], points[b], (60, 80, 200), 18)
+    cv2.circle(image, points[0], 40, (120, 150, 210), -1)
+    return image
+
+
+def synthetic_video(path, poses, frames=60, width=640, height=360, fps=20.0):
+    """Escribe un MP4 corto que recorre las poses del fixture"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for i in range(frames):
+        writer.write(synthetic_image(poses[i % len(poses)], width, height, seed=i))
+    writer.release()
+    return path
+
+
+def photo_frame(image, i, frames, width=640, height=360, zoom=(0.8, 1.0)):
+    """
+    Cuadro i de un paneo lento sobre una foto: la persona se mueve y cambia de escala
+    entre zoom[0] y zoom[1] del alto del cuadro.
+    """
+    phase = 2 * np.pi * i / max(1, frames)
+    low, high = zoom
+    size = int(height * ((low + high) / 2 + (high - low) / 2 * np.sin(phase)))
+    photo = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    frame = np.full((height, width, 3), 40, dtype=np.uint8)
+    x = int((width - size) * (0.5 + 0.4 * np.sin(phase / 2)))
+    y = (height - size) // 2
+    frame[y:y + size, x:x + size] = photo
+    return frame
+
+
+def photo_video(path, images, frames=60, width=640, height=360, fps=20.0, zoom=(0.8, 1.0)):
+    """MP4 con un paneo sobre cada foto real, repartiendo los cuadros entre ellas"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    per_image = max(1, frames // len(images))
+    for i in range(frames):
+        image = images[min(i // per_image, len(images) - 1)]
+        writer.write(photo_frame(image, i % per_image, per_image, width, height, zoom))
+    writer.release()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera el fixture de landmarks de los benchmarks')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--synthetic', type=int, metavar='N', help='Genera N poses sintéticas')
+    group.add_argument('--record', metavar='CARPETA', help='Graba landmarks de las fotos de una carpeta')
+    parser.add_argument('--variants', type=int, default=1, help='Variaciones de cada foto a grabar (con --record)')
+    parser.add_argument('--output', default=LANDMARKS_FILE)
+    args = parser.parse_args()
+
+    if args.record:
+        poses, source = record_poses(args.record, max(1, args.variants)), 'recorded'
+    else:
+        poses, source = synthetic_poses(args.synthetic), 'synthetic'
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'source': source, 'poses': poses}, f)
+    print(f'{len(poses)} poses guardadas en {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+Benchmarks de las etapas críticas del análisis postural.
+
+Las etapas puras (ángulos, evaluación, recomendaciones, dibujo) usan los landmarks
+del fixture y no ejecutan inferencia. Las etapas e2e_* sí ejecutan MediaPipe sobre las
+fotos reales de benchmarks/fixtures/images (o las de --images) y un video hecho con ellas.
+El baseline incluido es la ejecución más lenta de tres en un nodo de 1 CPU (el ruido entre
+ejecuciones ronda el 25%); en otra máquina conviene grabar uno propio.
+
+Uso:
+    python -m benchmarks.run                     # ejecuta y compara con el baseline
+    python -m benchmarks.run --save-baseline     # guarda los resultados como baseline
+    python -m benchmarks.run --only angles draw  # solo algunas etapas
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+
+from benchmarks import fixtures
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(fn, inputs, min_time, min_iterations, warmup=3):
+    """
+    Ejecuta fn sobre las entradas en ciclo hasta cumplir min_time e min_iterations.
+
+    Returns:
+        dict: Operaciones por segundo, latencias y pico de memoria (tracemalloc)
+    """
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+
+    timings = []
+    start = time.perf_counter()
+    i = 0
+    while len(timings) < min_iterations or time.perf_counter() - start < min_time:
+        item = inputs[i % len(inputs)]
+        t0 = time.perf_counter()
+        fn(item)
+        timings.append(time.perf_counter() - t0)
+        i += 1
+    elapsed = sum(timings)
+
+    # La medición de memoria va aparte porque tracemalloc altera los tiempos
+    gc.collect()
+    tracemalloc.start()
+    fn(inputs[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'iterations': len(timings),
+        'ops_per_sec': round(len(timings) / elapsed, 2) if elapsed > 0 else 0.0,
+        'mean_ms': round(elapsed / len(timings) * 1000, 4),
+        'p50_ms': round(_percentile(timings, 50) * 1000, 4),
+        'p95_ms': round(_percentile(timings, 95) * 1000, 4),
+        'peak_kb': round(peak / 1024, 1)
+    }
+
+
+def build_benchmarks(args):
+    from app.utils.cloudinary_helper import encode_image
+    from app.utils.mediapipe_helper import (
+        analyze_posture,
+        calculate_angles,
+        draw_pose,
+        evaluate_posture,
+        extract_landmarks,
+        generate_recommendations,
+    )
+    from app.utils.video_posture_helper import analyze_and_annotate_frame, process_video_posture
+
+    poses = fixtures.load_poses(args.fixture)
+    landmark_lists = [fixtures.to_landmark_list(p) for p in poses]
+    landmark_dicts = [extract_landmarks(l) for l in landmark_lists]
+    angle_sets = [calculate_angles(l) for l in landmark_dicts]
+
+    canvas = fixtures.synthetic_image(poses[0], args.width, args.height)
+    frame = fixtures.synthetic_image(poses[0], 640, 360)
+    frames = [(frame.copy(), l) for l in landmark_lists]
+
+    if args.images:
+        image_bytes = []
+        for name in sorted(os.listdir(args.images)):
+            with open(os.path.join(args.images, name), 'rb') as f:
+                image_bytes.append(f.read())
+    else:
+        image_bytes = []
+        for name in sorted(os.listdir(fixtures.IMAGES_DIR)):
+            with open(os.path.join(fixtures.IMAGES_DIR, name), 'rb') as f:
+                image_bytes.append(f.read())
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_')
+    video_path = fixtures.photo_video(
+        os.path.join(tmpdir, 'entrada.mp4'), fixtures.load_images(), frames=args.video_frames
+    )
+
+    def run_video(_):
+        # process_video_posture borra la entrada al terminar
+        path = os.path.join(tmpdir, 'copia.mp4')
+        with open(video_path, 'rb') as src, open(path, 'wb') as dst:
+            dst.write(src.read())
+        result = process_video_posture(path, os.path.join(tmpdir, 'salida.mp4'), upload=False)
+        if not result['success']:
+            raise RuntimeError(result['error'])
+
+    return {
+        'extract_landmarks': (extract_landmarks, landmark_lists, 'fast'),
+        'calculate_angles': (calculate_angles, landmark_dicts, 'fast'),
+        'evaluate_posture': (evaluate_posture, angle_sets, 'fast'),
+        'generate_recommendations': (generate_recommendations, angle_sets, 'fast'),
+        'draw_pose': (
+            lambda item: draw_pose(canvas, item[0], item[1]),
+            list(zip(landmark_lists, angle_sets)),
+            'fast'
+        ),
+        'video_annotate_frame': (
+            lambda item: analyze_and_annotate_frame(item[0], item[1]),
+            frames,
+            'fast'
+        ),
+        'encode_image': (encode_image, [canvas], 'fast'),
+        'e2e_image': (lambda data: analyze_posture(io.BytesIO(data)), image_bytes, 'slow'),
+        'e2e_video': (run_video, [None], 'slow'),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Devuelve la lista de regresiones respecto al baseline"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if current['ops_per_sec'] < previous['ops_per_sec'] * (1 - threshold):
+            regressions.append(
+                f"{name}: {current['ops_per_sec']} ops/s vs {previous['ops_per_sec']} en el baseline"
+            )
+        if previous['peak_kb'] > 0 and current['peak_kb'] > previous['peak_kb'] * (1 + threshold):
+            regressions.append(
+                f"{name}: {current['peak_kb']} KB de pico vs {previous['peak_kb']} en el baseline"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks del análisis postural')
+    parser.add_argument('--only', nargs='*', help='Etapas a ejecutar')
+    parser.add_argument('--fixture', default=fixtures.LANDMARKS_FILE)
+    parser.add_argument('--images', help='Carpeta con fotos reales para e2e_image')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--video-frames', type=int, default=60)
+    parser.add_argument('--min-time', type=float, default=1.0, help='Segundos mínimos por etapa rápida')
+    parser.add_argument('--repeat', type=int, default=3, help='Rondas por etapa (se compara la mejor)')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Regresión tolerada (0.2 = 20%%)')
+    parser.add_argument('--output', help='Guarda los resultados en JSON')
+    args = parser.parse_args()
+
+    benchmarks = build_benchmarks(args)
+    selected = args.only or list(benchmarks)
+
+    results = {}
+    print(f"{'etapa':<26}{'ops/s':>12}{'media ms':>12}{'p50 ms':>12}{'p95 ms':>12}{'pico KB':>12}")
+    for name in selected:
+        fn, inputs, kind = benchmarks[name]
+        # Se queda la mejor de varias rondas: el ruido de la máquina solo puede hacerla más lenta
+        rounds = []
+        for _ in range(max(1, args.repeat)):
+            if kind == 'fast':
+                rounds.append(measure(fn, inputs, args.min_time, min_iterations=50))
+            else:
+                rounds.append(measure(fn, inputs, 0, min_iterations=3, warmup=1))
+        result = max(rounds, key=lambda r: r['ops_per_sec'])
+        result['peak_kb'] = min(r['peak_kb'] for r in rounds)
+        results[name] = result
+        print(f"{name:<26}{result['ops_per_sec']:>12}{result['mean_ms']:>12}"
+              f"{result['p50_ms']:>12}{result['p95_ms']:>12}{result['peak_kb']:>12}")
+
+    if 'e2e_video' in results:
+        fps = args.video_frames * results['e2e_video']['ops_per_sec']
+        print(f"\ne2e_video: {fps:.1f} frames/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f'\nBaseline guardado en {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('\nNo hay baseline, ejecuta con --save-baseline para crearlo')
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+
+    if regressions:
+        print('\nRegresiones detectadas:')
+        for regression in regressions:
+            print(f'  - {regression}')
+        return 1
+
+    print('\nSin regresiones respecto al baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
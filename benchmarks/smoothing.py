@@ -0,0 +1,259 @@
+"""
+Precisión del análisis de video con suavizado temporal e histéresis del veredicto.
+
+Analiza cada video cuadro a cuadro con la configuración de referencia (modelo full sin
+suavizado, la salida actual) y con cada candidata, y compara por cuadro el veredicto y el
+ángulo del cuello: cuadros de mala postura, concordancia con la referencia, cambios de
+veredicto (parpadeo) y cuadros por segundo. Las configuraciones son modelo:suavizado, con
++N para exigir N cuadros seguidos antes de cambiar el veredicto (por defecto --hold-frames).
+
+MediaPipe se ejecuta una vez por video y modelo; el suavizado se aplica después sobre esos
+landmarks. Con --record-traces se guardan los landmarks de cada modelo y con --traces se
+reanaliza un archivo grabado sin ejecutar MediaPipe, en una máquina que no tiene el modelo.
+benchmarks/fixtures/traces.json tiene el modelo full sobre el video de las fotos reales de
+benchmarks/fixtures/images.
+
+Con --simulate no se ejecuta ningún modelo: la referencia es una persona sintética que se
+encorva y se endereza despacio, y las candidatas (solo el suavizado) reciben esos landmarks con
+ruido gaussiano de --noise. Sirve para ajustar los filtros, no para decidir si otro modelo
+es aceptable: eso solo lo dicen sus landmarks reales.
+
+Uso:
+    python -m benchmarks.smoothing videos/*.mp4
+    python -m benchmarks.smoothing videos/*.mp4 --candidate 1:none+5 --candidate 1:kalman --hold-frames 5
+    python -m benchmarks.smoothing videos/*.mp4 --record-traces trazas.json
+    python -m benchmarks.smoothing --traces trazas.json --candidate 1:one_euro+3 --output comparacion.json
+    python -m benchmarks.smoothing --traces benchmarks/fixtures/traces.json --candidate 1:one_euro --candidate 1:kalman
+    python -m benchmarks.smoothing --simulate --noise 0.01 --candidate none+3 --candidate one_euro
+"""
+import argparse
+import json
+import math
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks import fixtures
+
+DEFAULT_CANDIDATES = ['1:none+3', '1:one_euro', '1:kalman']
+SIMULATED_CANDIDATES = ['none', 'none+3', 'one_euro', 'one_euro+3', 'kalman', 'kalman+3']
+
+
+def parse_setting(text):
+    complexity, _, method = text.partition(':')
+    return int(complexity), method or 'none'
+
+
+def parse_smoothing(text, default_hold_frames):
+    method, _, hold_frames = text.partition('+')
+    return method or 'none', int(hold_frames) if hold_frames else default_hold_frames
+
+
+def _smoother(smoothing, args, hold_frames):
+    from app.utils.smoothing import PostureSmoother
+
+    method, hold_frames = parse_smoothing(smoothing, hold_frames)
+    if method == 'none' and hold_frames <= 1:
+        return None
+    return PostureSmoother(
+        method, min_cutoff=args.min_cutoff, beta=args.beta, process_noise=args.process_noise,
+        measurement_noise=args.measurement_noise, hold_frames=hold_frames
+    )
+
+
+def _analyze(frame, landmarks, timestamp, smoother):
+    """(veredicto, ángulo del cuello) de un cuadro, con el mismo código que process_video_posture"""
+    from app.utils.video_posture_helper import analyze_and_annotate_frame, calcular_angulo_cuello, mp_pose
+
+    if smoother is not None:
+        landmarks = smoother.landmarks(landmarks, timestamp)
+    verdict = analyze_and_annotate_frame(frame, landmarks, smoother)
+    if smoother is not None:
+        return verdict, smoother.angles['cuello']
+    points = landmarks.landmark
+    return verdict, calcular_angulo_cuello(
+        points[mp_pose.PoseLandmark.LEFT_EAR], points[mp_pose.PoseLandmark.RIGHT_EAR],
+        points[mp_pose.PoseLandmark.LEFT_SHOULDER], points[mp_pose.PoseLandmark.RIGHT_SHOULDER]
+    )
+
+
+def record_trace(path, complexity):
+    """Landmarks por cuadro (None sin persona) de un modelo y segundos de inferencia"""
+    import mediapipe as mp
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise OSError(f'No se pudo abrir {path}')
+    fps = cap.get(cv2.CAP_PROP_FPS) or 20.0
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    poses, elapsed = [], 0.0
+    with mp.solutions.pose.Pose(static_image_mode=False, model_complexity=complexity) as pose:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            start = time.perf_counter()
+            results = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            elapsed += time.perf_counter() - start
+            if results.pose_landmarks:
+                poses.append([[round(p.x, 5), round(p.y, 5), round(p.z, 5), round(p.visibility, 4)]
+                              for p in results.pose_landmarks.landmark])
+            else:
+                poses.append(None)
+    cap.release()
+    return {'fps': fps, 'size': size, 'poses': poses, 'seconds': round(elapsed, 3)}
+
+
+def replay_trace(recorded, smoothing, args, hold_frames=0):
+    """
+    Veredicto y ángulo por cuadro de unos landmarks grabados, y segundos de cómputo.
+    hold_frames es la histéresis si smoothing no trae +N.
+    """
+    smoother = _smoother(smoothing, args, hold_frames)
+    width, height = recorded['size']
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    trace, elapsed = [], recorded['seconds']
+    for i, pose in enumerate(recorded['poses']):
+        if pose is None:
+            trace.append(None)
+            continue
+        landmarks = fixtures.to_landmark_list(pose)
+        start = time.perf_counter()
+        trace.append(_analyze(frame, landmarks, i / recorded['fps'], smoother))
+        elapsed += time.perf_counter() - start
+    return trace, elapsed
+
+
+def simulated_poses(frames, fps, period):
+    """Persona sentada que se encorva y se endereza: cruza los umbrales de columna y cuello"""
+    base = np.array([(x, y, 0.0, 1.0) for x, y in fixtures.BASE_POSE])
+    poses = []
+    for i in range(frames):
+        slump = 0.5 - 0.5 * math.cos(2 * math.pi * i / fps / period)
+        pose = base.copy()
+        pose[:11, 1] += 0.30 * slump  # cabeza hacia abajo...
+        pose[:11, 0] += 0.06 * slump  # ...y hacia adelante
+        pose[11:23, 1] += 0.20 * slump  # hombros y brazos
+        poses.append(pose)
+    return poses
+
+
+def simulated_trace(poses, fps, noise, seed=0):
+    """Los landmarks de la persona sintética con ruido, con el formato de record_trace"""
+    rng = np.random.default_rng(seed)
+    noisy = []
+    for pose in poses:
+        pose = pose.copy()
+        if noise:
+            pose[:, :2] += rng.normal(0, noise, size=(len(pose), 2))
+        noisy.append(pose.tolist())
+    return {'fps': fps, 'size': (640, 360), 'poses': noisy, 'seconds': 0.0}
+
+
+def compare(reference, trace, elapsed):
+    frames = [(r, c) for r, c in zip(reference, trace) if r is not None and c is not None]
+    verdicts = [c[0] for c in trace if c is not None]
+    return {
+        'cuadros': len(trace),
+        'cuadros_con_persona': len(verdicts),
+        'malas_posturas': sum(verdicts),
+        'concordancia': round(sum(r[0] == c[0] for r, c in frames) / len(frames) * 100, 2) if frames else None,
+        'cambios_de_veredicto': sum(a != b for a, b in zip(verdicts, verdicts[1:])),
+        'error_cuello': round(sum(abs(r[1] - c[1]) for r, c in frames) / len(frames), 2) if frames else None,
+        'fps': round(len(trace) / elapsed, 1) if elapsed > 0 else None
+    }
+
+
+def _print(name, result):
+    print(f"{name:<14}{result['malas_posturas']:>10}{str(result['concordancia']):>14}"
+          f"{result['cambios_de_veredicto']:>10}{str(result['error_cuello']):>14}{str(result['fps']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara el suavizado y la histéresis contra la salida actual')
+    parser.add_argument('videos', nargs='*', help='Videos a analizar')
+    parser.add_argument('--reference', help='Configuración de referencia (por defecto 1:none; none con --simulate)')
+    parser.add_argument('--candidate', action='append', help=f'Configuración a comparar (repetible; por defecto {", ".join(DEFAULT_CANDIDATES)})')
+    parser.add_argument('--traces', help='Reanaliza landmarks grabados con --record-traces en lugar de videos')
+    parser.add_argument('--record-traces', help='Guarda los landmarks de cada video y modelo en este archivo')
+    parser.add_argument('--simulate', action='store_true', help='Usa una persona sintética con ruido en lugar de videos')
+    parser.add_argument('--noise', type=float, default=0.01, help='Ruido de --simulate (desviación, fracción del cuadro)')
+    parser.add_argument('--frames', type=int, default=1200, help='Cuadros de --simulate')
+    parser.add_argument('--fps', type=float, default=20.0)
+    parser.add_argument('--period', type=float, default=20.0, help='Segundos de cada ciclo de --simulate')
+    parser.add_argument('--min-cutoff', type=float, default=1.0)
+    parser.add_argument('--beta', type=float, default=0.3)
+    parser.add_argument('--process-noise', type=float, default=1.0)
+    parser.add_argument('--measurement-noise', type=float, default=1e-4)
+    parser.add_argument('--hold-frames', type=int, default=0, help='Histéresis de las candidatas sin +N')
+    parser.add_argument('--output', help='Guarda los resultados en JSON')
+    args = parser.parse_args()
+
+    if sum((bool(args.videos), bool(args.traces), args.simulate)) != 1:
+        parser.error('indica videos, --traces o --simulate')
+    if args.record_traces and not args.videos:
+        parser.error('--record-traces necesita videos')
+
+    if args.simulate:
+        # Sin modelo, una configuración es solo el suavizado: el ruido hace de temblor del modelo
+        reference = args.reference or 'none'
+        candidates = args.candidate or SIMULATED_CANDIDATES
+        if any(':' in setting for setting in [reference] + candidates):
+            parser.error('--simulate no ejecuta ningún modelo: indica solo el suavizado (p. ej. --candidate one_euro)')
+        poses = simulated_poses(args.frames, args.fps, args.period)
+        noisy = simulated_trace(poses, args.fps, args.noise)
+        traces = {f'{reference} sin ruido': replay_trace(simulated_trace(poses, args.fps, 0.0), reference, args)}
+        traces.update((setting, replay_trace(noisy, setting, args, args.hold_frames)) for setting in candidates)
+        settings = list(traces)
+        reference = settings[0]
+        sources = {'simulacion': traces}
+    else:
+        reference = args.reference or '1:none'
+        settings = [reference] + (args.candidate or DEFAULT_CANDIDATES)
+        complexities = sorted({parse_setting(setting)[0] for setting in settings})
+        if args.traces:
+            with open(args.traces) as f:
+                recorded = json.load(f)['videos']
+            for source, traces in recorded.items():
+                missing = [c for c in complexities if str(c) not in traces]
+                if missing:
+                    parser.error(f'{args.traces} no tiene landmarks del modelo {missing[0]} para {source}; '
+                                 f'grábalos con --record-traces donde esté ese modelo')
+        else:
+            recorded = {
+                path: {str(c): record_trace(path, c) for c in complexities}
+                for path in args.videos
+            }
+            if args.record_traces:
+                with open(args.record_traces, 'w') as f:
+                    json.dump({'videos': recorded}, f)
+        sources = {
+            source: {
+                setting: replay_trace(
+                    traces[str(parse_setting(setting)[0])], parse_setting(setting)[1], args,
+                    0 if setting == reference else args.hold_frames
+                )
+                for setting in settings
+            }
+            for source, traces in recorded.items()
+        }
+
+    results = {}
+    print(f"{'configuración':<14}{'malas':>10}{'concordancia':>14}{'cambios':>10}{'error cuello':>14}{'fps':>10}")
+    for source, traces in sources.items():
+        print(source)
+        reference_trace = traces[reference][0]
+        results[source] = {setting: compare(reference_trace, *traces[setting]) for setting in settings}
+        for setting, result in results[source].items():
+            _print(setting, result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+import os
+import shutil
+
+# Directorio compartido para que /metrics agregue los valores de todos los workers.
+# Debe existir y estar limpio antes de cargar la aplicación (preload_app la carga
+# antes de on_starting).
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', '/tmp/analisis_postural_metrics'
+)
+shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+# Cargar la aplicación (y los módulos de MediaPipe/OpenCV) una sola vez en el master;
+# los workers comparten esas páginas por copy-on-write
+preload_app = True
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def pre_fork(server, worker):
+    # Índice del worker para el reparto de núcleos: el primero libre entre los vivos
+    used = {getattr(w, 'cpu_slot', None) for w in server.WORKERS.values()}
+    worker.cpu_slot = next(i for i in range(len(used) + 1) if i not in used)
+
+
+def post_fork(server, worker):
+    # Primero se reparten los núcleos: los hilos y grafos creados después heredan el límite
+    from app.utils.cpu_topology import apply_worker_layout
+    app = server.app.wsgi()
+    # Con asgi:app (UvicornWorker) la aplicación Flask está dentro del adaptador
+    apply_worker_layout(getattr(app, 'flask_app', app), workers=server.cfg.workers, slot=worker.cpu_slot)
+
+    # Los grafos de MediaPipe crean hilos, por eso se inicializan en cada worker
+    from app.utils.models import registry
+    registry.start_warmup()
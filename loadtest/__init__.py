@@ -0,0 +1,3 @@
+"""
+Pruebas de carga con servicios externos simulados
+"""
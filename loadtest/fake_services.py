@@ -0,0 +1,265 @@
+"""
+Servidores locales que imitan Cloudinary y OpenAI para pruebas de carga.
+
+Un único servidor HTTP atiende:
+    POST /v1_1/<cloud>/<image|video>/upload   (upload y upload_large por partes)
+    POST /v1/chat/completions                 (también con stream=True)
+
+Uso independiente:
+    python -m loadtest.fake_services --port 9100 --cloudinary-latency 0.3 --openai-latency 4
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+UPLOAD_PATH = re.compile(r'^/v1_1/(?P<cloud>[^/]+)/(?P<resource>image|video|raw|auto)/upload$')
+
+FAKE_REPORT = {
+    'resumen_ejecutivo': 'Reporte generado por el servicio simulado de pruebas de carga.',
+    'analisis_espacio_trabajo': {
+        'mobiliario': 'Simulado',
+        'equipamiento': 'Simulado',
+        'iluminacion_entorno': 'Simulado'
+    },
+    'puntos_criticos': ['Simulado'],
+    'recomendaciones_inmediatas': ['Simulado'],
+    'recomendaciones_largo_plazo': ['Simulado'],
+    'riesgos_identificados': ['Simulado'],
+    'ejercicios_recomendados': ['Simulado'],
+    'puntuacion_ergonomica': {
+        'total': '70/100',
+        'postura': '18/25',
+        'mobiliario': '18/25',
+        'equipamiento': '17/25',
+        'entorno': '17/25'
+    }
+}
+
+
+class ServiceProfile:
+    """Latencia y tasa de errores simuladas de un servicio"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def delay(self):
+        return max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class FakeServices:
+
+    def __init__(self, host='127.0.0.1', port=0, cloudinary=None, openai=None):
+        self.profiles = {
+            'cloudinary': cloudinary or ServiceProfile(),
+            'openai': openai or ServiceProfile()
+        }
+        self.counters = {name: {'requests': 0, 'errors': 0, 'bytes': 0} for name in self.profiles}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, service, nbytes, failed):
+        with self._lock:
+            counters = self.counters[service]
+            counters['requests'] += 1
+            counters['bytes'] += nbytes
+            if failed:
+                counters['errors'] += 1
+
+    def _handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                chunks = []
+                remaining = length
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 1 << 16))
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    remaining -= len(chunk)
+                return b''.join(chunks)
+
+            def do_POST(self):
+                body = self._read_body()
+                nbytes = len(body)
+                match = UPLOAD_PATH.match(self.path)
+                if match:
+                    service = 'cloudinary'
+                elif self.path.rstrip('/').endswith('/chat/completions'):
+                    service = 'openai'
+                else:
+                    self._send_json(404, {'error': {'message': f'Ruta desconocida {self.path}'}})
+                    return
+
+                profile = services.profiles[service]
+                stream = service == 'openai' and self._wants_stream(body)
+                delay = profile.delay()
+                # En streaming la latencia se reparte: una décima parte hasta el primer token
+                time.sleep(delay * 0.1 if stream else delay)
+                failed = profile.should_fail()
+                services._count(service, nbytes, failed)
+
+                if failed:
+                    self._send_json(profile.error_status, {'error': {'message': 'Error simulado'}})
+                elif service == 'cloudinary':
+                    self._send_json(200, self._upload_response(match))
+                elif stream:
+                    self._send_stream(delay * 0.9)
+                else:
+                    self._send_json(200, self._completion_response())
+
+            def _wants_stream(self, body):
+                try:
+                    return bool(json.loads(body).get('stream'))
+                except ValueError:
+                    return False
+
+            def _send_stream(self, duration, pieces=40):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                def write(payload):
+                    data = f'data: {payload}\n\n'.encode()
+                    self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                    self.wfile.flush()
+
+                completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+                content = json.dumps(FAKE_REPORT, ensure_ascii=False)
+                size = max(1, len(content) // pieces)
+                for start in range(0, len(content), size):
+                    write(json.dumps({
+                        'id': completion_id,
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': 'gpt-4o',
+                        'choices': [{'index': 0, 'delta': {'content': content[start:start + size]}, 'finish_reason': None}]
+                    }))
+                    time.sleep(duration / pieces)
+                write(json.dumps({
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': 'gpt-4o',
+                    'choices': [],
+                    'usage': {'prompt_tokens': 1100, 'completion_tokens': 600, 'total_tokens': 1700}
+                }))
+                write('[DONE]')
+                self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+
+            def _upload_response(self, match):
+                cloud = match.group('cloud')
+                resource = match.group('resource')
+                public_id = f'loadtest/{uuid.uuid4().hex}'
+                url = f'https://res.cloudinary.test/{cloud}/{resource}/upload/{public_id}'
+                ext = 'mp4' if resource == 'video' else 'jpg'
+                return {
+                    'public_id': public_id,
+                    'secure_url': f'{url}.{ext}',
+                    'url': f'{url}.{ext}',
+                    'format': ext,
+                    'width': 1280,
+                    'height': 720,
+                    'resource_type': resource,
+                    'eager': [{'secure_url': f'{url}_eager.{ext}', 'url': f'{url}_eager.{ext}'}]
+                }
+
+            def _completion_response(self):
+                return {
+                    'id': f'chatcmpl-{uuid.uuid4().hex}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': 'gpt-4o',
+                    'choices': [{
+                        'index': 0,
+                        'finish_reason': 'stop',
+                        'message': {'role': 'assistant', 'content': json.dumps(FAKE_REPORT)}
+                    }],
+                    'usage': {'prompt_tokens': 1100, 'completion_tokens': 600, 'total_tokens': 1700}
+                }
+
+        return Handler
+
+
+def add_service_arguments(parser):
+    for service, latency in (('cloudinary', 0.3), ('openai', 4.0)):
+        parser.add_argument(f'--{service}-latency', type=float, default=latency,
+                            help=f'Latencia media simulada de {service} en segundos')
+        parser.add_argument(f'--{service}-jitter', type=float, default=latency / 4)
+        parser.add_argument(f'--{service}-error-rate', type=float, default=0.0)
+
+
+def services_from_args(args, host='127.0.0.1', port=0):
+    return FakeServices(
+        host=host,
+        port=port,
+        cloudinary=ServiceProfile(args.cloudinary_latency, args.cloudinary_jitter, args.cloudinary_error_rate),
+        openai=ServiceProfile(args.openai_latency, args.openai_jitter, args.openai_error_rate)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cloudinary y OpenAI simulados')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    add_service_arguments(parser)
+    args = parser.parse_args()
+
+    services = services_from_args(args, args.host, args.port)
+    print(f'Servicios simulados en {services.url}')
+    print(f'  CLOUDINARY_UPLOAD_PREFIX={services.url}')
+    print(f'  OPENAI_BASE_URL={services.url}/v1')
+    try:
+        services.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(services.counters, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Prueba de carga de extremo a extremo con Cloudinary y OpenAI simulados.
+
+Levanta los servicios simulados, arranca la API con gunicorn apuntando a ellos y
+envía tráfico concurrente mixto de imágenes y videos.
+
+Uso:
+    python -m loadtest.run --workers 2 --threads 4 --concurrency 16 --duration 60 \\
+        --mix image=0.9,video=0.1 --images fotos/ --openai-latency 5
+    python -m loadtest.run --asgi --workers 1 --concurrency 48 --images fotos/
+
+Sin --images se usan las fotos reales de benchmarks/fixtures/images, en las que MediaPipe
+detecta a la persona, así que cada solicitud pasa por la subida a Cloudinary y el reporte
+de OpenAI simulados. Sin --videos se usa un video hecho con esas mismas fotos.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import cv2
+import urllib3
+
+from app.utils.history import sign_user_token
+from loadtest.fake_services import add_service_arguments, services_from_args
+
+ENDPOINTS = {
+    'image': '/api/analisis-ergonomico/analyze',
+    'video': '/api/analisis-postural/analizar-postura'
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f'Tipo de tráfico desconocido: {kind}')
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def load_media(args):
+    from benchmarks import fixtures
+
+    if args.images:
+        images = []
+        for name in sorted(os.listdir(args.images)):
+            with open(os.path.join(args.images, name), 'rb') as f:
+                images.append((name, f.read()))
+    else:
+        # Variaciones de las fotos: el contenido distinto evita la coalescencia entre solicitudes
+        images = [
+            (f'foto_{i}_{j}.jpg', cv2.imencode('.jpg', variant)[1].tobytes())
+            for i, image in enumerate(fixtures.load_images())
+            for j, variant in enumerate(fixtures.photo_variants(image, 4))
+        ]
+
+    if args.videos:
+        videos = []
+        for name in sorted(os.listdir(args.videos)):
+            with open(os.path.join(args.videos, name), 'rb') as f:
+                videos.append((name, f.read()))
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix='loadtest_'), 'fotos.mp4')
+        fixtures.photo_video(path, fixtures.load_images(), frames=args.video_frames)
+        with open(path, 'rb') as f:
+            videos = [('fotos.mp4', f.read())]
+
+    return {'image': images, 'video': videos}
+
+
+def start_app(args, services):
+    env = dict(os.environ)
+    env.update({
+        'FLASK_ENV': 'production',
+        'CLOUDINARY_CLOUD_NAME': 'loadtest',
+        'CLOUDINARY_API_KEY': 'loadtest',
+        'CLOUDINARY_API_SECRET': 'loadtest',
+        'CLOUDINARY_UPLOAD_PREFIX': services.url,
+        'OPENAI_API_KEY': 'sk-loadtest',
+        'OPENAI_BASE_URL': f'{services.url}/v1',
+        'PROMETHEUS_MULTIPROC_DIR': tempfile.mkdtemp(prefix='loadtest_metrics_'),
+        'HISTORY_USER_SECRET': args.user_secret
+    })
+    if args.asgi:
+        # Un event loop por worker; --threads no aplica
+        serving = ['--worker-class', 'uvicorn.workers.UvicornWorker', 'asgi:app']
+    else:
+        serving = ['--worker-class', 'gthread', '--threads', str(args.threads), 'wsgi:app']
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+        '--workers', str(args.workers),
+        '--timeout', '300',
+        '--bind', f'127.0.0.1:{args.port}'
+    ] + serving
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+
+    http = urllib3.PoolManager()
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn terminó durante el arranque')
+        try:
+            if http.request('GET', f'http://127.0.0.1:{args.port}/health', timeout=1, retries=False).status == 200:
+                return process
+        except urllib3.exceptions.HTTPError:
+            pass
+        time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError('La API no respondió a /health a tiempo')
+
+
+class LoadRunner:
+
+    def __init__(self, base_url, media, mix, concurrency, duration, request_timeout, user_secret=None):
+        self.base_url = base_url.rstrip('/')
+        self.user_secret = user_secret
+        self.media = media
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.concurrency = concurrency
+        self.duration = duration
+        self.http = urllib3.PoolManager(maxsize=concurrency)
+        self.timeout = urllib3.Timeout(connect=5, read=request_timeout)
+
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def _send(self, kind, headers):
+        name, data = random.choice(self.media[kind])
+        field = 'image' if kind == 'image' else 'video'
+        start = time.perf_counter()
+        try:
+            response = self.http.request(
+                'POST',
+                self.base_url + ENDPOINTS[kind],
+                fields={field: (name, data)},
+                headers=headers,
+                timeout=self.timeout,
+                retries=False
+            )
+            status = response.status
+            error = None
+            if status >= 400:
+                try:
+                    error = json.loads(response.data).get('error', f'HTTP {status}')
+                except ValueError:
+                    error = f'HTTP {status}'
+        except urllib3.exceptions.HTTPError as e:
+            status = 'conexion'
+            error = type(e).__name__
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.latencies[kind].append(elapsed)
+            self.statuses[kind][status] += 1
+            if error:
+                self.errors[kind][str(error)[:120]] += 1
+
+    def _worker(self, stop_at):
+        # Cada hilo es un usuario distinto para el reparto justo por cliente; sin secreto, todos comparten la IP
+        headers = {}
+        if self.user_secret:
+            headers['X-User-Token'] = sign_user_token(f'loadtest-{threading.get_ident()}', self.user_secret)
+        while time.time() < stop_at:
+            kind = random.choices(self.kinds, self.weights)[0]
+            self._send(kind, headers)
+
+    def run(self):
+        stop_at = time.time() + self.duration
+        threads = [threading.Thread(target=self._worker, args=(stop_at,)) for _ in range(self.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        report = {'duration_seconds': round(elapsed, 2), 'by_type': {}}
+        total = 0
+        for kind, values in self.latencies.items():
+            total += len(values)
+            ordered = sorted(values)
+
+            def pct(q):
+                return round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] * 1000, 1)
+
+            ok = sum(count for status, count in self.statuses[kind].items() if status == 200)
+            report['by_type'][kind] = {
+                'requests': len(values),
+                'ok': ok,
+                'throughput_rps': round(len(values) / elapsed, 2),
+                'ok_rps': round(ok / elapsed, 2),
+                'latency_ms': {
+                    'p50': pct(50), 'p90': pct(90), 'p95': pct(95), 'p99': pct(99),
+                    'max': round(ordered[-1] * 1000, 1)
+                },
+                'status': {str(k): v for k, v in self.statuses[kind].items()},
+                'errors': dict(self.errors[kind].most_common(10))
+            }
+        report['total_requests'] = total
+        report['throughput_rps'] = round(total / elapsed, 2) if elapsed else 0.0
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de la API de análisis postural')
+    parser.add_argument('--target', help='URL de una API ya levantada (no arranca gunicorn ni simuladores)')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--asgi', action='store_true', help='Sirve asgi:app con UvicornWorker en lugar de gthread')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--request-timeout', type=float, default=300)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('image=0.9,video=0.1'))
+    parser.add_argument('--images', help='Carpeta con fotos para /analyze')
+    parser.add_argument('--videos', help='Carpeta con videos para /analizar-postura')
+    parser.add_argument('--video-frames', type=int, default=60)
+    parser.add_argument('--output', help='Guarda el reporte en JSON')
+    parser.add_argument('--user-secret', default='loadtest',
+                        help='HISTORY_USER_SECRET de la API para firmar un X-User-Token por hilo (con --target, el de esa API)')
+    add_service_arguments(parser)
+    args = parser.parse_args()
+
+    media = load_media(args)
+    services = None
+    process = None
+
+    try:
+        if args.target:
+            base_url = args.target
+        else:
+            services = services_from_args(args).start()
+            process = start_app(args, services)
+            base_url = f'http://127.0.0.1:{args.port}'
+
+        runner = LoadRunner(base_url, media, args.mix, args.concurrency, args.duration, args.request_timeout,
+                            args.user_secret)
+        elapsed = runner.run()
+        report = runner.report(elapsed)
+        report['config'] = {
+            'workers': args.workers,
+            'threads': None if args.asgi else args.threads,
+            'serving': 'asgi' if args.asgi else 'gthread',
+            'concurrency': args.concurrency,
+            'mix': args.mix
+        }
+        if services:
+            report['fake_services'] = services.counters
+    finally:
+        if process:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+        if services:
+            services.stop()
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
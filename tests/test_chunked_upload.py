@@ -0,0 +1,119 @@
+"""
+ChunkedUploadStore (offset, checksum, reanudación) y la limpieza de process_video_posture
+cuando la fuente de cuadros de una subida se corta.
+"""
+import base64
+import hashlib
+import io
+
+import numpy as np
+import pytest
+
+from app.utils.chunked_upload import ChunkedUploadError, ChunkedUploadStore
+from app.utils.scheduler import AdmissionRejected
+
+DATA = bytes(range(256)) * 40
+
+
+def _checksum(data, algorithm='sha1'):
+    return f'{algorithm} ' + base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkedUploadStore(str(tmp_path / 'parciales'), max_size=len(DATA))
+
+
+def test_offset_mismatch_writes_nothing(store):
+    upload_id = store.create(len(DATA), 'video.mp4')
+    assert store.append(upload_id, 0, io.BytesIO(DATA[:1000])) == 1000
+
+    for offset in (0, 500, 2000):
+        with pytest.raises(ChunkedUploadError) as excinfo:
+            store.append(upload_id, offset, io.BytesIO(DATA[offset:offset + 100]))
+        assert excinfo.value.status == 409
+        assert '1000' in excinfo.value.message
+    assert store.info(upload_id)['offset'] == 1000
+
+
+def test_checksum_failure_discards_part(store):
+    upload_id = store.create(len(DATA), 'video.mp4')
+    store.append(upload_id, 0, io.BytesIO(DATA[:1000]), checksum=_checksum(DATA[:1000]))
+
+    with pytest.raises(ChunkedUploadError) as excinfo:
+        store.append(upload_id, 1000, io.BytesIO(b'x' * 500), checksum=_checksum(DATA[1000:1500]))
+    assert excinfo.value.status == 460
+    assert store.info(upload_id)['offset'] == 1000
+
+    # La misma parte con los datos correctos entra en el mismo offset
+    store.append(upload_id, 1000, io.BytesIO(DATA[1000:1500]), checksum=_checksum(DATA[1000:1500], 'sha256'))
+    assert store.info(upload_id)['offset'] == 1500
+
+    with pytest.raises(ChunkedUploadError) as excinfo:
+        store.append(upload_id, 1500, io.BytesIO(DATA[1500:]), checksum='crc32 AAAA')
+    assert excinfo.value.status == 400
+
+
+def test_resume_from_another_store(store):
+    upload_id = store.create(len(DATA), 'video.mp4')
+    store.append(upload_id, 0, io.BytesIO(DATA[:4096]))
+
+    # Otro worker del nodo retoma la subida desde el offset en disco
+    other = ChunkedUploadStore(store.folder, store.max_size)
+    meta = other.info(upload_id)
+    assert meta['offset'] == 4096 and not meta['complete'] and meta['filename'] == 'video.mp4'
+
+    with pytest.raises(ChunkedUploadError) as excinfo:
+        other.append(upload_id, 4096, io.BytesIO(DATA[4096:] + b'sobra'))
+    assert excinfo.value.status == 413
+    assert other.info(upload_id)['offset'] == 4096
+
+    assert other.append(upload_id, 4096, io.BytesIO(DATA[4096:])) == len(DATA)
+    assert other.info(upload_id)['complete']
+    with open(other.data_path(upload_id), 'rb') as f:
+        assert f.read() == DATA
+
+    other.delete(upload_id)
+    with pytest.raises(ChunkedUploadError) as excinfo:
+        store.info(upload_id)
+    assert excinfo.value.status == 404
+
+
+def test_create_validates_length(store):
+    for length, status in ((0, 400), (len(DATA) + 1, 413)):
+        with pytest.raises(ChunkedUploadError) as excinfo:
+            store.create(length, 'video.mp4')
+        assert excinfo.value.status == status
+
+
+def _frames(count, error):
+    for _ in range(count):
+        yield np.zeros((120, 160, 3), dtype=np.uint8)
+    raise error
+
+
+@pytest.mark.parametrize('segment_seconds', [0, 0.1])
+def test_stalled_source_leaves_no_partial_output(tmp_path, segment_seconds):
+    from app.utils.video_posture_helper import process_video_posture
+
+    output_path = str(tmp_path / 'video_resultado.mp4')
+    resumen = process_video_posture(
+        str(tmp_path / 'video.mp4'), output_path, upload=False, segment_seconds=segment_seconds,
+        frames=_frames(5, ValueError('La subida del video se detuvo'))
+    )
+
+    assert not resumen['success'] and 'se detuvo' in resumen['error']
+    # Con partes de 2 cuadros quedan las dos completas; la que estaba a medias se borra
+    expected = ['video_resultado_parte000.mp4', 'video_resultado_parte001.mp4'] if segment_seconds else []
+    assert sorted(p.name for p in tmp_path.iterdir()) == expected
+
+
+def test_rejected_source_leaves_no_partial_output(tmp_path):
+    from app.utils.video_posture_helper import process_video_posture
+
+    with pytest.raises(AdmissionRejected):
+        process_video_posture(
+            str(tmp_path / 'video.mp4'), str(tmp_path / 'video_resultado.mp4'), upload=False,
+            frames=_frames(3, AdmissionRejected('Tiempo de espera en cola agotado', 5))
+        )
+    assert list(tmp_path.iterdir()) == []
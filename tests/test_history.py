@@ -0,0 +1,110 @@
+"""
+X-User-Token (firma, vencimiento, manipulación) y HistoryStore: un análisis repetido
+no se guarda ni se suma dos veces a los agregados diarios.
+"""
+import calendar
+import threading
+
+import pytest
+from flask import Flask, request
+
+from app.utils.history import HistoryStore, history_client_id, sign_user_token, verify_user_token
+from app.utils.mediapipe_helper import ANGLE_NAMES
+
+SECRET = 'secreto'
+DAY = calendar.timegm((2026, 3, 2, 12, 0, 0))
+
+
+def test_token_roundtrip():
+    assert verify_user_token(sign_user_token('usuario-42', SECRET), SECRET) == 'usuario-42'
+    # El id puede tener puntos: la firma y el vencimiento se separan desde la derecha
+    assert verify_user_token(sign_user_token('ana.perez', SECRET), SECRET) == 'ana.perez'
+
+
+def test_expired_token():
+    assert verify_user_token(sign_user_token('usuario-42', SECRET, ttl=-1), SECRET) is None
+
+
+def test_tampered_token():
+    user_id, expires, signature = sign_user_token('usuario-42', SECRET).rsplit('.', 2)
+
+    assert verify_user_token(f'usuario-43.{expires}.{signature}', SECRET) is None
+    assert verify_user_token(f'{user_id}.{int(expires) + 3600}.{signature}', SECRET) is None
+    flipped = signature[:-1] + ('1' if signature[-1] == '0' else '0')
+    assert verify_user_token(f'{user_id}.{expires}.{flipped}', SECRET) is None
+    assert verify_user_token(sign_user_token('usuario-42', 'otro-secreto'), SECRET) is None
+
+
+@pytest.mark.parametrize('token', ['', 'usuario', 'usuario.firma', 'usuario.mañana.firma', f'.{2 ** 40}.firma'])
+def test_malformed_token(token):
+    assert verify_user_token(token, SECRET) is None
+
+
+def test_history_client_id_needs_secret():
+    app = Flask(__name__)
+    token = sign_user_token('usuario-42', SECRET)
+
+    app.config['HISTORY_USER_SECRET'] = SECRET
+    with app.test_request_context(headers={'X-User-Token': token}):
+        assert history_client_id(request) == 'usuario-42'
+    with app.test_request_context():
+        assert history_client_id(request) is None
+
+    app.config['HISTORY_USER_SECRET'] = None
+    with app.test_request_context(headers={'X-User-Token': token}):
+        assert history_client_id(request) is None
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / 'historial.sqlite3'))
+
+
+def _angles(value):
+    return {name: value for name in ANGLE_NAMES}
+
+
+def test_record_is_idempotent(store):
+    assert store.record('a', 'usuario-42', 'imagen', created_at=DAY, angles=_angles(10.0), is_good_posture=True)
+    assert not store.record('a', 'usuario-42', 'imagen', created_at=DAY, angles=_angles(90.0), is_good_posture=False)
+    assert store.record('b', 'usuario-42', 'imagen', created_at=DAY + 60, angles=_angles(20.0), is_good_posture=False)
+
+    # Se conserva el primero
+    assert store.get('a')['angles']['neck'] == 10.0
+    assert store.get('a')['is_good_posture'] is True
+
+    [point] = store.trend(client_id='usuario-42')
+    assert point['day'] == '2026-03-02'
+    assert point['analyses'] == 2
+    assert point['good_ratio'] == 0.5
+    assert point['avg_angles']['neck'] == 15.0
+
+
+def test_concurrent_duplicates_counted_once(store):
+    barrier = threading.Barrier(8)
+    results = []
+
+    def record():
+        barrier.wait()
+        results.append(store.record('mismo', 'usuario-42', 'video', created_at=DAY, total_frames=100, bad_frames=25))
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False] * 7 + [True]
+    [point] = store.trend(kind='video')
+    assert point['analyses'] == 1 and point['frames'] == 100 and point['bad_frame_ratio'] == 0.25
+
+
+def test_aggregates_by_client_and_day(store):
+    store.record('a', 'usuario-42', 'imagen', created_at=DAY, angles=_angles(10.0), is_good_posture=True)
+    store.record('b', 'usuario-7', 'imagen', created_at=DAY, angles=_angles(30.0), is_good_posture=False)
+    store.record('c', 'usuario-42', 'imagen', created_at=DAY + 86400, angles=_angles(50.0), is_good_posture=False)
+
+    assert [p['analyses'] for p in store.trend(client_id='usuario-42')] == [1, 1]
+    assert [p['avg_angles']['neck'] for p in store.trend()] == [20.0, 50.0]
+    assert [p['day'] for p in store.trend(since_day='2026-03-03')] == ['2026-03-03']
+    assert [r['id'] for r in store.recent(client_id='usuario-42')] == ['c', 'a']
@@ -0,0 +1,88 @@
+"""
+KeyframeSelector: los k cuadros más graves, separados al menos min_gap segundos.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from app.utils.keyframes import KeyframeSelector
+
+FRAME = np.zeros((360, 640, 3), dtype=np.uint8)
+
+
+def _offer(selector, timestamp, severity):
+    return selector.offer(int(timestamp * 20), timestamp, FRAME, {'cuello': severity})
+
+
+def _chosen(selector):
+    return sorted((entry[2], entry[0]) for entry in selector._heap)
+
+
+def test_near_frames_keep_the_most_severe():
+    selector = KeyframeSelector(k=5, min_gap=2.0)
+    assert _offer(selector, 0.0, 10)
+    # A menos de min_gap: solo entra si es más grave, y entonces reemplaza al anterior
+    assert not _offer(selector, 1.0, 5)
+    assert not _offer(selector, 1.9, 10)
+    assert _offer(selector, 1.5, 20)
+    assert _offer(selector, 3.5, 3)
+
+    assert _chosen(selector) == [(1.5, 20), (3.5, 3)]
+
+
+def test_severe_frame_replaces_every_near_one():
+    selector = KeyframeSelector(k=5, min_gap=2.0)
+    for timestamp, severity in ((0.0, 8), (2.5, 9), (6.0, 4)):
+        assert _offer(selector, timestamp, severity)
+
+    # A 1.5 s del primero y a 1 s del segundo
+    assert _offer(selector, 1.5, 12)
+    assert _chosen(selector) == [(1.5, 12), (6.0, 4)]
+
+
+def test_bounded_to_k():
+    selector = KeyframeSelector(k=2, min_gap=1.0)
+    for timestamp, severity in ((0, 5), (10, 1), (20, 7)):
+        _offer(selector, timestamp, severity)
+    assert not _offer(selector, 30, 4)
+    assert _chosen(selector) == [(0, 5), (20, 7)]
+
+
+def test_correct_frames_are_ignored():
+    selector = KeyframeSelector(k=3)
+    assert not _offer(selector, 0, 0)
+    assert not KeyframeSelector(k=0).offer(0, 0, FRAME, {'cuello': 50})
+    assert selector._heap == []
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_chosen_frames_respect_gap(seed):
+    rng = np.random.default_rng(seed)
+    selector = KeyframeSelector(k=6, min_gap=2.0)
+    severities = rng.uniform(0, 40, size=600) * (rng.random(600) < 0.7)
+    for i, severity in enumerate(severities):
+        _offer(selector, i / 20, float(severity))
+
+    chosen = _chosen(selector)
+    assert len(chosen) == 6
+    times = [t for t, _ in chosen]
+    assert all(b - a >= 2.0 for a, b in zip(times, times[1:]))
+    # Ningún cuadro descartado es más grave que todos los elegidos cercanos a él
+    for i, severity in enumerate(severities):
+        near = [s for t, s in chosen if abs(t - i / 20) < 2.0]
+        assert not near or severity <= max(near) or (i / 20, severity) in chosen
+
+
+def test_save_writes_thumbnails_by_severity(tmp_path):
+    selector = KeyframeSelector(k=3, min_gap=1.0, width=160)
+    for timestamp, severity in ((0.0, 5), (4.0, 30), (8.0, 12)):
+        selector.offer(int(timestamp * 20), timestamp, FRAME, {'cuello': severity, 'espalda': 0.0}, True)
+
+    momentos = selector.save(str(tmp_path / 'video_resultado.mp4'))
+
+    assert [m['segundo'] for m in momentos] == [4.0, 8.0, 0.0]
+    assert [m['archivo'] for m in momentos] == [f'video_resultado_momento{i:02d}.jpg' for i in range(3)]
+    assert momentos[0]['desviaciones'] == {'cuello': 30.0}
+    assert all(os.path.getsize(tmp_path / m['archivo']) > 0 for m in momentos)
+    assert selector._heap[0][3].shape == (90, 160, 3)
@@ -0,0 +1,59 @@
+"""
+La reevaluación vectorizada (compute_angles + evaluate) debe dar los mismos ángulos y
+el mismo veredicto que el análisis de la API (calculate_angles + evaluate_posture).
+"""
+import numpy as np
+import pytest
+
+from app.utils.mediapipe_helper import ANGLE_NAMES, LANDMARK_NAMES, calculate_angles, evaluate_posture
+from app.utils.rescoring import DEFAULT_PROFILES, compute_angles, evaluate
+from benchmarks import fixtures
+
+
+def _as_dicts(array):
+    return [
+        {name: {'x': float(x), 'y': float(y), 'z': float(z)} for name, (x, y, z) in zip(LANDMARK_NAMES.values(), row)}
+        for row in array.tolist()
+    ]
+
+
+def _compare(array):
+    angles = compute_angles(array)
+    good, _ = evaluate(angles, DEFAULT_PROFILES['actual'])
+    for row, landmarks in enumerate(_as_dicts(array)):
+        expected = calculate_angles(landmarks)
+        for name in ANGLE_NAMES:
+            assert angles[name][row] == pytest.approx(expected[name], abs=1e-9), (row, name)
+        assert bool(good[row]) == evaluate_posture(expected), row
+    return good
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_landmarks(seed):
+    rng = np.random.default_rng(seed)
+    array = rng.uniform(-0.2, 1.2, size=(400, len(LANDMARK_NAMES), 3))
+    _compare(array)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_perturbed_recorded_poses(seed):
+    rng = np.random.default_rng(seed)
+    poses = np.array(fixtures.load_poses())[:, list(LANDMARK_NAMES), :3]
+    array = np.repeat(poses, 20, axis=0)
+    array[:, :, :2] += rng.normal(0, 0.03, size=array[:, :, :2].shape)
+    _compare(array)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_seated_poses_near_thresholds(seed):
+    # Una persona sentada con temblor: los ángulos cruzan los umbrales en ambos sentidos
+    poses = np.array(fixtures.synthetic_poses(400, seed=seed, jitter=0.01))[:, list(LANDMARK_NAMES), :3]
+    good = _compare(poses)
+    assert good.any() and not good.all()
+
+
+def test_float32_dataset_rows():
+    # Los datasets guardan float32: la API ve esos mismos valores convertidos a float
+    rng = np.random.default_rng(0)
+    array = rng.uniform(0, 1, size=(400, len(LANDMARK_NAMES), 3)).astype(np.float32)
+    _compare(array)
@@ -0,0 +1,130 @@
+"""
+AdmissionScheduler: orden por prioridad, límite por cliente y respuesta 429 con
+Retry-After; get_client_id no se deja engañar por cabeceras del cliente.
+"""
+import threading
+import time
+
+import pytest
+from flask import Flask, request
+
+from app.utils.history import sign_user_token
+from app.utils.scheduler import AdmissionRejected, AdmissionScheduler, get_client_id, rejection_response
+
+
+def _scheduler(cpu_slots=1, queue_limit=4, max_wait=10, max_per_client=0):
+    return AdmissionScheduler(
+        cpu_slots=cpu_slots,
+        class_limits={'interactive': cpu_slots, 'batch': cpu_slots, 'video': cpu_slots},
+        queue_limits={c: queue_limit for c in ('interactive', 'batch', 'video')},
+        max_wait=max_wait,
+        max_per_client=max_per_client
+    )
+
+
+def _wait_queued(scheduler, expected, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if sum(c['queued'] for c in scheduler.stats()['classes'].values()) == expected:
+            return
+        time.sleep(0.01)
+    raise TimeoutError('Las solicitudes no llegaron a la cola')
+
+
+def test_priority_order():
+    scheduler = _scheduler()
+    order = []
+
+    def job(job_class):
+        with scheduler.slot(job_class, job_class):
+            order.append(job_class)
+
+    threads = []
+    with scheduler.slot('interactive', 'ocupa'):
+        # Se encolan en orden inverso a su prioridad
+        for queued, job_class in enumerate(('video', 'batch', 'interactive'), start=1):
+            thread = threading.Thread(target=job, args=(job_class,))
+            thread.start()
+            threads.append(thread)
+            _wait_queued(scheduler, queued)
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ['interactive', 'batch', 'video']
+
+
+def test_fair_share_between_clients():
+    scheduler = _scheduler(queue_limit=8)
+    order = []
+
+    def job(client_id):
+        with scheduler.slot('interactive', client_id):
+            order.append(client_id)
+
+    threads = []
+    with scheduler.slot('interactive', 'ocupa'):
+        for queued, client_id in enumerate(('a', 'a', 'a', 'b'), start=1):
+            thread = threading.Thread(target=job, args=(client_id,))
+            thread.start()
+            threads.append(thread)
+            _wait_queued(scheduler, queued)
+    for thread in threads:
+        thread.join(5)
+
+    # b llegó último, pero a ya había sido atendido
+    assert order == ['a', 'b', 'a', 'a']
+
+
+def test_per_client_cap():
+    scheduler = _scheduler(cpu_slots=4, max_per_client=2)
+    with scheduler.slot('interactive', 'a'), scheduler.slot('interactive', 'a'):
+        with pytest.raises(AdmissionRejected, match='cliente'):
+            with scheduler.slot('interactive', 'a'):
+                pass
+        # Otro cliente sigue entrando
+        with scheduler.slot('interactive', 'b'):
+            pass
+    # Al liberar, el mismo cliente vuelve a entrar
+    with scheduler.slot('interactive', 'a'):
+        pass
+    assert scheduler.stats()['classes']['interactive']['rejected'] == 1
+
+
+def test_queue_timeout_is_rejected():
+    scheduler = _scheduler(max_wait=0.2)
+    with scheduler.slot('video', 'a'):
+        with pytest.raises(AdmissionRejected, match='agotado'):
+            with scheduler.slot('video', 'b'):
+                pass
+    assert scheduler.stats()['classes']['video']['queued'] == 0
+
+
+def test_full_queue_returns_429_with_retry_after():
+    scheduler = _scheduler(queue_limit=0)
+    with scheduler.slot('batch', 'a'):
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with scheduler.slot('batch', 'b'):
+                pass
+
+    with Flask(__name__).app_context():
+        response = rejection_response(excinfo.value)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == excinfo.value.retry_after >= 1
+    assert response.get_json()['retry_after'] == excinfo.value.retry_after
+
+
+def test_client_id_ignores_client_headers():
+    app = Flask(__name__)
+    app.config['HISTORY_USER_SECRET'] = 'secreto'
+    spoofed = {'X-Client-Id': 'otro', 'X-Forwarded-For': '10.0.0.9'}
+
+    with app.test_request_context(headers=spoofed, environ_base={'REMOTE_ADDR': '203.0.113.5'}):
+        assert get_client_id(request) == '203.0.113.5'
+
+    token = sign_user_token('ana', 'secreto')
+    with app.test_request_context(headers={'X-User-Token': token}, environ_base={'REMOTE_ADDR': '203.0.113.5'}):
+        assert get_client_id(request) == 'usuario:ana'
+
+    forged = sign_user_token('ana', 'otro-secreto')
+    with app.test_request_context(headers={'X-User-Token': forged}, environ_base={'REMOTE_ADDR': '203.0.113.5'}):
+        assert get_client_id(request) == '203.0.113.5'
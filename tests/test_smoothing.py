@@ -0,0 +1,71 @@
+"""
+Histéresis del veredicto (VerdictHysteresis) y su configuración, independiente del filtro.
+"""
+import pytest
+
+from app.config.config import Config
+from app.utils.smoothing import PostureSmoother, VerdictHysteresis, video_smoothing_options
+
+
+def _run(hysteresis, raw):
+    return [hysteresis(value) for value in raw]
+
+
+def test_short_flicker_is_held():
+    hysteresis = VerdictHysteresis(hold_frames=3)
+    raw = [False, True, True, False, False, True, False]
+    assert _run(hysteresis, raw) == [False] * len(raw)
+
+
+def test_changes_after_hold_frames():
+    hysteresis = VerdictHysteresis(hold_frames=3)
+    raw = [False, True, True, True, True, False, True, False, False, False]
+    expected = [False, False, False, True, True, True, True, True, True, False]
+    assert _run(hysteresis, raw) == expected
+
+
+def test_interrupted_streak_starts_over():
+    hysteresis = VerdictHysteresis(hold_frames=3)
+    # Dos contrarios, uno igual al estado y otros dos: nunca hay tres seguidos
+    assert _run(hysteresis, [False, True, True, False, True, True]) == [False] * 6
+    assert hysteresis(True) is True
+
+
+def test_first_frame_sets_state_and_reset_forgets_it():
+    hysteresis = VerdictHysteresis(hold_frames=5)
+    assert hysteresis(True) is True
+    assert hysteresis(False) is True
+    hysteresis.reset()
+    assert hysteresis(False) is False
+
+
+@pytest.mark.parametrize('hold_frames', [0, 1])
+def test_hold_of_one_follows_raw(hold_frames):
+    raw = [False, True, False, True, True, False]
+    assert _run(VerdictHysteresis(hold_frames), raw) == raw
+
+
+def _config(**overrides):
+    return {**vars(Config), **overrides}
+
+
+def test_options_disabled_by_default():
+    assert video_smoothing_options(_config(VIDEO_SMOOTHING='none', VIDEO_VERDICT_HOLD_FRAMES=0)) is None
+    assert video_smoothing_options(_config(VIDEO_SMOOTHING='none', VIDEO_VERDICT_HOLD_FRAMES=1)) is None
+
+
+def test_hysteresis_without_filter():
+    options = video_smoothing_options(_config(VIDEO_SMOOTHING='none', VIDEO_VERDICT_HOLD_FRAMES=3))
+    assert options['method'] == 'none' and options['hold_frames'] == 3
+
+    smoother = PostureSmoother(**options)
+    # Sin filtro los ángulos pasan tal cual, pero el veredicto sí tiene histéresis
+    smoother.landmarks(None, 0.0)
+    assert smoother.angle('cuello', 93.5) == 93.5
+    assert [smoother.verdict(v) for v in (False, True, True, True)] == [False, False, False, True]
+
+
+def test_filter_without_hysteresis():
+    options = video_smoothing_options(_config(VIDEO_SMOOTHING='kalman', VIDEO_VERDICT_HOLD_FRAMES=0))
+    smoother = PostureSmoother(**options)
+    assert [smoother.verdict(v) for v in (False, True, False)] == [False, True, False]
@@ -0,0 +1,114 @@
+"""
+UploadManager contra el Cloudinary simulado de loadtest.fake_services, y el dueño
+de las subidas y directorios de trabajo que quedan de un worker terminado.
+"""
+import os
+import subprocess
+import time
+
+import cloudinary
+import pytest
+
+from app.utils.storage import OWNER_FILE, VideoStorage, process_token
+from app.utils.upload_manager import UploadManager
+from loadtest.fake_services import FakeServices, ServiceProfile
+
+LATENCY = 0.5
+
+
+@pytest.fixture
+def services():
+    services = FakeServices(cloudinary=ServiceProfile(latency=LATENCY)).start()
+    previous = cloudinary.config().__dict__.copy()
+    cloudinary.config(cloud_name='prueba', api_key='prueba', api_secret='prueba', upload_prefix=services.url)
+    try:
+        yield services
+    finally:
+        cloudinary.config(**previous)
+        services.stop()
+
+
+def test_image_upload_not_blocked_by_video_jobs(services, tmp_path):
+    manager = UploadManager(max_concurrency=2, max_jobs=2, chunk_size=1024, max_retries=0,
+                            state_dir=str(tmp_path / 'upload_jobs'))
+    # Cada video son 8 partes: unos 4 segundos de subida
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'\0' * 8 * 1024)
+    jobs = [f'video-{i}' for i in range(2)]
+    for job_id in jobs:
+        manager.submit(job_id, str(video), folder='prueba')
+
+    deadline = time.monotonic() + 5
+    while manager.stats()['active_jobs'] < 2:
+        assert time.monotonic() < deadline, 'Las subidas de video no empezaron'
+        time.sleep(0.01)
+
+    start = time.monotonic()
+    result = manager.upload(b'imagen', folder='prueba')
+    elapsed = time.monotonic() - start
+
+    assert result['secure_url']
+    # Sin límites separados la imagen esperaría a que terminen ambos videos
+    assert elapsed < 3 * LATENCY
+    assert all(manager.status(job_id)['status'] == 'uploading' for job_id in jobs)
+
+    for job_id in jobs:
+        assert manager.wait(job_id, timeout=30)['status'] == 'completed'
+
+
+def test_background_jobs_limited_to_max_jobs(services, tmp_path):
+    manager = UploadManager(max_concurrency=1, max_jobs=1, chunk_size=1024, max_retries=0,
+                            state_dir=str(tmp_path / 'upload_jobs'))
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'\0' * 2 * 1024)
+    manager.submit('primero', str(video), folder='prueba')
+    manager.submit('segundo', str(video), folder='prueba')
+
+    time.sleep(LATENCY)
+    assert manager.stats()['active_jobs'] == 1
+    assert manager.status('segundo')['status'] == 'pending'
+
+    for job_id in ('primero', 'segundo'):
+        assert manager.wait(job_id, timeout=30)['status'] == 'completed'
+
+
+def test_resume_pending_by_process_token(services, tmp_path):
+    manager = UploadManager(chunk_size=1024, max_retries=0, state_dir=str(tmp_path / 'upload_jobs'))
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'\0' * 2048)
+
+    finished = subprocess.Popen(['sleep', '30'])
+    finished_token = process_token(finished.pid)
+    finished.kill()
+    finished.wait()
+    owners = {
+        'en_curso': process_token(),
+        'terminado': finished_token,
+        # Mismo pid que un proceso vivo pero otro inicio: el pid se reutilizó tras un reinicio
+        'pid_reutilizado': process_token().rsplit(':', 1)[0] + ':0',
+    }
+    for job_id, owner in owners.items():
+        manager._save(job_id, {
+            'status': 'uploading', 'path': str(video), 'resource_type': 'video', 'options': {},
+            'upload_id': job_id, 'offset': 1024, 'public_id': None, 'attempts': 1, 'url': None,
+            'owner': owner
+        })
+
+    assert manager.resume_pending() == 2
+    for job_id in ('terminado', 'pid_reutilizado'):
+        state = manager.wait(job_id, timeout=30)
+        assert state['status'] == 'completed' and state['owner'] == process_token()
+    assert manager.status('en_curso')['owner'] == owners['en_curso']
+
+
+def test_cleanup_orphans_by_process_token(tmp_path):
+    storage = VideoStorage(input_folder=str(tmp_path / 'entrada'), output_folder=str(tmp_path / 'salida'),
+                           chunked_folder=str(tmp_path / 'entrada' / 'parciales'))
+    with storage.job('vivo'):
+        for name, owner in (('huerfano', process_token().rsplit(':', 1)[0] + ':0'), ('sin_dueno', None)):
+            os.makedirs(tmp_path / 'entrada' / name)
+            if owner:
+                (tmp_path / 'entrada' / name / OWNER_FILE).write_text(owner)
+
+        assert storage.cleanup_orphans() == 2
+        assert sorted(os.listdir(tmp_path / 'entrada')) == ['parciales', 'vivo']